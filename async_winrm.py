@@ -0,0 +1,509 @@
+import asyncio
+import re
+import struct
+import time
+import uuid
+from base64 import b64decode, b64encode
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree as ET
+from xml.sax.saxutils import escape
+
+import aiohttp
+import spnego
+from winrm.exceptions import WinRMError, WinRMTransportError, WinRMOperationTimeoutError
+
+from config import config
+from cache import result_cache
+from metrics import WINRM_CONNECT_SECONDS, WINRM_COMMAND_SECONDS, WINRM_REQUEST_SECONDS, WINRM_FAILURES
+from health import host_health
+from routes import Route, candidate_routes, default_route, route_cache
+from utils import split_host_port
+from winrm_client import ConnectFailed, OutputCallback, record_race_failure
+
+NS = {
+    's': 'http://www.w3.org/2003/05/soap-envelope',
+    'a': 'http://schemas.xmlsoap.org/ws/2004/08/addressing',
+    'w': 'http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd',
+    'p': 'http://schemas.microsoft.com/wbem/wsman/1/wsman.xsd',
+    'rsp': 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell',
+    'f': 'http://schemas.microsoft.com/wbem/wsman/1/wsmanfault',
+}
+
+SHELL_URI = 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd'
+ACTIONS = {
+    'Create': 'http://schemas.xmlsoap.org/ws/2004/09/transfer/Create',
+    'Delete': 'http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete',
+    'Command': 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command',
+    'Receive': 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive',
+    'Signal': 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal',
+}
+SIGNAL_TERMINATE = 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/signal/terminate'
+COMMAND_DONE = 'CommandState/Done'
+
+# WSManFault code for "no output within the operation timeout"
+FAULT_OPERATION_TIMEOUT = '2150858793'
+
+# HTTP message encryption for NTLM over plain HTTP ([MS-WSMV] 2.2.9.1.1)
+MIME_BOUNDARY = b'--Encrypted Boundary'
+ENCRYPTED_PROTOCOL = 'application/HTTP-SPNEGO-session-encrypted'
+ENCRYPTED_CONTENT_TYPE = f'multipart/encrypted;protocol="{ENCRYPTED_PROTOCOL}";boundary="Encrypted Boundary"'
+SOAP_CONTENT_TYPE = 'application/soap+xml;charset=UTF-8'
+
+# Default namespace declarations in CLIXML error output
+XMLNS = re.compile(rb'xmlns="[^"]*"')
+
+class AsyncWinRMClient:
+    """WinRM over aiohttp: one keep-alive connection and one remote shell, no threads"""
+
+    def __init__(self, host: str, username: str, password: str, port: int = None, transport: str = None,
+                 route: Route = None):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port or config.WINRM_PORT
+        # Use the given route or the one a connection race found for the host;
+        # open() races the candidates again without one
+        self.route = None
+        if transport:
+            default = default_route(self.port)
+            route = Route(default.port, default.scheme, transport)
+        route = route or route_cache.get(host)
+        if route:
+            self._use_route(route)
+        self.shell_id = None
+        self.is_connected = False
+        self.last_used = time.time()
+        # Exception the last command failed with, for the host health registry
+        self.last_error: Optional[Exception] = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._context = None
+        # A shell runs one command at a time
+        self._lock = asyncio.Lock()
+
+    def _use_route(self, route: Route):
+        self.route = route
+        self.transport = route.transport
+        self.endpoint = route.endpoint(self.host)
+        # pywinrm only seals messages when the channel isn't TLS
+        self._encrypt = self.transport == 'ntlm' and route.scheme == 'http'
+
+    async def open(self):
+        """Create the HTTP session; NTLM authenticates lazily on the first request.
+
+        With no route for the host (the cached one expired, or the bot
+        restarted), the candidate routes are raced and the winner's
+        authenticated connection and shell are kept; raises ConnectFailed if
+        none connects.
+        """
+        if self.route is None:
+            client, message = await async_race_connect(self.host, self.username, self.password, self.port)
+            if client is None:
+                raise ConnectFailed(message)
+            route_cache.put(self.host, client.route)
+            self._use_route(client.route)
+            self._http, self._context, self.shell_id = client._http, client._context, client.shell_id
+            self.is_connected = True
+            return
+        if self._http is None:
+            # NTLM authenticates the TCP connection, so every request must reuse one
+            connector = aiohttp.TCPConnector(limit=1, ssl=False)
+            self._http = aiohttp.ClientSession(
+                connector=connector,
+                # The server may hold a Receive for the operation timeout when there's no output
+                timeout=aiohttp.ClientTimeout(total=None, sock_read=config.WINRM_TIMEOUT + 10),
+            )
+
+    async def connect(self) -> Tuple[bool, str]:
+        """Connect to Windows server via WinRM"""
+        with WINRM_CONNECT_SECONDS.time():
+            success, message = await self._connect()
+        if not success:
+            WINRM_FAILURES.inc(stage='connect')
+        return success, message
+
+    async def _connect(self) -> Tuple[bool, str]:
+        try:
+            await self.open()
+            result = await self.run_cmd("whoami")
+            if result[2] == 0:
+                self.is_connected = True
+                return True, "Connection successful"
+            else:
+                return False, f"Connection test failed: {result[1]}"
+        except Exception as e:
+            return False, f"Connection error: {str(e)}"
+
+    async def run_cmd(self, command: str, on_output: OutputCallback = None) -> Tuple[str, str, int]:
+        """Execute command via CMD"""
+        try:
+            with WINRM_COMMAND_SECONDS.time(shell='cmd'):
+                stdout, stderr, status_code = await self._execute(command, on_output)
+            self.last_error = None
+            return (
+                stdout.decode('utf-8', errors='ignore'),
+                stderr.decode('utf-8', errors='ignore'),
+                status_code
+            )
+        except Exception as e:
+            WINRM_FAILURES.inc(stage='command')
+            self.last_error = e
+            return "", f"Command execution error: {str(e)}", 1
+
+    async def run_ps(self, command: str, on_output: OutputCallback = None) -> Tuple[str, str, int]:
+        """Execute PowerShell command"""
+        try:
+            encoded_ps = b64encode(command.encode('utf_16_le')).decode('ascii')
+            with WINRM_COMMAND_SECONDS.time(shell='ps'):
+                stdout, stderr, status_code = await self._execute(
+                    f"powershell -encodedcommand {encoded_ps}", on_output)
+            if stderr.startswith(b"#< CLIXML\r\n"):
+                stderr = clean_error_msg(stderr)
+            self.last_error = None
+            return (
+                stdout.decode('utf-8', errors='ignore'),
+                stderr.decode('utf-8', errors='ignore'),
+                status_code
+            )
+        except Exception as e:
+            WINRM_FAILURES.inc(stage='command')
+            self.last_error = e
+            return "", f"PowerShell execution error: {str(e)}", 1
+
+    async def is_alive(self) -> bool:
+        """Health check: run a no-op on the existing shell"""
+        return (await self.run_cmd("rem"))[2] == 0
+
+    async def close(self):
+        """Delete the remote shell and drop the connection"""
+        async with self._lock:
+            await self._close_shell()
+            if self._http is not None:
+                await self._http.close()
+                self._http = None
+                self._context = None
+
+    async def _execute(self, command: str, on_output: OutputCallback = None) -> Tuple[bytes, bytes, int]:
+        """Run a command in the open shell, reopening it once if the server dropped it"""
+        async with self._lock:
+            self.last_used = time.time()
+            await self.open()
+            try:
+                command_id = await self._start(await self._ensure_shell(), command)
+            except (WinRMError, WinRMTransportError):
+                # Shell expired or was closed remotely; the command never started
+                self.shell_id = None
+                command_id = await self._start(await self._ensure_shell(), command)
+
+            failed = False
+            try:
+                return await self._receive(command_id, on_output)
+            except BaseException:
+                # Includes cancellation, e.g. by asyncio.wait_for on a deadline
+                failed = True
+                raise
+            finally:
+                try:
+                    # Signal/terminate: stops the process if it is still running
+                    await self._signal(command_id)
+                except Exception:
+                    failed = True
+                if failed:
+                    # Don't reuse a shell whose state we no longer know
+                    await self._close_shell()
+
+    async def _start(self, shell_id: str, command: str) -> str:
+        body = f'<rsp:CommandLine><rsp:Command>{escape(command)}</rsp:Command></rsp:CommandLine>'
+        options = {'WINRS_CONSOLEMODE_STDIN': 'TRUE', 'WINRS_SKIP_CMD_SHELL': 'FALSE'}
+        root = await self._request('Command', body, shell_id, options)
+        return root.findtext('s:Body/rsp:CommandResponse/rsp:CommandId', '', NS)
+
+    async def _receive(self, command_id: str, on_output: OutputCallback = None) -> Tuple[bytes, bytes, int]:
+        """Poll the Receive operation, passing each chunk to on_output as it arrives"""
+        body = (f'<rsp:Receive><rsp:DesiredStream CommandId="{command_id}">stdout stderr'
+                f'</rsp:DesiredStream></rsp:Receive>')
+        stdout, stderr = [], []
+        while True:
+            try:
+                root = await self._request('Receive', body, self.shell_id)
+            except WinRMOperationTimeoutError:
+                # Nothing new within the operation timeout; keep polling
+                continue
+            out, err = [], []
+            for stream in root.iterfind('.//rsp:Stream', NS):
+                if stream.text:
+                    (out if stream.get('Name') == 'stdout' else err).append(b64decode(stream.text))
+            out, err = b''.join(out), b''.join(err)
+            stdout.append(out)
+            stderr.append(err)
+            if on_output and (out or err):
+                on_output(out, err)
+            state = root.find('.//rsp:CommandState', NS)
+            if state is not None and state.get('State', '').endswith(COMMAND_DONE):
+                exit_code = int(state.findtext('rsp:ExitCode', '0', NS))
+                return b''.join(stdout), b''.join(stderr), exit_code
+
+    async def _signal(self, command_id: str):
+        body = f'<rsp:Signal CommandId="{command_id}"><rsp:Code>{SIGNAL_TERMINATE}</rsp:Code></rsp:Signal>'
+        await self._request('Signal', body, self.shell_id)
+
+    async def _ensure_shell(self) -> str:
+        if not self.shell_id:
+            body = (
+                '<rsp:Shell><rsp:InputStreams>stdin</rsp:InputStreams>'
+                '<rsp:OutputStreams>stdout stderr</rsp:OutputStreams>'
+                f'<rsp:IdleTimeOut>PT{config.SESSION_TTL}S</rsp:IdleTimeOut></rsp:Shell>'
+            )
+            options = {'WINRS_NOPROFILE': 'FALSE', 'WINRS_CODEPAGE': '437'}
+            root = await self._request('Create', body, options=options)
+            self.shell_id = root.findtext(".//w:Selector[@Name='ShellId']", '', NS)
+        return self.shell_id
+
+    async def _close_shell(self):
+        shell_id, self.shell_id = self.shell_id, None
+        if shell_id and self._http is not None:
+            try:
+                await self._request('Delete', '', shell_id)
+            except Exception:
+                pass
+
+    async def _request(self, action: str, body: str, shell_id: str = None,
+                       options: Dict[str, str] = None) -> ET.Element:
+        """Send one SOAP message and return the parsed response envelope"""
+        envelope = self._envelope(action, body, shell_id, options).encode('utf-8')
+        with WINRM_REQUEST_SECONDS.time(op=action.lower()):
+            status, content = await self._post(envelope)
+            if status == 401 and self.transport == 'ntlm' and self._context is not None:
+                # The keep-alive connection was dropped; authenticate the new one
+                self._context = None
+                status, content = await self._post(envelope)
+        if status == 401:
+            raise WinRMTransportError('http', status, 'Unauthorized: check the username and password')
+        if status != 200:
+            self._raise_fault(status, content)
+        return ET.fromstring(content)
+
+    async def _post(self, envelope: bytes) -> Tuple[int, bytes]:
+        headers = {}
+        data = envelope
+        if self.transport == 'basic':
+            headers['Authorization'] = aiohttp.BasicAuth(self.username, self.password).encode()
+        elif self._context is None:
+            await self._authenticate()
+        if self._encrypt:
+            data = self._seal(envelope)
+            headers['Content-Type'] = ENCRYPTED_CONTENT_TYPE
+        else:
+            headers['Content-Type'] = SOAP_CONTENT_TYPE
+        async with self._http.post(self.endpoint, data=data, headers=headers) as response:
+            content = await response.read()
+            if self._encrypt and ENCRYPTED_PROTOCOL in response.headers.get('Content-Type', ''):
+                content = self._unseal(content)
+            return response.status, content
+
+    async def _authenticate(self):
+        """NTLM handshake on the keep-alive connection; later requests ride on it"""
+        context = spnego.client(self.username, self.password, hostname=self.host,
+                                service='http', protocol='ntlm')
+        token = context.step()
+        while token:
+            headers = {'Authorization': f"Negotiate {b64encode(token).decode('ascii')}",
+                       'Content-Type': SOAP_CONTENT_TYPE}
+            async with self._http.post(self.endpoint, data=b'', headers=headers) as response:
+                await response.read()
+                challenge = response.headers.get('WWW-Authenticate', '')
+                status = response.status
+            if context.complete:
+                break
+            if not challenge.startswith('Negotiate '):
+                raise WinRMTransportError('http', status, 'Server did not offer NTLM authentication')
+            token = context.step(b64decode(challenge.split(' ', 1)[1]))
+        if status == 401:
+            raise WinRMTransportError('http', status, 'Unauthorized: check the username and password')
+        self._context = context
+
+    def _seal(self, message: bytes) -> bytes:
+        wrapped = self._context.wrap_winrm(message)
+        stream = struct.pack('<i', len(wrapped.header)) + wrapped.header + wrapped.data
+        return (
+            MIME_BOUNDARY + b'\r\n'
+            b'\tContent-Type: ' + ENCRYPTED_PROTOCOL.encode() + b'\r\n'
+            b'\tOriginalContent: type=application/soap+xml;charset=UTF-8;Length='
+            + str(len(message)).encode() + b'\r\n'
+            + MIME_BOUNDARY + b'\r\n'
+            b'\tContent-Type: application/octet-stream\r\n' + stream
+            + MIME_BOUNDARY + b'--\r\n'
+        )
+
+    def _unseal(self, content: bytes) -> bytes:
+        parts = [part for part in content.split(MIME_BOUNDARY + b'\r\n') if part]
+        message = b''
+        for header, payload in zip(parts[0::2], parts[1::2]):
+            expected = int(header.strip().split(b'Length=')[1])
+            if payload.endswith(MIME_BOUNDARY + b'--\r\n'):
+                payload = payload[:-len(MIME_BOUNDARY + b'--\r\n')]
+            stream = payload.replace(b'\tContent-Type: application/octet-stream\r\n', b'')
+            length = struct.unpack('<i', stream[:4])[0]
+            decrypted = self._context.unwrap_winrm(stream[4:4 + length], stream[4 + length:])
+            if len(decrypted) != expected:
+                raise WinRMError("Encrypted length from server does not match the expected size")
+            message += decrypted
+        return message
+
+    def _envelope(self, action: str, body: str, shell_id: str = None, options: Dict[str, str] = None) -> str:
+        selector = (f'<w:SelectorSet><w:Selector Name="ShellId">{shell_id}</w:Selector></w:SelectorSet>'
+                    if shell_id else '')
+        option_set = ''
+        if options:
+            option_set = '<w:OptionSet>' + ''.join(
+                f'<w:Option Name="{name}">{value}</w:Option>' for name, value in options.items()
+            ) + '</w:OptionSet>'
+        return (
+            f'<s:Envelope xmlns:s="{NS["s"]}" xmlns:a="{NS["a"]}" xmlns:w="{NS["w"]}" '
+            f'xmlns:p="{NS["p"]}" xmlns:rsp="{NS["rsp"]}"><s:Header>'
+            f'<a:To>{self.endpoint}</a:To>'
+            '<a:ReplyTo><a:Address s:mustUnderstand="true">'
+            'http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:Address></a:ReplyTo>'
+            '<w:MaxEnvelopeSize s:mustUnderstand="true">153600</w:MaxEnvelopeSize>'
+            f'<a:MessageID>uuid:{str(uuid.uuid4()).upper()}</a:MessageID>'
+            '<w:Locale xml:lang="en-US" s:mustUnderstand="false"/>'
+            '<p:DataLocale xml:lang="en-US" s:mustUnderstand="false"/>'
+            f'<w:OperationTimeout>PT{config.WINRM_TIMEOUT}S</w:OperationTimeout>'
+            f'<w:ResourceURI s:mustUnderstand="true">{SHELL_URI}</w:ResourceURI>'
+            f'<a:Action s:mustUnderstand="true">{ACTIONS[action]}</a:Action>'
+            f'{selector}{option_set}</s:Header><s:Body>{body}</s:Body></s:Envelope>'
+        )
+
+    def _raise_fault(self, status: int, content: bytes):
+        try:
+            root = ET.fromstring(content)
+        except ET.ParseError:
+            raise WinRMTransportError('http', status, content.decode('utf-8', errors='ignore'))
+        fault = root.find('.//f:WSManFault', NS)
+        code = fault.get('Code') if fault is not None else None
+        if code == FAULT_OPERATION_TIMEOUT:
+            raise WinRMOperationTimeoutError()
+        reason = root.findtext('.//s:Reason/s:Text', '', NS) or f"HTTP {status}"
+        raise WinRMError(f"{reason.strip()} (WSManFault {code})" if code else reason.strip())
+
+def clean_error_msg(stderr: bytes) -> bytes:
+    """Turn PowerShell's CLIXML error stream into plain text, as winrm.Session.run_ps does"""
+    try:
+        root = ET.fromstring(XMLNS.sub(b'', stderr[len(b"#< CLIXML\r\n"):]))
+    except ET.ParseError:
+        return stderr
+    message = "".join(s.text.replace("_x000D__x000A_", "\n") for s in root.findall('./S') if s.text)
+    return message.strip().encode('utf-8') if message else stderr
+
+class AsyncWinRMPool:
+    """Idle AsyncWinRMClients keyed by (host, port, username), reused across commands"""
+
+    def __init__(self, max_idle: int = None, idle_ttl: int = None):
+        self.max_idle = max_idle or config.WINRM_POOL_SIZE
+        self.idle_ttl = idle_ttl or config.SESSION_TTL
+        self._idle: Dict[Tuple[str, int, str], List[AsyncWinRMClient]] = {}
+
+    async def acquire(self, host: str, username: str, password: str, port: int) -> AsyncWinRMClient:
+        """Reuse an idle client for this login, or open a new one"""
+        clients = self._idle.get((host, port, username), [])
+        while clients:
+            client = clients.pop()
+            if client.password == password and time.time() - client.last_used < self.idle_ttl:
+                return client
+            await client.close()
+        client = AsyncWinRMClient(host, username, password, port)
+        await client.open()
+        return client
+
+    async def release(self, client: AsyncWinRMClient, discard: bool = False):
+        """Return a client for reuse, closing it if broken or the pool is full"""
+        if discard or sum(len(c) for c in self._idle.values()) >= self.max_idle:
+            await client.close()
+            return
+        self._idle.setdefault((client.host, client.port, client.username), []).append(client)
+
+    async def close_all(self):
+        """Close every idle client"""
+        idle, self._idle = self._idle, {}
+        await asyncio.gather(*(client.close() for clients in idle.values() for client in clients),
+                             return_exceptions=True)
+
+# Global pool of async clients, used instead of the thread pool when WINRM_ASYNC is set
+async_winrm_pool = AsyncWinRMPool()
+
+async def async_race_connect(host: str, username: str, password: str, port: int = None,
+                             routes: List[Route] = None,
+                             delay: float = None) -> Tuple[Optional[AsyncWinRMClient], str]:
+    """Connect over whichever candidate route works first, like winrm_client.race_connect.
+
+    Attempts start `delay` seconds apart, or at once when every earlier one
+    has failed; attempts still in flight when one wins are cancelled.
+    Returns (client, message), or (None, every route's error) if none worked.
+    """
+    routes = routes or candidate_routes(port)
+    delay = config.WINRM_RACE_DELAY if delay is None else delay
+    loop = asyncio.get_running_loop()
+    attempts: Dict[asyncio.Future, AsyncWinRMClient] = {}
+    errors, failures = [], []
+    started = 0
+    next_start = loop.time()
+    try:
+        while started < len(routes) or attempts:
+            if started < len(routes) and (not attempts or loop.time() >= next_start):
+                client = AsyncWinRMClient(host, username, password, port, route=routes[started])
+                attempts[asyncio.ensure_future(client.connect())] = client
+                started += 1
+                next_start = loop.time() + delay
+            timeout = max(0.0, next_start - loop.time()) if started < len(routes) else None
+            done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                client = attempts.pop(task)
+                success, message = task.result()
+                if success:
+                    host_health.record_success(host)
+                    return client, f"{message} via {client.route}"
+                errors.append(f"{client.route}: {message}")
+                failures.append(client.last_error)
+                await client.close()
+    finally:
+        for task in attempts:
+            task.cancel()
+        if attempts:
+            await asyncio.gather(*attempts, return_exceptions=True)
+            await asyncio.gather(*(client.close() for client in attempts.values()), return_exceptions=True)
+    record_race_failure(host, username, password, failures)
+    return None, "; ".join(errors)
+
+async def async_test_connection(host: str, username: str, password: str, port: int = None) -> Tuple[bool, str]:
+    """Test WinRM connection without a worker thread; raises HostDown if the host's circuit is open"""
+    host, port = split_host_port(host, port)
+    rejected = host_health.rejected_login(host, username, password)
+    if rejected:
+        return False, rejected
+    host_health.guard(host)
+    try:
+        client = await async_winrm_pool.acquire(host, username, password, port)
+    except ConnectFailed as e:
+        return False, str(e)
+    success, message = await client.connect()
+    host_health.record_error(host, client.last_error, username, password)
+    await async_winrm_pool.release(client, discard=not success)
+    return success, message
+
+async def async_run_command(host: str, username: str, password: str, port: int, command: str,
+                            powershell: bool = False, on_output: OutputCallback = None) -> Tuple[str, str, int]:
+    """Run a command on a pooled async client; raises HostDown if the host's circuit is open"""
+    host, port = split_host_port(host, port)
+    host_health.guard(host)
+    result_cache.invalidate_if_mutating(f"{host}:{port}", command)
+    client = await async_winrm_pool.acquire(host, username, password, port)
+    discard = True
+    try:
+        if powershell:
+            result = await client.run_ps(command, on_output)
+        else:
+            result = await client.run_cmd(command, on_output)
+        host_health.record_error(host, client.last_error)
+        discard = client.shell_id is None
+        return result
+    finally:
+        await async_winrm_pool.release(client, discard=discard)
@@ -0,0 +1,214 @@
+"""Benchmark: simulated users driving the bot's handlers end to end.
+
+Starts the fake WinRM server and the fake Bot API (fake_telegram.py) in a
+separate process, builds the real Application against them and feeds it
+updates as if they came from Telegram. Each simulated user pastes credentials,
+runs /connect, a few /run commands and /status, for several rounds; each step
+is timed from handing the update to the Application until its handler has
+sent its last reply. The servers live in their own process so their threads
+don't compete with the bot for the GIL or count towards its memory.
+
+    python benchmarks/bench_bot.py [--users 50] [--rounds 3] [--winrm-latency 0.02] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+USERNAME, PASSWORD = 'administrator', 'password'
+FIRST_USER_ID = 100000
+STEPS = ('paste', 'connect', 'run', 'status')
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def serve_fakes(args, ready, stop):
+    """Child process: run both fake servers until told to stop, then report their counters"""
+    from fake_telegram import FakeTelegramServer
+    from fake_winrm import FakeWinRMServer
+
+    # 0.0.0.0 so every 127.0.0.x "host" reaches the same fake WinRM server
+    winrm = FakeWinRMServer('0.0.0.0', 0, args.winrm_latency, args.output_bytes, args.chunks,
+                            USERNAME, PASSWORD).start()
+    telegram = FakeTelegramServer('127.0.0.1', 0, args.telegram_latency).start()
+    ready.put((winrm.port, telegram.base_url))
+    stop.wait()
+    ready.put({
+        'winrm_requests': winrm.requests,
+        'bot_api_calls': dict(telegram.calls),
+        'error_replies': sum(text.startswith('❌') for _, text in telegram.messages),
+    })
+    winrm.stop()
+    telegram.stop()
+
+class Users:
+    """Builds Telegram updates for the simulated users"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.update_id = 0
+
+    def update(self, user_id: int, text: str):
+        from telegram import Update
+
+        self.update_id += 1
+        command = text.split()[0] if text.startswith('/') else None
+        message = {
+            'message_id': self.update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        }
+        if command:
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return Update.de_json({'update_id': self.update_id, 'message': message}, self.bot)
+
+async def drive(application, users: int, rounds: int, runs: int, winrm_port: int, command: str):
+    """Run every simulated user's script concurrently; returns (latencies per step, wall time)"""
+    factory = Users(application.bot)
+    latencies = {step: [] for step in STEPS}
+
+    async def step(name: str, user_id: int, text: str):
+        started = time.perf_counter()
+        # Returns once the handler has finished, replies included
+        await application.process_update(factory.update(user_id, text))
+        latencies[name].append(time.perf_counter() - started)
+
+    async def user(index: int):
+        user_id = FIRST_USER_ID + index
+        host = f"127.0.0.{index % 254 + 1}"
+        for _ in range(rounds):
+            await step('paste', user_id, f"IP: {host}:{winrm_port} User: {USERNAME} Pass: {PASSWORD}")
+            await step('connect', user_id, f"/connect {host} {USERNAME} {PASSWORD} {winrm_port}")
+            for _ in range(runs):
+                await step('run', user_id, f"/run {command}")
+            await step('status', user_id, "/status")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(index) for index in range(users)))
+    return latencies, time.perf_counter() - started
+
+async def bench(args, winrm_port: int):
+    import main
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(repr(context.error))
+
+    application = main.build_application(polling=False)
+    application.add_error_handler(on_error)
+    async with application:
+        latencies, wall = await drive(application, args.users, args.rounds, args.runs, winrm_port, args.command)
+    await main.close_async_clients(application)
+    main.release_resources()
+    return latencies, wall, errors
+
+def summarize(latencies, wall):
+    steps = {}
+    for name, values in latencies.items():
+        if values:
+            steps[name] = {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+                'mean_ms': round(statistics.mean(values) * 1000, 2),
+                'max_ms': round(max(values) * 1000, 2),
+            }
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'updates': total,
+        'wall_s': round(wall, 3),
+        'updates_per_s': round(total / wall, 1),
+        'steps': steps,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help="simulated users, each on its own 127.0.0.x host")
+    parser.add_argument('--rounds', type=int, default=3, help="paste/connect/run/status cycles per user")
+    parser.add_argument('--runs', type=int, default=5, help="/run commands per round")
+    parser.add_argument('--command', default='dir')
+    parser.add_argument('--winrm-latency', type=float, default=0.02, help="seconds the fake WinRM server adds per request")
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help="seconds the fake Bot API adds per call")
+    parser.add_argument('--chat-rate', type=float, default=None,
+                        help="TELEGRAM_CHAT_RATE for the run; raise it to measure handlers without per-chat throttling")
+    parser.add_argument('--output-bytes', type=int, default=2048)
+    parser.add_argument('--chunks', type=int, default=1, help="Receive round trips per command")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    ready, stop = context.Queue(), context.Event()
+    servers = context.Process(target=serve_fakes, args=(args, ready, stop), daemon=True)
+    servers.start()
+    winrm_port, api_url = ready.get(timeout=30)
+
+    # Configure before the bot's modules read config
+    os.environ.update({
+        'BOT_TOKEN': '123456:benchmark',
+        'BOT_API_URL': api_url,
+        'ALLOWED_USER_IDS': ','.join(str(FIRST_USER_ID + i) for i in range(args.users)),
+        'WINRM_TRANSPORT': 'basic',
+        'SESSION_BACKEND': 'memory',
+        'METRICS_PORT': '0',
+        'DELETE_CREDENTIAL_MESSAGES': 'true',
+    })
+    if args.chat_rate:
+        os.environ['TELEGRAM_CHAT_RATE'] = str(args.chat_rate)
+    # Configured before main is imported, so main's INFO basicConfig is a no-op
+    logging.basicConfig(level=logging.WARNING)
+
+    rss_before = peak_rss_mb()
+    try:
+        latencies, wall, errors = asyncio.run(bench(args, winrm_port))
+    finally:
+        stop.set()
+        servers_report = ready.get(timeout=30)
+        servers.join(timeout=10)
+
+    result = summarize(latencies, wall)
+    result.update({
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_before_load_mb': rss_before,
+        'handler_errors': len(errors),
+        **servers_report,
+    })
+
+    print(f"{args.users} users x {args.rounds} rounds ({args.runs} runs each), "
+          f"WinRM +{args.winrm_latency * 1000:.0f} ms, Bot API +{args.telegram_latency * 1000:.0f} ms\n")
+    for name, s in result['steps'].items():
+        print(f"{name:<8} n={s['count']:<5} p50 {s['p50_ms']:>8.1f} ms  p95 {s['p95_ms']:>8.1f} ms  "
+              f"p99 {s['p99_ms']:>8.1f} ms  max {s['max_ms']:>8.1f} ms")
+    print(f"\n{result['updates']} updates in {result['wall_s']:.2f}s ({result['updates_per_s']:.1f}/s), "
+          f"peak RSS {result['peak_rss_mb']:.1f} MB (before load {rss_before:.1f} MB), "
+          f"{result['handler_errors']} handler errors, {result['error_replies']} error replies")
+    for error in errors[:5]:
+        print(f"  {error}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'bot', 'args': vars(args), 'results': result}, f, indent=2)
+
+    sys.exit(1 if errors or result['error_replies'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark: raw command output vs output gzipped on the server (compression.py).
+
+Starts the fake WinRM server from fake_winrm.py, throttled to a slow link,
+with a handler that prints log-like text of a requested size and answers the
+compression wrapper the way the real script does (gzip, base64 lines). Runs
+the same commands through winrm_client.run_command with compress off and on
+and reports bytes on the wire and end-to-end latency for each size.
+
+    python benchmarks/bench_compression.py [--sizes 16384,262144,2097152] [--latency 0.05]
+        [--bandwidth 1250000] [--repeat 3] [--json out.json]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('WINRM_TRANSPORT', 'basic')
+
+from compression import LINE_BYTES  # noqa: E402
+from winrm_client import run_command  # noqa: E402
+from fake_winrm import FakeWinRMServer  # noqa: E402
+
+USERNAME, PASSWORD = 'administrator', 'password'
+
+SERVICES = ['Windows Update', 'Print Spooler', 'WinHTTP Web Proxy Auto-Discovery Service', 'Windows Defender',
+            'Background Intelligent Transfer Service', 'Microsoft Software Shadow Copy Provider', 'W3SVC']
+STATES = ['running', 'stopped']
+
+def log_text(size: int) -> bytes:
+    """Event-log-like lines totalling size bytes; same size, same text"""
+    rng = random.Random(size)
+    lines, total = [], 0
+    while total < size:
+        line = (f"2024-03-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                f"{rng.randint(0, 59):02d} Information Service Control Manager 7036 "
+                f"The {rng.choice(SERVICES)} service entered the {rng.choice(STATES)} state. "
+                f"PID {rng.randint(400, 9000)}\r\n").encode()
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)[:size]
+
+def handle(command: str, arguments: str, stdin: bytes = b""):
+    """`type <N>.log` prints N bytes; the compression wrapper returns them gzipped"""
+    if command.startswith('powershell -encodedcommand '):
+        script = base64.b64decode(command.split()[-1]).decode('utf_16_le')
+        if 'GZipStream' not in script:
+            return b"", b"unexpected script", 1
+        inner = re.search(r"^\$arguments = '/c ' \+ '((?:[^']|'')*)'$", script, re.M).group(1).replace("''", "'")
+        stdout, stderr, exit_code = handle(inner, "")
+        packed = gzip.compress(stdout, compresslevel=6)
+        lines = [base64.b64encode(packed[i:i + LINE_BYTES]) for i in range(0, len(packed), LINE_BYTES)]
+        return b"".join(line + b"\r\n" for line in lines), stderr, exit_code
+    match = re.fullmatch(r'type \S*?(\d+)\.log', command.strip())
+    if not match:
+        return b"", b"The system cannot find the file specified.", 1
+    return log_text(int(match.group(1))), b"", 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='16384,262144,2097152,8388608', help="output sizes in bytes")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds the fake server adds per request")
+    parser.add_argument('--bandwidth', type=float, default=1250000, help="bytes per second (default 10 Mbit/s)")
+    parser.add_argument('--max-receive', type=int, default=384 * 1024,
+                        help="most stdout bytes per Receive, as MaxEnvelopeSizekb would allow")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    server = FakeWinRMServer('127.0.0.1', 0, args.latency, username=USERNAME, password=PASSWORD, handler=handle,
+                             bandwidth=args.bandwidth, max_receive=args.max_receive).start()
+    results, failures = [], []
+    try:
+        # Open the pooled shell before timing anything
+        run_command('127.0.0.1', USERNAME, PASSWORD, server.port, 'type 1.log', compress=False)
+        for size in [int(s) for s in args.sizes.split(',')]:
+            expected = log_text(size).decode()
+            for compress in (False, True):
+                latencies, wire = [], []
+                for _ in range(args.repeat):
+                    before = server.bytes_out
+                    started = time.perf_counter()
+                    stdout, stderr, exit_code = run_command('127.0.0.1', USERNAME, PASSWORD, server.port,
+                                                            f'type C:\\Logs\\{size}.log', compress=compress)
+                    latencies.append(time.perf_counter() - started)
+                    wire.append(server.bytes_out - before)
+                    if stdout != expected or exit_code != 0:
+                        failures.append(f"{size} bytes, compress={compress}: output differs ({stderr[:100]!r})")
+                results.append({
+                    'size': size,
+                    'mode': 'gzip' if compress else 'raw',
+                    'wire_bytes': int(statistics.median(wire)),
+                    'latency_ms': round(statistics.median(latencies) * 1000, 1),
+                })
+    finally:
+        server.stop()
+
+    print(f"{args.latency * 1000:.0f} ms per request, {args.bandwidth / 1e6 * 8:.1f} Mbit/s, "
+          f"{args.max_receive // 1024} KiB per Receive, median of {args.repeat}\n")
+    print(f"{'output':>10}  {'mode':<5} {'wire bytes':>12} {'latency':>10}")
+    for r in results:
+        print(f"{r['size']:>10,}  {r['mode']:<5} {r['wire_bytes']:>12,} {r['latency_ms']:>8.1f}ms")
+    for raw, packed in zip(results[::2], results[1::2]):
+        print(f"{raw['size']:>10,}  gzip sends {packed['wire_bytes'] / raw['wire_bytes']:.0%} of the bytes, "
+              f"takes {packed['latency_ms'] / raw['latency_ms']:.0%} of the time")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'compression', 'args': vars(args), 'results': results,
+                       'failures': failures}, f, indent=2)
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Micro-benchmark for the credential extractor.
+
+Runs extractor.extract over a corpus of dump formats seen in the wild, checks
+each result, and reports per-message timings so regressions stand out.
+
+    python benchmarks/bench_extractor.py [--repeat N] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor import extractor  # noqa: E402
+
+# (name, message, expected (host, username, password) or None)
+CORPUS = [
+    ("labels_inline", "IP: 192.168.1.10 User: admin Pass: P@ssw0rd!",
+     ("192.168.1.10", "admin", "P@ssw0rd!")),
+    ("labels_lines", "Server: 10.0.0.5:5985\nUsername: Administrator\nPassword: Winter2024#",
+     ("10.0.0.5:5985", "Administrator", "Winter2024#")),
+    ("labels_reordered", "Username - svc_backup, Password - Qwerty-123, Host - 172.16.4.20",
+     ("172.16.4.20", "svc_backup", "Qwerty-123")),
+    ("labels_chinese", "地址：45.77.12.9 用户名：administrator 密码：Zx9$kLm2",
+     ("45.77.12.9", "administrator", "Zx9$kLm2")),
+    ("provider_mail",
+     "Your VPS is ready!\n\nHostname: win-2291\nIP Address: 203.0.113.44\n"
+     "Login: Administrator\nPassword: hT7#pq2Lz\n\nRDP port 3389. Thanks for choosing us.",
+     ("203.0.113.44", "Administrator", "hT7#pq2Lz")),
+    ("arrows", "198.51.100.7 ➡️ admin ➡️ s3cr3t", ("198.51.100.7", "admin", "s3cr3t")),
+    ("bullets", "🔹 198.51.100.8 • root • toor", ("198.51.100.8", "root", "toor")),
+    ("dashes", "198.51.100.9 - administrator - Pa-ss-123", ("198.51.100.9", "administrator", "Pa-ss-123")),
+    ("colon_triplet", "198.51.100.10:5985 Administrator Hunter2", ("198.51.100.10:5985", "Administrator", "Hunter2")),
+    ("surrounding", "admin 10.1.1.1 hunter2", ("10.1.1.1", "admin", "hunter2")),
+    ("chatter_no_ip", "hey can you restart the IIS app pool on the web box when you get a sec? thanks", None),
+    ("long_chatter_no_ip", "lorem ipsum dolor sit amet " * 40, None),
+    ("ip_only", "ping 8.8.8.8", None),
+]
+
+def run(repeat: int):
+    results = []
+    failures = 0
+    for name, message, expected in CORPUS:
+        got = extractor.extract(message)
+        got = (got['host'], got['username'], got['password']) if got else None
+        ok = got == expected
+        failures += not ok
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            extractor.extract(message)
+        per_call_us = (time.perf_counter() - start) / repeat * 1e6
+
+        results.append({'name': name, 'ok': ok, 'got': got, 'us_per_call': round(per_call_us, 2)})
+    return results, failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    results, failures = run(args.repeat)
+    width = max(len(r['name']) for r in results)
+    for r in results:
+        mark = "ok  " if r['ok'] else "FAIL"
+        print(f"{mark} {r['name']:<{width}} {r['us_per_call']:>9.2f} us/call  {r['got']}")
+    total = sum(r['us_per_call'] for r in results)
+    print(f"\n{len(results)} messages, {failures} failures, {total:.2f} us for one pass over the corpus")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'extractor', 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
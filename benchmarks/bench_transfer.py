@@ -0,0 +1,170 @@
+"""Benchmark: /download and /upload of a large file through transfer.py.
+
+Starts the fake WinRM server from fake_winrm.py with a handler that keeps
+"remote" files in memory and answers the transfer scripts (stat, read chunk,
+write chunk, finish). Times a download and an upload of the same file, checks
+both round-trip byte for byte, then interrupts an upload part way and checks
+that repeating it only sends the missing chunks.
+
+    python benchmarks/bench_transfer.py [--mb 50] [--latency 0.02] [--parallel 4] [--json out.json]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('WINRM_TRANSPORT', 'basic')
+os.environ['TRANSFER_DIR'] = tempfile.mkdtemp(prefix='bench_transfer_')
+
+from config import config  # noqa: E402
+from transfer import TransferError, TransferManager  # noqa: E402
+from fake_winrm import FakeWinRMServer  # noqa: E402
+
+USERNAME, PASSWORD = 'administrator', 'password'
+
+class FakeFiles:
+    """In-memory remote filesystem answering transfer.py's PowerShell scripts"""
+
+    def __init__(self):
+        self.files = {}
+        self.writes = 0
+        # Offsets whose writes fail, to interrupt an upload
+        self.failing = set()
+
+    def handle(self, command: str, arguments: str, stdin: bytes = b""):
+        if not command.startswith('powershell -encodedcommand '):
+            return b"", b"not a transfer script", 1
+        script = base64.b64decode(command.split()[-1]).decode('utf_16_le')
+        path = re.search(r"^\$path = '((?:[^']|'')*)'$", script, re.M).group(1).replace("''", "'")
+        offset = int(re.search(r"^\$offset = (\d+)$", script, re.M).group(1))
+        length = int(re.search(r"^\$length = (\d+)$", script, re.M).group(1))
+
+        if 'FromBase64String' in script:
+            if offset in self.failing:
+                return b"", b"The network path was not found.", 1
+            data = base64.b64decode(stdin)
+            target = self.files.setdefault(path, bytearray())
+            if len(target) < offset + len(data):
+                target.extend(b"\0" * (offset + len(data) - len(target)))
+            target[offset:offset + len(data)] = data
+            self.writes += 1
+            return str(len(data)).encode(), b"", 0
+        if 'Move-Item' in script:
+            target = self.files.setdefault(path, bytearray())
+            del target[length:]
+            digest = hashlib.sha256(target).hexdigest().upper()
+            expected = re.search(r"-eq '([0-9A-F]+)'", script).group(1)
+            destination = re.search(r"-Destination '((?:[^']|'')*)'", script).group(1).replace("''", "'")
+            if digest == expected:
+                self.files[destination] = self.files.pop(path)
+            return digest.encode(), b"", 0
+        data = self.files.get(path)
+        if data is None:
+            return b"", f"Cannot find path '{path}' because it does not exist.".encode(), 1
+        if 'ToBase64String' in script:
+            return base64.b64encode(bytes(data[offset:offset + length])), b"", 0
+        limit = int(re.search(r"^\$limit = (-?\d+)$", script, re.M).group(1))
+        if 0 <= limit < len(data):
+            return f"{len(data)} 638000000000000000 -".encode(), b"", 0
+        return f"{len(data)} 638000000000000000 {hashlib.sha256(data).hexdigest().upper()}".encode(), b"", 0
+
+async def run(args, server: FakeWinRMServer, files: FakeFiles):
+    manager = TransferManager(args.chunk_kb * 1024, args.parallel)
+    session = SimpleNamespace(host='127.0.0.1', port=server.port, username=USERNAME, password=PASSWORD,
+                              address=f"127.0.0.1:{server.port}")
+    source = os.urandom(args.mb * 1024 * 1024)
+    files.files['C:\\Logs\\big.log'] = bytearray(source)
+    results, failures = {}, []
+
+    started = time.perf_counter()
+    state = await manager.download(1, session, 'C:\\Logs\\big.log')
+    results['download_s'] = round(time.perf_counter() - started, 2)
+    with open(state.data_path, 'rb') as f:
+        if f.read() != source:
+            failures.append("downloaded file differs")
+    state.discard()
+
+    async def fetch(path):
+        with open(path, 'wb') as f:
+            f.write(source)
+
+    started = time.perf_counter()
+    await manager.upload(1, session, 'C:\\Temp\\copy.log', 'file-1', fetch)
+    results['upload_s'] = round(time.perf_counter() - started, 2)
+    if bytes(files.files.get('C:\\Temp\\copy.log', b"")) != source:
+        failures.append("uploaded file differs")
+
+    # Interrupt an upload at its last chunk, then resume it
+    files.failing.add((len(source) - 1) // manager.chunk_size * manager.chunk_size)
+    try:
+        await manager.upload(1, session, 'C:\\Temp\\resumed.log', 'file-2', fetch)
+        failures.append("interrupted upload did not fail")
+    except TransferError:
+        pass
+    files.failing.clear()
+    files.writes = 0
+    await manager.upload(1, session, 'C:\\Temp\\resumed.log', 'file-2', fetch)
+    results['resumed_chunks_sent'] = files.writes
+    if bytes(files.files.get('C:\\Temp\\resumed.log', b"")) != source:
+        failures.append("resumed upload differs")
+    if files.writes != 1:
+        failures.append(f"resume sent {files.writes} chunks instead of 1")
+
+    # Files over TRANSFER_MAX_BYTES are refused before the server hashes them
+    files.files['C:\\Logs\\huge.log'] = bytearray(config.TRANSFER_MAX_BYTES + 1)
+    try:
+        await manager.download(1, session, 'C:\\Logs\\huge.log')
+        failures.append("oversized download was not refused")
+    except TransferError as e:
+        if 'the limit is' not in str(e):
+            failures.append(f"oversized download failed differently: {e}")
+    return results, failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mb', type=int, default=50, help="file size in MiB")
+    parser.add_argument('--chunk-kb', type=int, default=config.TRANSFER_CHUNK_BYTES // 1024)
+    parser.add_argument('--parallel', type=int, default=config.TRANSFER_PARALLEL, help="chunks in flight")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds the fake server adds per request")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    files = FakeFiles()
+    server = FakeWinRMServer('127.0.0.1', 0, args.latency, username=USERNAME, password=PASSWORD,
+                             handler=files.handle).start()
+    try:
+        results, failures = asyncio.run(run(args, server, files))
+    finally:
+        server.stop()
+        shutil.rmtree(config.TRANSFER_DIR, ignore_errors=True)
+
+    size = args.mb * 1024 * 1024
+    print(f"{args.mb} MiB in {args.chunk_kb} KiB chunks, {args.parallel} in flight, "
+          f"{args.latency * 1000:.0f} ms per request\n")
+    for direction in ('download', 'upload'):
+        seconds = results[f'{direction}_s']
+        print(f"{direction:<9} {seconds:>7.2f}s  {size / seconds / 1024 / 1024:>6.2f} MiB/s")
+    print(f"resume    {results['resumed_chunks_sent']} chunk(s) sent after the interruption")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'transfer', 'args': vars(args), 'results': results,
+                       'failures': failures}, f, indent=2)
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
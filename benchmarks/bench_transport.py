@@ -0,0 +1,140 @@
+"""Benchmark: thread-pool pywinrm path vs the asyncio WinRM client.
+
+Starts the fake WinRM server from fake_winrm.py, then runs the same batch of
+commands through winrm_executor + winrm_client.run_command (blocking pywinrm on
+worker threads) and through async_winrm.async_run_command (one event loop).
+Hosts are distinct loopback addresses, so pooling and per-host limits behave
+as they would against real servers.
+
+    python benchmarks/bench_transport.py [--commands 400] [--hosts 20] [--latency 0.02] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The fake server speaks Basic auth; keep pools big enough that neither path churns shells
+os.environ.setdefault('WINRM_TRANSPORT', 'basic')
+os.environ.setdefault('WINRM_POOL_SIZE', '1024')
+
+from config import config  # noqa: E402
+from executor import WinRMExecutor  # noqa: E402
+from winrm_client import run_command, winrm_pool  # noqa: E402
+from async_winrm import async_run_command, async_winrm_pool  # noqa: E402
+from fake_winrm import FakeWinRMServer  # noqa: E402
+
+USERNAME, PASSWORD = 'administrator', 'password'
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def client_threads():
+    """Threads in this process that aren't the fake server's request handlers"""
+    return sum(1 for t in threading.enumerate() if 'process_request' not in t.name)
+
+def summarize(name, wall, latencies, failures, threads):
+    return {
+        'path': name,
+        'commands': len(latencies),
+        'failures': failures,
+        'wall_s': round(wall, 3),
+        'commands_per_s': round(len(latencies) / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'peak_threads': threads,
+    }
+
+async def bench_threads(targets, command, concurrency, workers):
+    executor = WinRMExecutor(max_workers=workers, per_host=concurrency)
+    limit = asyncio.Semaphore(concurrency)
+    latencies, failures, peak = [], 0, client_threads()
+
+    async def one(host, port):
+        nonlocal failures, peak
+        async with limit:
+            started = time.perf_counter()
+            _, _, code = await executor.run(None, host, run_command, host, USERNAME, PASSWORD, port, command)
+            latencies.append(time.perf_counter() - started)
+            failures += code != 0
+            peak = max(peak, client_threads())
+
+    # Warm the pool so both paths measure steady-state commands, not logins
+    await asyncio.gather(*(one(host, port) for host, port in dict.fromkeys(targets)))
+    latencies.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(host, port) for host, port in targets))
+    wall = time.perf_counter() - started
+    executor.shutdown()
+    winrm_pool.close_all()
+    return summarize('threads', wall, latencies, failures, peak)
+
+async def bench_async(targets, command, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+    latencies, failures, peak = [], 0, client_threads()
+
+    async def one(host, port):
+        nonlocal failures, peak
+        async with limit:
+            started = time.perf_counter()
+            _, _, code = await async_run_command(host, USERNAME, PASSWORD, port, command)
+            latencies.append(time.perf_counter() - started)
+            failures += code != 0
+            peak = max(peak, client_threads())
+
+    await asyncio.gather(*(one(host, port) for host, port in dict.fromkeys(targets)))
+    latencies.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(host, port) for host, port in targets))
+    wall = time.perf_counter() - started
+    await async_winrm_pool.close_all()
+    return summarize('asyncio', wall, latencies, failures, peak)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', type=int, default=400)
+    parser.add_argument('--hosts', type=int, default=20, help="distinct loopback addresses (127.0.0.x)")
+    parser.add_argument('--concurrency', type=int, default=100, help="commands in flight at once")
+    parser.add_argument('--workers', type=int, default=config.WINRM_MAX_WORKERS,
+                        help="thread pool size for the pywinrm path")
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds the fake server adds per request")
+    parser.add_argument('--output-bytes', type=int, default=2048)
+    parser.add_argument('--chunks', type=int, default=2, help="Receive round trips per command")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    server = FakeWinRMServer('0.0.0.0', 0, args.latency, args.output_bytes, args.chunks,
+                             USERNAME, PASSWORD).start()
+    hosts = [f"127.0.0.{i % 254 + 1}" for i in range(args.hosts)]
+    targets = [(hosts[i % len(hosts)], server.port) for i in range(args.commands)]
+    try:
+        results = [
+            asyncio.run(bench_threads(targets, 'dir', args.concurrency, args.workers)),
+            asyncio.run(bench_async(targets, 'dir', args.concurrency)),
+        ]
+    finally:
+        server.stop()
+
+    print(f"{args.commands} commands on {args.hosts} hosts, {args.concurrency} in flight, "
+          f"{args.latency * 1000:.0f} ms per request, {args.chunks} receive(s) per command\n")
+    for r in results:
+        print(f"{r['path']:<8} {r['wall_s']:>7.2f}s  {r['commands_per_s']:>8.1f} cmd/s  "
+              f"p50 {r['p50_ms']:>7.1f} ms  p95 {r['p95_ms']:>7.1f} ms  "
+              f"threads {r['peak_threads']:>3}  failures {r['failures']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'transport', 'args': vars(args), 'results': results}, f, indent=2)
+
+    sys.exit(1 if any(r['failures'] for r in results) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers the methods the bot calls (getMe, sendMessage, editMessageText,
+deleteMessage, sendDocument, ...) with well-formed objects after a
+configurable delay, and records what was sent, so handlers can run end to end
+without network access. Point the bot at it with BOT_API_URL:
+
+    python benchmarks/fake_telegram.py [--port 8081] [--latency 0.05]
+    BOT_API_URL=http://127.0.0.1:8081/bot python main.py
+"""
+import argparse
+import json
+import threading
+import time
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qsl
+
+BOT_USER = {'id': 4242, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+# Methods that answer with the Message they sent or edited
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'sendDocument', 'sendPhoto', 'copyMessage'}
+
+class FakeTelegramServer:
+    """Threaded HTTP server answering Bot API calls on /bot<token>/<method>"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls: Counter = Counter()
+        # (chat_id, text) of every sendMessage/editMessageText, oldest first
+        self.messages: List[Tuple[int, str]] = []
+        self._message_id = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._request_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        """Value for BOT_API_URL"""
+        return f"http://{self.httpd.server_address[0]}:{self.port}/bot"
+
+    def start(self) -> 'FakeTelegramServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def dispatch(self, method: str, params: Dict[str, str]) -> dict:
+        """Bot API result for one call"""
+        with self.lock:
+            self.calls[method] += 1
+            if method == 'getMe':
+                return BOT_USER
+            if method not in MESSAGE_METHODS:
+                return True
+            chat_id = int(params.get('chat_id', 0))
+            text = params.get('text', '')
+            if method in ('sendMessage', 'editMessageText'):
+                self.messages.append((chat_id, text))
+            if method == 'editMessageText' and params.get('message_id'):
+                message_id = int(params['message_id'])
+            else:
+                self._message_id += 1
+                message_id = self._message_id
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if method == 'sendDocument':
+            message['document'] = {'file_id': f'doc{message_id}', 'file_unique_id': f'doc{message_id}'}
+        else:
+            message['text'] = text
+        return message
+
+    def _request_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = self.rfile.read(length)
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                if server.latency:
+                    time.sleep(server.latency)
+                result = server.dispatch(method, parse_params(self.headers.get('Content-Type', ''), payload))
+                body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+def parse_params(content_type: str, payload: bytes) -> Dict[str, str]:
+    """Form fields of a urlencoded, JSON or multipart request body (file parts are skipped)"""
+    if not payload:
+        return {}
+    if content_type.startswith('application/json'):
+        return {name: value if isinstance(value, str) else json.dumps(value)
+                for name, value in json.loads(payload).items()}
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + payload)
+        return {
+            part.get_param('name', header='content-disposition'): part.get_payload(decode=True).decode('utf-8')
+            for part in message.get_payload()
+            if not part.get_filename()
+        }
+    return dict(parse_qsl(payload.decode('utf-8')))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every call")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(args.host, args.port, args.latency)
+    print(f"Fake Bot API listening; set BOT_API_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
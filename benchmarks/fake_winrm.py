@@ -0,0 +1,289 @@
+"""Local stand-in for a Windows WinRM endpoint.
+
+Speaks just enough WS-Management (Create, Command, Receive, Signal, Send and
+Delete on the cmd shell resource) for pywinrm and AsyncWinRMClient to run
+commands against it over plain HTTP with Basic auth. Latency, bandwidth, output
+size and how many Receive round trips a command takes are configurable, so
+transports can be compared without a Windows host.
+
+    python benchmarks/fake_winrm.py [--port 5985] [--latency 0.02] [--bandwidth 1000000]
+"""
+import argparse
+import base64
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+from xml.etree import ElementTree as ET
+
+NS = {
+    's': 'http://www.w3.org/2003/05/soap-envelope',
+    'a': 'http://schemas.xmlsoap.org/ws/2004/08/addressing',
+    'w': 'http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd',
+    'rsp': 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell',
+}
+
+ENVELOPE = (
+    '<s:Envelope xmlns:s="{s}" xmlns:a="{a}" xmlns:w="{w}" xmlns:rsp="{rsp}">'
+    '<s:Header><a:Action>{{action}}</a:Action><a:RelatesTo>{{relates_to}}</a:RelatesTo></s:Header>'
+    '<s:Body>{{body}}</s:Body></s:Envelope>'
+).format(**NS)
+
+DONE = 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done'
+RUNNING = 'http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running'
+
+# (command, arguments, stdin) -> (stdout, stderr, exit_code)
+CommandHandler = Callable[[str, str, bytes], Tuple[bytes, bytes, int]]
+
+def default_handler(output_bytes: int) -> CommandHandler:
+    """whoami/hostname answer like a real box; anything else prints output_bytes of text"""
+    line = b"The quick brown fox jumps over the lazy dog 0123456789\r\n"
+    body = (line * (output_bytes // len(line) + 1))[:output_bytes]
+
+    def handle(command: str, arguments: str, stdin: bytes = b"") -> Tuple[bytes, bytes, int]:
+        verb = command.strip().lower()
+        if verb == 'whoami':
+            return b"fake\\administrator\r\n", b"", 0
+        if verb == 'hostname':
+            return b"FAKE-WINRM\r\n", b"", 0
+        if verb == 'rem':
+            return b"", b"", 0
+        if verb.startswith('exit '):
+            return b"", b"", int(verb.split()[1])
+        return body, b"", 0
+
+    return handle
+
+class _Command:
+    """One started command; its output is handed out over several Receive calls.
+
+    The handler runs at the first Receive so input sent before then is seen.
+    """
+
+    def __init__(self, command: str, arguments: str, chunks: int, max_receive: int = 0):
+        self.command = command
+        self.arguments = arguments
+        self.chunks = chunks
+        self.max_receive = max_receive
+        self.stdin = b""
+        self.pieces = None
+        self.stderr = b""
+        self.exit_code = 0
+
+    def run(self, handler: CommandHandler):
+        if self.pieces is not None:
+            return
+        stdout, self.stderr, self.exit_code = handler(self.command, self.arguments, self.stdin)
+        size = max(1, -(-len(stdout) // max(1, self.chunks)))
+        if self.max_receive:
+            size = min(size, self.max_receive)
+        self.pieces = [stdout[i:i + size] for i in range(0, len(stdout), size)] or [b""]
+
+class FakeWinRMServer:
+    """Threaded HTTP server answering WS-Management requests on /wsman"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 output_bytes: int = 64, chunks: int = 1, username: str = 'administrator',
+                 password: str = 'password', handler: Optional[CommandHandler] = None,
+                 bandwidth: float = 0.0, max_receive: int = 0):
+        self.latency = latency
+        # Bytes per second each response is throttled to (0 = unlimited)
+        self.bandwidth = bandwidth
+        self.chunks = chunks
+        # Most stdout bytes per Receive, like a real server's MaxEnvelopeSizekb (0 = no limit)
+        self.max_receive = max_receive
+        self.credentials = (
+            base64.b64encode(f"{username}:{password}".encode()).decode() if username else None
+        )
+        self.handler = handler or default_handler(output_bytes)
+        self.shells: Dict[str, Dict[str, _Command]] = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        # HTTP body bytes received and sent
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._request_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.httpd.server_address[0]}:{self.port}/wsman"
+
+    def start(self) -> 'FakeWinRMServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def dispatch(self, envelope: bytes) -> Tuple[int, str]:
+        """Answer one SOAP request; returns (HTTP status, response envelope)"""
+        root = ET.fromstring(envelope)
+        action = root.findtext('s:Header/a:Action', '', NS).rsplit('/', 1)[-1]
+        message_id = root.findtext('s:Header/a:MessageID', '', NS)
+        shell_id = root.findtext("s:Header/w:SelectorSet/w:Selector[@Name='ShellId']", '', NS)
+        body = root.find('s:Body', NS)
+        with self.lock:
+            self.requests += 1
+
+        if action == 'Create':
+            shell_id = str(uuid.uuid4()).upper()
+            with self.lock:
+                self.shells[shell_id] = {}
+            reply = (
+                '<x:ResourceCreated xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer">'
+                '<a:Address>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:Address>'
+                '<a:ReferenceParameters><w:ResourceURI>http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd'
+                f'</w:ResourceURI><w:SelectorSet><w:Selector Name="ShellId">{shell_id}</w:Selector>'
+                f'</w:SelectorSet></a:ReferenceParameters></x:ResourceCreated>'
+                f'<rsp:Shell><rsp:ShellId>{shell_id}</rsp:ShellId></rsp:Shell>'
+            )
+            return 200, self._envelope('http://schemas.xmlsoap.org/ws/2004/09/transfer/CreateResponse',
+                                       message_id, reply)
+
+        commands = self.shells.get(shell_id)
+        if commands is None:
+            return 500, self._fault(message_id, '2150858843', 'The request for the Windows Remote Shell '
+                                    'with ShellId %s failed because the shell was not found on the server.' % shell_id)
+
+        if action == 'Delete':
+            with self.lock:
+                self.shells.pop(shell_id, None)
+            return 200, self._envelope('http://schemas.xmlsoap.org/ws/2004/09/transfer/DeleteResponse',
+                                       message_id, '')
+
+        if action == 'Command':
+            line = body.find('rsp:CommandLine', NS)
+            command = line.findtext('rsp:Command', '', NS)
+            arguments = line.findtext('rsp:Arguments', '', NS)
+            command_id = str(uuid.uuid4()).upper()
+            commands[command_id] = _Command(command, arguments, self.chunks, self.max_receive)
+            return 200, self._envelope('http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandResponse',
+                                       message_id, f'<rsp:CommandResponse><rsp:CommandId>{command_id}'
+                                       f'</rsp:CommandId></rsp:CommandResponse>')
+
+        if action == 'Receive':
+            command_id = body.find('rsp:Receive/rsp:DesiredStream', NS).get('CommandId')
+            state = commands.get(command_id)
+            if state is None:
+                return 500, self._fault(message_id, '2150858843', 'Unknown command')
+            state.run(self.handler)
+            piece = state.pieces.pop(0) if state.pieces else b""
+            streams = self._stream('stdout', command_id, piece)
+            if state.pieces:
+                status = f'<rsp:CommandState CommandId="{command_id}" State="{RUNNING}"/>'
+            else:
+                streams += self._stream('stderr', command_id, state.stderr)
+                status = (f'<rsp:CommandState CommandId="{command_id}" State="{DONE}">'
+                          f'<rsp:ExitCode>{state.exit_code}</rsp:ExitCode></rsp:CommandState>')
+            return 200, self._envelope('http://schemas.microsoft.com/wbem/wsman/1/windows/shell/ReceiveResponse',
+                                       message_id, f'<rsp:ReceiveResponse>{streams}{status}</rsp:ReceiveResponse>')
+
+        if action == 'Send':
+            stream = body.find('rsp:Send/rsp:Stream', NS)
+            state = commands.get(stream.get('CommandId'))
+            if state is not None and stream.text:
+                state.stdin += base64.b64decode(stream.text)
+            return 200, self._envelope('http://schemas.microsoft.com/wbem/wsman/1/windows/shell/SendResponse',
+                                       message_id, '<rsp:SendResponse/>')
+
+        if action == 'Signal':
+            command_id = body.find('rsp:Signal', NS).get('CommandId')
+            commands.pop(command_id, None)
+            return 200, self._envelope('http://schemas.microsoft.com/wbem/wsman/1/windows/shell/SignalResponse',
+                                       message_id, '<rsp:SignalResponse/>')
+
+        return 500, self._fault(message_id, '2150858770', f'Unsupported action {action}')
+
+    def _stream(self, name: str, command_id: str, data: bytes) -> str:
+        if not data:
+            return ''
+        encoded = base64.b64encode(data).decode('ascii')
+        return f'<rsp:Stream Name="{name}" CommandId="{command_id}">{encoded}</rsp:Stream>'
+
+    def _envelope(self, action: str, relates_to: str, body: str) -> str:
+        return ENVELOPE.format(action=action, relates_to=relates_to, body=body)
+
+    def _fault(self, relates_to: str, code: str, message: str) -> str:
+        body = (
+            '<s:Fault><s:Code><s:Value>s:Receiver</s:Value></s:Code>'
+            f'<s:Reason><s:Text xml:lang="en-US">{message}</s:Text></s:Reason>'
+            '<s:Detail><f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" '
+            f'Code="{code}" Machine="fake"><f:Message>{message}</f:Message></f:WSManFault></s:Detail></s:Fault>'
+        )
+        return self._envelope('http://schemas.dmtf.org/wbem/wsman/1/wsman/fault', relates_to, body)
+
+    def _request_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = self.rfile.read(length)
+                with server.lock:
+                    server.bytes_in += len(payload)
+                if server.credentials and self.headers.get('Authorization') != f'Basic {server.credentials}':
+                    self._reply(401, b'', {'WWW-Authenticate': 'Basic realm="WSMAN"'})
+                    return
+                if not payload:
+                    self._reply(200, b'')
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                status, envelope = server.dispatch(payload)
+                self._reply(status, envelope.encode('utf-8'),
+                            {'Content-Type': 'application/soap+xml;charset=UTF-8'})
+
+            def _reply(self, status: int, data: bytes, headers: Dict[str, str] = None):
+                with server.lock:
+                    server.bytes_out += len(data)
+                if server.bandwidth:
+                    time.sleep(len(data) / server.bandwidth)
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5985)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--output-bytes', type=int, default=64)
+    parser.add_argument('--chunks', type=int, default=1, help="Receive round trips per command")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="bytes per second per response (0 = unlimited)")
+    args = parser.parse_args()
+
+    server = FakeWinRMServer(args.host, args.port, args.latency, args.output_bytes, args.chunks,
+                             bandwidth=args.bandwidth)
+    print(f"Fake WinRM listening on {server.url} (administrator / password)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import fnmatch
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from config import config
+from metrics import registry
+
+# (host:port, username, shell, normalized command)
+CacheKey = Tuple[str, str, str, str]
+
+# Pipeline stages that only reshape output
+SAFE_PIPE_STAGES = {
+    'select-object', 'select', 'sort-object', 'sort', 'where-object', 'where', '?',
+    'format-table', 'ft', 'format-list', 'fl', 'measure-object', 'measure', 'out-string',
+    'findstr', 'more', 'find',
+}
+
+# Switches that turn an otherwise read-only command into a mutating one
+MUTATING_ARGS = {'/release', '/release6', '/renew', '/renew6', '/flushdns', '/registerdns', '/setclassid'}
+
+# Command chaining, redirection, subexpressions, script blocks and method
+# calls (e.g. Where-Object { $_.Stop() }) can hide side effects
+UNSAFE = re.compile(r'[;&<>`{}]|\$\(|\|\||\.\w+\s*\(')
+
+class ResultCache:
+    """LRU cache of read-only command results with per-entry TTL and a memory cap"""
+
+    def __init__(self, ttl: int = None, max_bytes: int = None, allowlist: str = None):
+        self.ttl = ttl or config.RESULT_CACHE_TTL
+        self.max_bytes = max_bytes or config.RESULT_CACHE_MAX_BYTES
+        patterns = allowlist if allowlist is not None else config.RESULT_CACHE_COMMANDS
+        self.allowlist = [p.strip().lower() for p in patterns.split(',') if p.strip()]
+        self._entries: "OrderedDict[CacheKey, Tuple[str, str, int, float, int]]" = OrderedDict()
+        self._by_host: Dict[str, Set[CacheKey]] = {}
+        self._bytes = 0
+        # Invalidation happens on worker threads, lookups on the event loop
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def is_cacheable(self, command: str) -> bool:
+        """True if every pipeline stage is allowlisted and nothing can mutate state"""
+        normalized = normalize_command(command)
+        if not normalized or UNSAFE.search(normalized):
+            return False
+        stages = [stage.split() for stage in normalized.split('|')]
+        if any(not stage for stage in stages):
+            return False
+        first = stages[0]
+        if not any(fnmatch.fnmatchcase(first[0], pattern) for pattern in self.allowlist):
+            return False
+        if MUTATING_ARGS.intersection(first[1:]):
+            return False
+        return all(stage[0] in SAFE_PIPE_STAGES for stage in stages[1:])
+
+    def get(self, host: str, username: str, shell: str, command: str) -> Optional[Tuple[str, str, int, float]]:
+        """Return (stdout, stderr, exit_code, age_seconds) for a fresh entry, or None"""
+        key = (host, username.lower(), shell, normalize_command(command))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stdout, stderr, exit_code, stored_at, _ = entry
+            age = time.time() - stored_at
+            if age > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return stdout, stderr, exit_code, age
+
+    def put(self, host: str, username: str, shell: str, command: str, stdout: str, stderr: str, exit_code: int):
+        """Store a successful result of an allowlisted command, visible only to the same account"""
+        if exit_code != 0 or not self.is_cacheable(command):
+            return
+        size = len(stdout.encode('utf-8')) + len(stderr.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        key = (host, username.lower(), shell, normalize_command(command))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (stdout, stderr, exit_code, time.time(), size)
+            self._by_host.setdefault(host, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_if_mutating(self, host: str, command: str) -> int:
+        """Drop the host's entries before running anything that isn't allowlisted"""
+        if self.is_cacheable(command):
+            return 0
+        return self.invalidate(host)
+
+    def invalidate(self, host: str) -> int:
+        """Drop every cached result for a host, whichever account it was run as"""
+        with self._lock:
+            keys = self._by_host.pop(host, set())
+            for key in keys:
+                self._remove(key, index=False)
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        """Return entry count, memory use and hit counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _remove(self, key: CacheKey, index: bool = True):
+        """Remove one entry (caller holds the lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[4]
+        if index:
+            keys = self._by_host.get(key[0])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_host[key[0]]
+
+def normalize_command(command: str) -> str:
+    """Case- and whitespace-insensitive form used as the cache key"""
+    return ' '.join(command.lower().split())
+
+# Global result cache
+result_cache = ResultCache()
+
+registry.counter('result_cache_lookups_total', "Result cache lookups by outcome", ['result'],
+                 lambda: {('hit',): result_cache.hits, ('miss',): result_cache.misses})
+registry.gauge('result_cache_bytes', "Memory held by cached results", callback=lambda: result_cache.stats()['bytes'])
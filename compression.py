@@ -0,0 +1,156 @@
+import base64
+import binascii
+import fnmatch
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+from config import config
+from cache import normalize_command
+from metrics import registry
+from structured import quote_ps
+
+# cmd.exe refuses longer command lines, and run_ps sends the script as one
+MAX_COMMAND_LINE = 8000
+
+# Compressed bytes per base64 line written by the remote script (a multiple of 3)
+LINE_BYTES = 48 * 1024
+
+COMPRESSED_BYTES = registry.counter(
+    'winrm_compressed_bytes_total', "Stdout of compressed commands: base64 received (wire) and decoded (output)",
+    ['side'])
+
+# Runs the command as a child process and gzips its stdout as it is produced,
+# writing the compressed stream as base64 lines; stderr and the exit code are
+# passed through. The child gets the same command line the shell would run.
+WRAPPER = """$ProgressPreference = 'SilentlyContinue'; $ErrorActionPreference = 'Stop'
+{setup}
+$info = New-Object Diagnostics.ProcessStartInfo $file, $arguments
+$info.UseShellExecute = $false; $info.RedirectStandardOutput = $true; $info.RedirectStandardError = $true
+$process = [Diagnostics.Process]::Start($info)
+$errors = $process.StandardError.ReadToEndAsync()
+$buffer = New-Object IO.MemoryStream
+$gzip = New-Object IO.Compression.GZipStream $buffer, ([IO.Compression.CompressionMode]::Compress), $true
+function Send-Compressed($final) {{
+  $bytes = $buffer.ToArray(); $count = if ($final) {{ $bytes.Length }} else {{ $bytes.Length - $bytes.Length % 3 }}
+  if ($count) {{ [Console]::Out.WriteLine([Convert]::ToBase64String($bytes, 0, $count)) }}
+  $buffer.SetLength(0); $buffer.Write($bytes, $count, $bytes.Length - $count)
+}}
+$source = $process.StandardOutput.BaseStream; $chunk = New-Object byte[] 65536
+while (($read = $source.Read($chunk, 0, $chunk.Length)) -gt 0) {{
+  $gzip.Write($chunk, 0, $read)
+  if ($buffer.Length -ge {line_bytes}) {{ Send-Compressed $false }}
+}}
+$gzip.Close(); Send-Compressed $true
+$process.WaitForExit()
+[Console]::Error.Write($errors.Result)
+exit $process.ExitCode
+"""
+
+def build_compressed_command(command: str, powershell: bool = False) -> Optional[str]:
+    """PowerShell script that runs command and returns its stdout gzipped, or None if it would be too long"""
+    if powershell:
+        setup = (f"$file = 'powershell.exe'\n$arguments = '-NoProfile -NonInteractive -EncodedCommand ' + "
+                 f"[Convert]::ToBase64String([Text.Encoding]::Unicode.GetBytes({quote_ps(command)}))")
+    else:
+        setup = f"$file = 'cmd.exe'\n$arguments = '/c ' + {quote_ps(command)}"
+    script = WRAPPER.format(setup=setup, line_bytes=LINE_BYTES)
+    # run_ps sends it as powershell -encodedcommand <UTF-16LE base64>
+    if len(base64.b64encode(script.encode('utf_16_le'))) + 30 > MAX_COMMAND_LINE:
+        return None
+    return script
+
+class GzipDecoder:
+    """Decode a compressed command's stdout (base64 lines of one gzip stream) as it arrives.
+
+    If the output turns out not to be compressed, the rest is passed through
+    unchanged.
+    """
+
+    def __init__(self):
+        self._pending = b""
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.raw = False
+        self.wire_bytes = 0
+        self.output_bytes = 0
+
+    def feed(self, data: bytes) -> bytes:
+        """Decode a chunk of stdout; returns the output bytes it completes"""
+        self.wire_bytes += len(data)
+        if self.raw:
+            return self._count(data)
+        pending = self._pending + b"".join(data.split())
+        usable = len(pending) - len(pending) % 4
+        self._pending = pending[usable:]
+        try:
+            return self._count(self._inflate.decompress(base64.b64decode(pending[:usable], validate=True)))
+        except (binascii.Error, zlib.error):
+            # Not our encoding (e.g. the wrapper itself failed); hand it over as is
+            self.raw = True
+            return self._count(data)
+
+    def finish(self) -> bytes:
+        """Flush whatever the gzip stream still holds"""
+        if self.raw:
+            return b""
+        try:
+            rest = self._inflate.decompress(base64.b64decode(self._pending, validate=True)) + self._inflate.flush()
+        except (binascii.Error, zlib.error):
+            rest = self._pending
+        self._pending = b""
+        COMPRESSED_BYTES.inc(self.wire_bytes, side='wire')
+        COMPRESSED_BYTES.inc(self.output_bytes + len(rest), side='output')
+        return self._count(rest) if rest else b""
+
+    def _count(self, data: bytes) -> bytes:
+        self.output_bytes += len(data)
+        return data
+
+class OutputSizes:
+    """Remember how much output each command printed last time on each server"""
+
+    # Entries kept before the least recently used are dropped
+    MAX_ENTRIES = 4096
+
+    def __init__(self, patterns: str = None):
+        patterns = patterns if patterns is not None else config.WINRM_COMPRESS_COMMANDS
+        self.verbose = [p.strip().lower() for p in patterns.split(',') if p.strip()]
+        self._sizes: "OrderedDict[Tuple[str, bool, str], int]" = OrderedDict()
+        # Updated from executor worker threads
+        self._lock = threading.Lock()
+
+    def estimate(self, address: str, command: str, powershell: bool) -> Optional[int]:
+        """Bytes the command printed last time, or None if it hasn't run here yet"""
+        key = (address, powershell, normalize_command(command))
+        with self._lock:
+            size = self._sizes.get(key)
+            if size is not None:
+                self._sizes.move_to_end(key)
+            return size
+
+    def record(self, address: str, command: str, powershell: bool, size: int):
+        key = (address, powershell, normalize_command(command))
+        with self._lock:
+            self._sizes[key] = size
+            self._sizes.move_to_end(key)
+            while len(self._sizes) > self.MAX_ENTRIES:
+                self._sizes.popitem(last=False)
+
+    def is_verbose(self, command: str) -> bool:
+        """True if the command's first word is in WINRM_COMPRESS_COMMANDS"""
+        words = normalize_command(command).split()
+        return bool(words) and any(fnmatch.fnmatchcase(words[0], pattern) for pattern in self.verbose)
+
+    def should_compress(self, address: str, command: str, powershell: bool) -> bool:
+        """Whether WINRM_COMPRESS says to compress this command's output"""
+        if config.WINRM_COMPRESS == 'always':
+            return True
+        if config.WINRM_COMPRESS != 'auto':
+            return False
+        size = self.estimate(address, command, powershell)
+        if size is None:
+            return self.is_verbose(command)
+        return size >= config.WINRM_COMPRESS_THRESHOLD
+
+# Global output size history
+output_sizes = OutputSizes()
@@ -7,23 +7,154 @@ class Config:
     def __init__(self):
         # Telegram Bot Token
         self.BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+        # Bot API base URL, for a local Bot API server (empty = api.telegram.org)
+        self.BOT_API_URL = os.getenv("BOT_API_URL", "")
+        
+        # How updates arrive: polling (one process) or webhook (a local HTTP front
+        # feeding BOT_WORKERS processes; each user is always handled by the same one)
+        self.BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+        self.BOT_WORKERS = int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1)))
+        self.WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+        self.WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+        self.WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+        self.WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+        self.WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
         
         # Allowed Telegram User IDs
         allowed_users = os.getenv("ALLOWED_USER_IDS", "")
         self.ALLOWED_USER_IDS = set(map(int, filter(None, allowed_users.split(',')))) if allowed_users else set()
+        # Users who may see /stats (defaults to every allowed user)
+        admin_users = os.getenv("ADMIN_USER_IDS", "")
+        self.ADMIN_USER_IDS = set(map(int, filter(None, admin_users.split(',')))) if admin_users else set(self.ALLOWED_USER_IDS)
         
         # Session TTL in seconds (default 15 minutes)
         self.SESSION_TTL = int(os.getenv("SESSION_TTL", "900"))
+        # How often expired sessions are reaped, in seconds
+        self.SESSION_REAP_INTERVAL = int(os.getenv("SESSION_REAP_INTERVAL", "30"))
+        
+        # Session persistence: memory (lost on restart) or sqlite (passwords
+        # encrypted with the Fernet key SESSION_STORE_KEY)
+        self.SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+        self.SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "data/sessions.db")
+        self.SESSION_STORE_KEY = os.getenv("SESSION_STORE_KEY", "")
+        # How often buffered last_used updates are written, in seconds
+        self.SESSION_FLUSH_INTERVAL = int(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
         
         # WinRM configuration
         self.WINRM_PORT = int(os.getenv("WINRM_PORT", "5985"))
         self.WINRM_TIMEOUT = int(os.getenv("WINRM_TIMEOUT", "10"))
+        # Default per-command deadline in seconds (0 = none); /run --timeout overrides it
+        self.WINRM_COMMAND_TIMEOUT = float(os.getenv("WINRM_COMMAND_TIMEOUT", "300"))
+        # Authentication: ntlm (default) or basic (HTTP Basic, for test servers)
+        self.WINRM_TRANSPORT = os.getenv("WINRM_TRANSPORT", "ntlm").lower()
+        # Transports tried on each candidate port when connecting (comma-separated)
+        transports = os.getenv("WINRM_TRANSPORTS", "").lower()
+        self.WINRM_TRANSPORTS = [t.strip() for t in transports.split(',') if t.strip()] or [self.WINRM_TRANSPORT]
+        # Connects race 5985/HTTP, 5986/HTTPS and WINRM_PORT, starting one every
+        # WINRM_RACE_DELAY seconds; the winner is reused for WINRM_ROUTE_TTL seconds
+        self.WINRM_RACE_DELAY = float(os.getenv("WINRM_RACE_DELAY", "0.25"))
+        self.WINRM_ROUTE_TTL = int(os.getenv("WINRM_ROUTE_TTL", "3600"))
+        # Circuit breaker: a host that fails to connect this many times in a row
+        # is skipped for HOST_BACKOFF seconds, doubling up to HOST_BACKOFF_MAX
+        self.HOST_FAILURE_THRESHOLD = int(os.getenv("HOST_FAILURE_THRESHOLD", "3"))
+        self.HOST_BACKOFF = float(os.getenv("HOST_BACKOFF", "30"))
+        self.HOST_BACKOFF_MAX = float(os.getenv("HOST_BACKOFF_MAX", "600"))
+        # A rejected login isn't retried for this many seconds (0 = always retry)
+        self.HOST_AUTH_FAILURE_TTL = int(os.getenv("HOST_AUTH_FAILURE_TTL", "60"))
+        # Run /runall and bulk imports on the asyncio WinRM client instead of the thread pool
+        self.WINRM_ASYNC = os.getenv("WINRM_ASYNC", "false").lower() == "true"
+        
+        # /download and /upload: files move in base64 chunks over several pooled
+        # shells; partial transfers are kept in TRANSFER_DIR for resuming
+        self.TRANSFER_DIR = os.getenv("TRANSFER_DIR", "data/transfers")
+        self.TRANSFER_CHUNK_BYTES = int(os.getenv("TRANSFER_CHUNK_BYTES", str(1024 * 1024)))
+        self.TRANSFER_PARALLEL = int(os.getenv("TRANSFER_PARALLEL", "4"))
+        # Bots can send files up to 50 MB (and fetch up to 20 MB from the cloud Bot API)
+        self.TRANSFER_MAX_BYTES = int(os.getenv("TRANSFER_MAX_BYTES", str(50 * 1024 * 1024)))
+        self.TRANSFER_RESUME_TTL = int(os.getenv("TRANSFER_RESUME_TTL", "86400"))
+        
+        # Gzip large command output on the server and send it as base64: off, auto
+        # (when the command printed at least WINRM_COMPRESS_THRESHOLD bytes last
+        # time, or is listed in WINRM_COMPRESS_COMMANDS and hasn't run yet) or always
+        self.WINRM_COMPRESS = os.getenv("WINRM_COMPRESS", "off").lower()
+        self.WINRM_COMPRESS_THRESHOLD = int(os.getenv("WINRM_COMPRESS_THRESHOLD", "65536"))
+        self.WINRM_COMPRESS_COMMANDS = os.getenv(
+            "WINRM_COMPRESS_COMMANDS",
+            "systeminfo,tasklist,netstat,driverquery,wevtutil,type,get-content,gc,get-eventlog,get-winevent,"
+            "get-childitem,gci,get-process,get-service"
+        )
+        
+        # WinRM executor (blocking WinRM calls run on a thread pool)
+        self.WINRM_MAX_WORKERS = int(os.getenv("WINRM_MAX_WORKERS", "16"))
+        self.WINRM_MAX_PER_USER = int(os.getenv("WINRM_MAX_PER_USER", "2"))
+        self.WINRM_MAX_PER_HOST = int(os.getenv("WINRM_MAX_PER_HOST", "4"))
+        
+        # WinRM connection pool (idle clients are evicted after SESSION_TTL)
+        self.WINRM_POOL_SIZE = int(os.getenv("WINRM_POOL_SIZE", "32"))
+        self.WINRM_POOL_HEALTH_INTERVAL = int(os.getenv("WINRM_POOL_HEALTH_INTERVAL", "60"))
+        
+        # /runall fan-out: hosts run at once and per-host timeout in seconds
+        self.FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "10"))
+        self.FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", "60"))
+        
+        # Bulk credential import: default group name and max uploaded file size
+        self.IMPORT_GROUP = os.getenv("IMPORT_GROUP", "imported")
+        self.IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", "1048576"))
+        
+        # Opt-in cache for read-only commands (comma-separated, * wildcards allowed)
+        self.RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "false").lower() == "true"
+        self.RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "60"))
+        self.RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", "8388608"))
+        self.RESULT_CACHE_COMMANDS = os.getenv(
+            "RESULT_CACHE_COMMANDS", "hostname,whoami,ipconfig,systeminfo,ver,tasklist,netstat,get-*"
+        )
+        
+        # Background jobs (/run --bg): running jobs per user, deadline in seconds,
+        # finished jobs kept per user and how long their results are kept
+        self.JOB_MAX_ACTIVE = int(os.getenv("JOB_MAX_ACTIVE", "5"))
+        self.JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600"))
+        self.JOB_HISTORY = int(os.getenv("JOB_HISTORY", "20"))
+        self.JOB_RETENTION = int(os.getenv("JOB_RETENTION", "3600"))
+        
+        # Watches (/watch): per user, shortest interval in seconds, the fraction each
+        # interval is randomly shortened or lengthened by, and diff lines per message
+        self.WATCH_MAX_PER_USER = int(os.getenv("WATCH_MAX_PER_USER", "3"))
+        self.WATCH_MIN_INTERVAL = float(os.getenv("WATCH_MIN_INTERVAL", "30"))
+        self.WATCH_JITTER = float(os.getenv("WATCH_JITTER", "0.1"))
+        self.WATCH_DIFF_LINES = int(os.getenv("WATCH_DIFF_LINES", "20"))
+        
+        # Maximum commands in one /script
+        self.SCRIPT_MAX_COMMANDS = int(os.getenv("SCRIPT_MAX_COMMANDS", "25"))
         
         # Security settings
         self.DELETE_CREDENTIAL_MESSAGES = os.getenv("DELETE_CREDENTIAL_MESSAGES", "true").lower() == "true"
         
         # Output truncation (Telegram message limit is 4096 chars)
         self.MAX_OUTPUT_LENGTH = 4000
+        
+        # Output above MAX_OUTPUT_LENGTH is paged up to this many bytes, then sent as a file
+        self.OUTPUT_DOCUMENT_THRESHOLD = int(os.getenv("OUTPUT_DOCUMENT_THRESHOLD", "16000"))
+        # Output files larger than this many bytes are gzipped
+        self.OUTPUT_GZIP_THRESHOLD = int(os.getenv("OUTPUT_GZIP_THRESHOLD", "262144"))
+        
+        # Prometheus /metrics endpoint (0 disables it); webhook worker N listens on METRICS_PORT + N
+        self.METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+        self.METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+        
+        # Outbound Bot API limits: calls per second overall and per private chat,
+        # messages per minute per group chat, burst size per chat, and retries on 429
+        self.TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+        self.TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+        self.TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))
+        self.TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "5"))
+        self.TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+        
+        # Seconds to wait for a result before sending a "working on it" message;
+        # faster results are sent as one message, slower ones replace it in place
+        self.ACK_DELAY = float(os.getenv("ACK_DELAY", "1.0"))
+        
+        # Minimum seconds between edits of a streaming output message
+        self.STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
 
 # Global config instance
 config = Config()
\ No newline at end of file
@@ -0,0 +1,116 @@
+import asyncio
+import gzip
+import io
+from typing import Awaitable, Optional, Tuple, TypeVar
+from telegram import Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, TelegramError
+from config import config
+from utils import format_command_output, split_text
+
+T = TypeVar('T')
+
+async def with_ack(message: Message, text: str, work: Awaitable[T],
+                   delay: float = None) -> Tuple[T, Optional[Message]]:
+    """Await work, replying with `text` only if it takes longer than ACK_DELAY.
+
+    Returns (result, ack) where ack is the status message, or None if the result
+    came quickly; pass it to reply()/send_output() to put the result in its place.
+    If work raises, the ack travels with the exception (see ack_of) so the error
+    can replace it too.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        delay = config.ACK_DELAY if delay is None else delay
+        if delay > 0:
+            await asyncio.wait({task}, timeout=delay)
+        ack = None
+        if not task.done():
+            ack = await message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        try:
+            return await task, ack
+        except Exception as e:
+            e.ack = ack
+            raise
+    finally:
+        # Don't leave the work running unobserved if sending the ack failed
+        if not task.done():
+            task.cancel()
+
+def ack_of(error: BaseException) -> Optional[Message]:
+    """The status message with_ack sent before its work raised error, if any"""
+    return getattr(error, 'ack', None)
+
+async def reply(message: Message, text: str, ack: Message = None,
+                parse_mode: Optional[str] = ParseMode.MARKDOWN) -> Message:
+    """Reply with text, editing it into the ack message instead when there is one"""
+    if ack is not None:
+        try:
+            return await ack.edit_text(text, parse_mode=parse_mode)
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                return ack
+            # The ack was deleted or can't be edited any more; send a new message
+    return await message.reply_text(text, parse_mode=parse_mode)
+
+def build_output_document(stdout: str, stderr: str, exit_code: int, name: str = "output"):
+    """Build an in-memory file holding a command's full output"""
+    parts = []
+    if stdout:
+        parts.append(stdout)
+    if stderr:
+        parts.append(f"----- stderr -----\n{stderr}")
+    parts.append(f"----- exit code: {exit_code} -----\n")
+    return build_text_document("\n".join(parts), name)
+
+def build_text_document(text: str, name: str):
+    """Wrap text in an in-memory file, gzipped above OUTPUT_GZIP_THRESHOLD bytes.
+
+    Returns (buffer, filename).
+    """
+    data = text.encode('utf-8')
+    if len(data) > config.OUTPUT_GZIP_THRESHOLD:
+        return io.BytesIO(gzip.compress(data)), f"{name}.txt.gz"
+    return io.BytesIO(data), f"{name}.txt"
+
+async def send_output(message: Message, stdout: str, stderr: str, exit_code: int, name: str = "output",
+                      ack: Message = None):
+    """Reply with command output inline, as pages, or as a document depending on size.
+
+    Inline output and the first page replace the ack message if one is given.
+    """
+    output = format_command_output(stdout, stderr, exit_code)
+    if len(output) <= config.MAX_OUTPUT_LENGTH:
+        await reply(message, output, ack)
+        return
+
+    size = len(stdout.encode('utf-8')) + len(stderr.encode('utf-8'))
+    if size > config.OUTPUT_DOCUMENT_THRESHOLD:
+        document, filename = build_output_document(stdout, stderr, exit_code, name)
+        await message.reply_document(
+            document=document,
+            filename=filename,
+            caption=f"📎 Output ({size:,} bytes) · Exit code {exit_code}"
+        )
+        if ack is not None:
+            # The document can't be edited into the ack, so don't leave it behind
+            try:
+                await ack.delete()
+            except TelegramError:
+                pass
+        return
+
+    ack = await _send_pages(message, "📤 **Stdout", stdout, ack)
+    ack = await _send_pages(message, "📥 **Stderr", stderr, ack)
+    await reply(message, f"🔢 **Exit Code:** `{exit_code}`", ack)
+
+async def _send_pages(message: Message, label: str, text: str, ack: Message = None) -> Optional[Message]:
+    """Send text as numbered pages; returns the ack if it wasn't used up"""
+    if not text:
+        return ack
+    # Leave room for the page header and code fences
+    pages = split_text(text, config.MAX_OUTPUT_LENGTH - 100)
+    for number, page in enumerate(pages, 1):
+        await reply(message, f"{label} ({number}/{len(pages)}):**\n```\n{page}\n```", ack)
+        ack = None
+    return None
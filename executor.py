@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, Callable, Dict, Hashable, Set
+from config import config
+from health import host_health
+from metrics import registry, EXECUTOR_WAIT_SECONDS
+
+class _KeyedLimiter:
+    """Per-key semaphores that are dropped once nobody holds or waits on them"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._slots: Dict[Hashable, asyncio.Semaphore] = {}
+        self._refs: Dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        semaphore = self._slots.get(key)
+        if semaphore is None:
+            semaphore = self._slots[key] = asyncio.Semaphore(self.limit)
+        self._refs[key] = self._refs.get(key, 0) + 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._refs[key] -= 1
+            if not self._refs[key]:
+                del self._refs[key]
+                del self._slots[key]
+
+class WinRMExecutor:
+    """Run blocking WinRM calls on a bounded thread pool"""
+
+    def __init__(self, max_workers: int = None, per_user: int = None, per_host: int = None):
+        self.max_workers = max_workers or config.WINRM_MAX_WORKERS
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="winrm")
+        self._users = _KeyedLimiter(per_user or config.WINRM_MAX_PER_USER)
+        self._hosts = _KeyedLimiter(per_host or config.WINRM_MAX_PER_HOST)
+
+        # Metrics (updated from both the event loop and worker threads)
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        # Cancel tokens of in-flight calls per user, for /cancel (event loop only)
+        self._tokens: Dict[int, Set[Any]] = {}
+
+    async def run(self, user_id: int, host: str, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """Run func(*args, **kwargs) in the pool, honouring per-user and per-host limits.
+
+        Pass user_id=None for work that applies its own limit (such as fan-out).
+        A `token` keyword argument (a winrm_client.CancelToken) is registered for
+        cancel(user_id) and fired if this coroutine is cancelled, so the worker
+        stops the remote command instead of running on unobserved. Raises
+        health.HostDown straight away if the host's circuit is open.
+        """
+        host_health.guard(host)
+        token = kwargs.get('token')
+        if token is not None and user_id is not None:
+            self._tokens.setdefault(user_id, set()).add(token)
+        enqueued_at = time.monotonic()
+        with self._lock:
+            self.queued += 1
+        started = False
+
+        def call():
+            nonlocal started
+            # Wait time covers both the limiter queue and the thread pool queue
+            wait = time.monotonic() - enqueued_at
+            with self._lock:
+                started = True
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            EXECUTOR_WAIT_SECONDS.observe(wait)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+
+        try:
+            user_slot = self._users.hold(user_id) if user_id is not None else nullcontext()
+            async with user_slot, self._hosts.hold(host):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, call)
+        except asyncio.CancelledError:
+            if token is not None:
+                token.cancel("Command abandoned by its caller")
+            raise
+        finally:
+            if token is not None and user_id is not None:
+                tokens = self._tokens.get(user_id)
+                if tokens is not None:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._tokens[user_id]
+            with self._lock:
+                if not started:
+                    # Cancelled before a worker picked it up
+                    self.queued -= 1
+                    started = True
+
+    def cancel(self, user_id: int) -> int:
+        """Cancel every queued or running call of a user; returns how many were signalled"""
+        tokens = self._tokens.get(user_id, set())
+        for token in tokens:
+            token.cancel("Command cancelled with /cancel")
+        return len(tokens)
+
+    def stats(self) -> Dict[str, float]:
+        """Return queue depth and wait time metrics"""
+        with self._lock:
+            started = self.running + self.completed
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'avg_wait': self.total_wait / started if started else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+    def shutdown(self):
+        """Stop accepting work and release worker threads"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# Global executor
+winrm_executor = WinRMExecutor()
+
+registry.gauge('executor_calls', "WinRM calls waiting for or running on a worker thread", ['state'],
+               lambda: {('queued',): winrm_executor.queued, ('running',): winrm_executor.running})
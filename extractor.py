@@ -1,133 +1,241 @@
 import re
-from typing import Dict, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from metrics import EXTRACTOR_SECONDS
+
+# Any IPv4-looking token; messages without one are skipped outright
+IPV4 = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
+HOST_FORMAT = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?::\d+)?$')
+
+# One scanner for every format: labels, IPs and plain words in a single pass
+TOKEN = re.compile(
+    r'''
+    (?<!\w)(?:
+        (?P<host>ip|host|server|address|地址)
+      | (?P<user>username|user|login|用户名|用户)
+      | (?P<pass>password|pass|pwd|密码)
+    )(?!\w)[\s:\-=]*
+  | (?P<ip>\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?::\d+)?)(?!\w)
+  | (?P<word>[^\s,;➡→▶🔹•\ufe0f]+)
+    ''',
+    re.IGNORECASE | re.VERBOSE
+)
+
+# Words that are only separators, e.g. the dashes in "1.2.3.4 - admin - pass"
+SEPARATOR_WORD = re.compile(r'^[\-=|>:]+$')
+
+# Normalise full-width colons and long dashes before scanning
+TRANSLATION = str.maketrans({'：': ':', '–': '-', '—': '-'})
+
+# Candidate ranks, best first
+RANK_LABELED = 3      # IP: x User: y Pass: z (any order)
+RANK_FOLLOWING = 2    # 1.2.3.4 ➡️ admin ➡️ password
+RANK_SURROUNDING = 1  # admin 1.2.3.4 password
+
+FIELDS = ('host', 'user', 'pass')
+LABEL_SEPARATORS = ':-='
+
+Token = Tuple[str, str]
+
+class _LabelParser:
+    """Assemble labeled host/user/pass values into records, one token at a time"""
+
+    def __init__(self):
+        self.record: Dict[str, str] = {}
+        self.start = 0
+        self.pending = None
+        self.pending_label = ""
+
+    def feed(self, kind: str, value: str, index: int) -> Tuple[bool, Optional[Dict[str, str]]]:
+        """Returns (token is a labeled host value, completed record or None)"""
+        is_host = False
+        if self.pending:
+            if kind == self.pending and self.pending_label[-1] not in LABEL_SEPARATORS:
+                # Two-word label such as "IP Address:"
+                self.pending_label = value
+                return False, None
+            # The token after a label is its value, even if it looks like a label
+            self.record[self.pending] = value.rstrip(LABEL_SEPARATORS + ' ') if kind in FIELDS else value
+            is_host = self.pending == 'host'
+            self.pending = None
+        elif kind in FIELDS:
+            if kind in self.record:
+                # A repeated label before the record was complete starts over
+                self.record = {}
+            if not self.record:
+                self.start = index
+            self.pending = kind
+            self.pending_label = value
+
+        if len(self.record) == 3:
+            record, self.record = self.record, {}
+            return is_host, record
+        return is_host, None
 
 class CredentialExtractor:
     """Extract credentials from messy text dumps"""
-    
-    def __init__(self):
-        # Patterns for different credential formats
-        self.patterns = [
-            # IP: 192.168.1.1, User: admin, Pass: password
-            self._pattern_ip_user_pass,
-            # Host: 192.168.1.1:3389, Username: admin, Password: password
-            self._pattern_host_user_pass,
-            # Various separator patterns
-            self._pattern_with_separators,
-            # Simple space/tab separated
-            self._pattern_simple,
-        ]
-    
+
     def extract(self, text: str) -> Optional[Dict[str, str]]:
         """Extract credentials from text"""
-        text = self._preprocess_text(text)
-        
-        for pattern_func in self.patterns:
-            result = pattern_func(text)
-            if result and self._validate_credentials(result):
-                return result
-        
+        candidates = self.extract_candidates(text)
+        return candidates[0] if candidates else None
+
+    def extract_candidates(self, text: str) -> List[Dict[str, str]]:
+        """Return every valid credential candidate in text, best ranked first"""
+        with EXTRACTOR_SECONDS.time(mode='single'):
+            return self._extract_candidates(text)
+
+    def _extract_candidates(self, text: str) -> List[Dict[str, str]]:
+        if not IPV4.search(text):
+            return []
+        return self._rank(self._tokenize(text))
+
+    def parse_message(self, text: str) -> Tuple[List[Dict[str, str]], Optional[Dict[str, str]]]:
+        """Read a pasted message as a dump and as one login, tokenizing it once.
+
+        Returns (servers, None) if it lists several servers, else ([], best
+        credentials or None).
+        """
+        if not IPV4.search(text):
+            return [], None
+        with EXTRACTOR_SECONDS.time(mode='single'):
+            token_lines = [self._tokenize(line) for line in text.splitlines()]
+            found = list(self._extract_all(token_lines))
+            if len(found) > 1:
+                return found, None
+            candidates = self._rank([token for tokens in token_lines for token in tokens])
+            return [], candidates[0] if candidates else None
+
+    def _rank(self, tokens: List[Token]) -> List[Dict[str, str]]:
+        ranked = []
+        seen = set()
+        for rank, position, credentials in self._candidates(tokens):
+            key = (credentials['host'], credentials['username'], credentials['password'])
+            if key not in seen and self._validate_credentials(credentials):
+                seen.add(key)
+                ranked.append((-rank, position, credentials))
+
+        ranked.sort(key=lambda item: (item[0], item[1]))
+        return [credentials for _, _, credentials in ranked]
+
+    def extract_all(self, lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+        """Yield every credential triple in a dump, one per server, in a single pass.
+
+        lines may be a list or a lazily read file. Labeled records may span
+        lines; bare 'ip user pass' lines only count in dumps without labeled
+        records, since next to those a bare IP is a netmask, gateway or DNS
+        server. Bare lines are held back until the end for that reason.
+        """
+        return self._extract_all(self._tokenize(line) for line in lines)
+
+    def _extract_all(self, token_lines: Iterable[List[Token]]) -> Iterator[Dict[str, str]]:
+        labels = _LabelParser()
+        seen = set()
+        bare = []
+        labeled = False
+
+        def emit(credentials):
+            key = (credentials['host'], credentials['username'], credentials['password'])
+            if key not in seen and self._validate_credentials(credentials):
+                seen.add(key)
+                return credentials
+            return None
+
+        index = 0
+        for tokens in token_lines:
+            for kind, value in tokens:
+                _, record = labels.feed(kind, value, index)
+                index += 1
+                if record:
+                    labeled = True
+                    bare = []
+                    credentials = emit(self._as_credentials(record))
+                    if credentials:
+                        yield credentials
+            if not labeled:
+                credentials = self._bare_line(tokens)
+                if credentials:
+                    bare.append(credentials)
+
+        for credentials in bare:
+            credentials = emit(credentials)
+            if credentials:
+                yield credentials
+
+    def _bare_line(self, tokens: List[Token]) -> Optional[Dict[str, str]]:
+        """Credentials from a line with one IP and no labels: 'ip user pass' or 'user ip pass'"""
+        if any(kind in FIELDS for kind, _ in tokens):
+            return None
+        ips = [index for index, (kind, _) in enumerate(tokens) if kind == 'ip']
+        if len(ips) != 1:
+            return None
+        index = ips[0]
+        after = tokens[index + 1:index + 3]
+        if len(after) == 2 and all(kind == 'word' for kind, _ in after):
+            return {'host': tokens[index][1], 'username': after[0][1], 'password': after[1][1]}
+        if 0 < index < len(tokens) - 1 and tokens[index - 1][0] == tokens[index + 1][0] == 'word':
+            return {'host': tokens[index][1], 'username': tokens[index - 1][1], 'password': tokens[index + 1][1]}
         return None
-    
-    def _preprocess_text(self, text: str) -> str:
-        """Preprocess text for better extraction"""
-        # Remove extra whitespace but preserve structure
-        text = re.sub(r'\s+', ' ', text)
-        # Common replacements
-        text = text.replace('：', ':')  # Chinese colon to English
-        text = text.replace('–', '-')  # Different dash types
-        text = text.replace('—', '-')
-        return text.strip()
-    
-    def _pattern_ip_user_pass(self, text: str) -> Optional[Dict[str, str]]:
-        """Pattern: IP: x.x.x.x, User: xxx, Pass: xxx"""
-        patterns = [
-            r'(?:IP|Host|Server|地址)[\s:：\-]*([\d\.]+(?::\d+)?)[\s,;\-]*(?:User|Username|用户|用户名)[\s:：\-]*([^\s,;]+)[\s,;\-]*(?:Pass|Password|密码)[\s:：\-]*([^\s,;]+)',
-            r'(?:User|Username)[\s:：\-]*([^\s,;]+)[\s,;\-]*(?:Pass|Password)[\s:：\-]*([^\s,;]+)[\s,;\-]*(?:IP|Host)[\s:：\-]*([\d\.]+(?::\d+)?)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                return {
-                    'host': match.group(3) if 'User' in pattern else match.group(1),
-                    'username': match.group(1) if 'User' in pattern else match.group(2),
-                    'password': match.group(2) if 'User' in pattern else match.group(3)
+
+    def _tokenize(self, text: str) -> List[Token]:
+        """Split text into (kind, value) tokens: host/user/pass labels, ip or word"""
+        tokens = []
+        for match in TOKEN.finditer(text.translate(TRANSLATION)):
+            kind = match.lastgroup
+            if kind in FIELDS:
+                # Keep the separator so "IP Address:" and "Pass: pass" can be told apart
+                value = match.group().strip()
+            else:
+                value = match.group(kind)
+                if kind == 'word' and SEPARATOR_WORD.match(value):
+                    continue
+            tokens.append((kind, value))
+        return tokens
+
+    def _candidates(self, tokens: List[Token]):
+        """Yield (rank, position, credentials) for labeled records and bare IPs"""
+        labels = _LabelParser()
+        labeled_ips = set()
+
+        for index, (kind, value) in enumerate(tokens):
+            is_host, record = labels.feed(kind, value, index)
+            if is_host:
+                labeled_ips.add(index)
+            if record:
+                yield RANK_LABELED, labels.start, self._as_credentials(record)
+
+        for index, (kind, value) in enumerate(tokens):
+            if kind != 'ip' or index in labeled_ips:
+                continue
+            after = tokens[index + 1:index + 3]
+            if len(after) == 2 and all(k == 'word' for k, _ in after):
+                yield RANK_FOLLOWING, index, {'host': value, 'username': after[0][1], 'password': after[1][1]}
+            if 0 < index < len(tokens) - 1 and tokens[index - 1][0] == tokens[index + 1][0] == 'word':
+                yield RANK_SURROUNDING, index, {
+                    'host': value, 'username': tokens[index - 1][1], 'password': tokens[index + 1][1]
                 }
-        return None
-    
-    def _pattern_host_user_pass(self, text: str) -> Optional[Dict[str, str]]:
-        """Pattern with explicit labels"""
-        pattern = r'(?:Host|Server)[\s:：\-]*([\d\.]+(?::\d+)?)[^a-zA-Z]*(?:User|Username)[\s:：\-]*([^\s,;]+)[^a-zA-Z]*(?:Pass|Password)[\s:：\-]*([^\s,;]+)'
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return {
-                'host': match.group(1),
-                'username': match.group(2),
-                'password': match.group(3)
-            }
-        return None
-    
-    def _pattern_with_separators(self, text: str) -> Optional[Dict[str, str]]:
-        """Pattern with various separators like ➡️, →, etc."""
-        # Remove emojis and special characters but preserve structure
-        cleaned = re.sub(r'[➡️→▶️🔹•\-]+', ' ', text)
-        parts = cleaned.split()
-        
-        if len(parts) >= 3:
-            # Try to find IP pattern in parts
-            ip_pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?::\d+)?$'
-            for i, part in enumerate(parts):
-                if re.match(ip_pattern, part) and i + 2 < len(parts):
-                    return {
-                        'host': part,
-                        'username': parts[i+1],
-                        'password': parts[i+2]
-                    }
-        return None
-    
-    def _pattern_simple(self, text: str) -> Optional[Dict[str, str]]:
-        """Simple space/tab separated pattern"""
-        ip_pattern = r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?::\d+)?\b'
-        matches = list(re.finditer(ip_pattern, text))
-        
-        if matches:
-            # Take the first IP match and try to extract credentials around it
-            ip_match = matches[0]
-            start = max(0, ip_match.start() - 50)
-            end = min(len(text), ip_match.end() + 50)
-            context = text[start:end]
-            
-            # Split context and look for username/password near IP
-            parts = context.split()
-            for i, part in enumerate(parts):
-                if ip_match.group() in part:
-                    if i > 0 and i + 1 < len(parts):
-                        return {
-                            'host': ip_match.group(),
-                            'username': parts[i-1],
-                            'password': parts[i+1]
-                        }
-        return None
-    
+
+    def _as_credentials(self, record: Dict[str, str]) -> Dict[str, str]:
+        return {'host': record['host'], 'username': record['user'], 'password': record['pass']}
+
     def _validate_credentials(self, credentials: Dict[str, str]) -> bool:
         """Validate extracted credentials"""
         if not all(k in credentials for k in ['host', 'username', 'password']):
             return False
-        
+
         # Basic validation
         host = credentials['host']
         username = credentials['username']
         password = credentials['password']
-        
+
         # Validate host format
-        if not re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?::\d+)?$', host):
+        if not HOST_FORMAT.match(host):
             return False
-        
+
         # Basic length checks
         if len(username) < 1 or len(password) < 1:
             return False
-        
+
         return True
 
 # Global instance
-extractor = CredentialExtractor()
\ No newline at end of file
+extractor = CredentialExtractor()
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from config import config
+from async_winrm import async_run_command, async_test_connection
+from executor import winrm_executor
+from sessions import HostEntry
+from winrm_client import CancelToken, test_connection, run_command as run_remote_command
+
+@dataclass
+class HostResult:
+    """Outcome of one command on one host"""
+    entry: HostEntry
+    stdout: str = ""
+    stderr: str = ""
+    exit_code: Optional[int] = None
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.exit_code == 0
+
+    def summary_line(self, width: int = 60) -> str:
+        """One compact line: status, host, exit code and the first line of output"""
+        if self.error:
+            return f"❌ {self.entry.address} — {self.error}"
+        icon = "✅" if self.exit_code == 0 else "⚠️"
+        first = next((line.strip() for line in (self.stdout or self.stderr).splitlines() if line.strip()), "")
+        if len(first) > width:
+            first = first[:width - 1] + "…"
+        return f"{icon} {self.entry.address} [{self.exit_code}] {self.elapsed:.1f}s {first}".rstrip()
+
+async def run_on_hosts(hosts: List[HostEntry], command: str, powershell: bool = False,
+                       timeout: float = None, concurrency: int = None) -> AsyncIterator[HostResult]:
+    """Run one command on many hosts at once, yielding results as they finish"""
+    async def run(entry: HostEntry, result: HostResult):
+        if config.WINRM_ASYNC:
+            result.stdout, result.stderr, result.exit_code = await async_run_command(
+                entry.host, entry.username, entry.password, entry.port, command, powershell=powershell
+            )
+            return
+        result.stdout, result.stderr, result.exit_code = await winrm_executor.run(
+            None, entry.host, run_remote_command,
+            entry.host, entry.username, entry.password, entry.port, command, powershell=powershell,
+            # Fired by the executor when the per-host timeout cancels this call
+            token=CancelToken()
+        )
+
+    async for result in _fan_out(hosts, run, timeout, concurrency):
+        yield result
+
+async def verify_hosts(hosts: List[HostEntry], timeout: float = None,
+                       concurrency: int = None) -> AsyncIterator[HostResult]:
+    """Test credentials on many hosts at once; exit_code is 0 when the login works"""
+    async def verify(entry: HostEntry, result: HostResult):
+        if config.WINRM_ASYNC:
+            success, result.stdout = await async_test_connection(
+                entry.host, entry.username, entry.password, entry.port
+            )
+        else:
+            success, result.stdout = await winrm_executor.run(
+                None, entry.host, test_connection, entry.host, entry.username, entry.password, entry.port
+            )
+        result.exit_code = 0 if success else 1
+
+    async for result in _fan_out(hosts, verify, timeout, concurrency):
+        yield result
+
+async def _fan_out(hosts: List[HostEntry], work: Callable[[HostEntry, HostResult], Awaitable[None]],
+                   timeout: float = None, concurrency: int = None) -> AsyncIterator[HostResult]:
+    """Run work for every host under one concurrency limit and a per-host timeout"""
+    timeout = timeout or config.FANOUT_TIMEOUT
+    limit = asyncio.Semaphore(concurrency or config.FANOUT_CONCURRENCY)
+
+    async def run_one(entry: HostEntry) -> HostResult:
+        async with limit:
+            started = time.monotonic()
+            result = HostResult(entry=entry)
+            try:
+                # Fan-out has its own limit, so the work skips the per-user one
+                await asyncio.wait_for(work(entry, result), timeout)
+            except asyncio.TimeoutError:
+                result.error = f"timed out after {timeout:g}s"
+            except Exception as e:
+                result.error = str(e) or e.__class__.__name__
+            result.elapsed = time.monotonic() - started
+            return result
+
+    for finished in asyncio.as_completed([run_one(entry) for entry in hosts]):
+        yield await finished
+
+def format_bundle(results: List[HostResult], command: str) -> str:
+    """Full per-host output as one text file body"""
+    sections = [f"Command: {command}\n"]
+    for result in sorted(results, key=lambda r: r.entry.address):
+        header = f"===== {result.entry.address} ({result.entry.username}) "
+        if result.error:
+            sections.append(f"{header}ERROR =====\n{result.error}\n")
+            continue
+        body = result.stdout
+        if result.stderr:
+            body += f"\n----- stderr -----\n{result.stderr}"
+        sections.append(f"{header}exit {result.exit_code}, {result.elapsed:.1f}s =====\n{body}\n")
+    return "\n".join(sections)
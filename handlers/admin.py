@@ -0,0 +1,76 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.constants import ParseMode
+
+from config import config
+from sessions import session_manager
+from executor import winrm_executor
+from winrm_client import winrm_pool
+from cache import result_cache
+from jobs import job_manager
+from watches import watch_manager
+from health import host_health
+from metrics import (Histogram, WINRM_CONNECT_SECONDS, WINRM_COMMAND_SECONDS, EXECUTOR_WAIT_SECONDS,
+                     TELEGRAM_REQUEST_SECONDS, EXTRACTOR_SECONDS, WINRM_FAILURES, WINRM_TIMEOUTS,
+                     WINRM_CANCELLED)
+from security import allowed_users_only, admin_only
+
+def format_seconds(value: float) -> str:
+    """Short duration such as 250ms or 2.5s"""
+    if value == float('inf'):
+        return "∞"
+    return f"{value * 1000:g}ms" if value < 1 else f"{value:g}s"
+
+def describe_histogram(histogram: Histogram, **labels: str) -> str:
+    """Observation count and bucketed p50/p95/p99 for one label set"""
+    count, total = histogram.totals(**labels)
+    if not count:
+        return "no data"
+    p50, p95, p99 = (histogram.quantile(q, **labels) for q in (0.5, 0.95, 0.99))
+    return (f"n={count}, avg {format_seconds(total / count)}, p50 ≤{format_seconds(p50)}, "
+            f"p95 ≤{format_seconds(p95)}, p99 ≤{format_seconds(p99)}")
+
+@allowed_users_only
+@admin_only
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /stats command: latency percentiles, error counts and live state of this process"""
+    sessions = session_manager.stats()
+    pool = winrm_pool.stats()
+    executor = winrm_executor.stats()
+    cache = result_cache.stats()
+    jobs = job_manager.stats()
+    watches = watch_manager.stats()
+    hosts = host_health.stats()
+    failures = WINRM_FAILURES.snapshot()
+    lookups = cache['hits'] + cache['misses']
+    telegram_methods = sorted(key[0] for key in TELEGRAM_REQUEST_SECONDS.snapshot())
+
+    lines = [
+        "📊 **Bot stats**",
+        f"**Sessions:** {sessions['live']} live, {sessions['expired']} expired, {sessions['groups']} groups",
+        f"**Pool:** {pool['size']}/{pool['max_size']} clients ({pool['idle']} idle), "
+        f"{pool['hits']} reused, {pool['misses']} opened",
+        f"**Executor:** {executor['queue_depth']} queued, {executor['running']}/{executor['workers']} running, "
+        f"max wait {format_seconds(executor['max_wait'])}",
+        f"**Cache:** {cache['hits']}/{lookups} hits, {cache['entries']} entries",
+        f"**Jobs:** {jobs['active']} active, {jobs['completed']} completed",
+        f"**Watches:** {watches['active']} active, {watches['runs']} runs",
+        f"**Hosts:** {hosts['open']} down, {hosts['half_open']} probing, {hosts['failing']} failing, "
+        f"{hosts['rejected_logins']} rejected logins remembered",
+        f"**Failures:** {int(failures.get(('connect',), 0))} connect, {int(failures.get(('command',), 0))} command, "
+        f"{int(sum(WINRM_TIMEOUTS.snapshot().values()))} timeouts, "
+        f"{int(sum(WINRM_CANCELLED.snapshot().values()))} cancelled",
+        "",
+        "⏱ **Latency**",
+        f"Connect: {describe_histogram(WINRM_CONNECT_SECONDS)}",
+        f"CMD: {describe_histogram(WINRM_COMMAND_SECONDS, shell='cmd')}",
+        f"PowerShell: {describe_histogram(WINRM_COMMAND_SECONDS, shell='ps')}",
+        f"Executor wait: {describe_histogram(EXECUTOR_WAIT_SECONDS)}",
+        f"Extractor: {describe_histogram(EXTRACTOR_SECONDS, mode='single')}",
+    ]
+    lines += [f"Telegram {method}: {describe_histogram(TELEGRAM_REQUEST_SECONDS, method=method)}"
+              for method in telegram_methods]
+    if config.METRICS_PORT:
+        lines += ["", f"Full metrics: `http://{config.METRICS_LISTEN}:{config.METRICS_PORT}/metrics`"]
+
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
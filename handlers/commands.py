@@ -4,9 +4,28 @@ from telegram.constants import ParseMode
 
 from config import config
 from sessions import session_manager
-from winrm_client import test_connection, WinRMClient
+from executor import winrm_executor
+from health import HostDown
+from winrm_client import CancelToken, CommandCancelled, test_connection, run_script, run_command as run_remote_command
 from security import allowed_users_only, delete_credential_message
-from utils import truncate_text, format_command_output, validate_host
+from cache import result_cache
+from delivery import ack_of, reply, send_output, with_ack
+from streaming import stream_command
+from jobs import job_manager
+from pipeline import parse_pipeline, prepare_pipeline
+from handlers.jobs import start_job
+from structured import build_json_command, parse_json_output, parse_filters, query, render_table
+from utils import validate_host, parse_flags, split_powershell
+
+# Options accepted before the command in /run
+RUN_FLAGS = {'stream': bool, 'fresh': bool, 'bg': bool, 'timeout': float}
+
+# Options accepted before the command in /ps; any table option implies --json
+PS_FLAGS = {'json': bool, 'cols': str, 'sort': str, 'top': int, 'where': str, 'fresh': bool, 'timeout': float}
+TABLE_OPTIONS = ('json', 'cols', 'sort', 'top', 'where')
+
+# Options accepted on the first line of /script
+SCRIPT_FLAGS = {'ps': bool, 'continue': bool, 'timeout': float}
 
 @allowed_users_only
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -19,12 +38,24 @@ I help you manage Windows servers via WinRM when RDP is unstable.
 **Available Commands:**
 /connect <host> <username> <password> [port] - Manual connection
 /run <command> - Execute command (CMD or PowerShell)
+/ps [--json] <command> - PowerShell, optionally as a sorted/filtered table
+/group add <name> <host> <username> <password> - Build a host group
+/runall <group> <command> - Run on every host in a group
+/script - Run several commands (one per line) in one shell
+/download <path> - Fetch a file from the server
+/upload <path> - Send a file with this caption to put it on the server
+/jobs - List background jobs (start one with /run --bg)
+/result <id> - Show a background job's output
+/watch <interval> <command> - Re-run a command and report only changes
+/unwatch [id] - Stop watches
+/cancel [id] - Stop your running commands and jobs
 /status - Show current session status
 /disconnect - Clear credentials
 /help - Show this help
 
 **Auto-extraction:** Just paste credential dumps like:
 `IP: 192.168.1.1 User: admin Pass: password`
+Dumps with many servers (pasted or as a .txt file) are tested and saved as a host group.
 
 **Security:** Sessions auto-expire after 15 minutes.
     """
@@ -53,10 +84,30 @@ Password: password123
    - `/run ipconfig`
    - `/run powershell Get-Service`
    - `/run dir C:\\`
+   - `/run --stream ping -n 10 8.8.8.8` (live output)
+   - `/run --timeout 60 chkdsk C:` (stop after 60s)
+   - `/script` with one command per line on the following lines
+   - `/run type C:\\app.log | tail 50` (also `| head N`, `| grep text`, `| count`)
+   - `/ps --sort -CPU --top 10 Get-Process` (PowerShell objects as a compact table)
+   - `/run --bg systeminfo` runs in the background; `/jobs` and `/result <id>` show progress and output
+   - `/cancel` stops whatever you have running, `/cancel 3` just job 3
+   - `/watch 5m tasklist` re-runs every 5 minutes and sends only the changed lines; `/unwatch` stops it
+
+4. **Move files:**
+   - `/download C:\\inetpub\\logs\\u_ex.log` sends the file back as a document
+   - Send a file captioned `/upload C:\\Temp\\tool.zip` (or reply to one with it)
+   - Both check SHA-256; an interrupted transfer resumes when you repeat the command
 
-4. **Manage session:**
+5. **Run on many servers:**
+   - `/group add web 10.0.0.5 admin pass123`
+   - `/group list`
+   - `/runall web hostname`
+   - `/runall --timeout 30 web powershell Get-Service W3SVC`
+
+6. **Manage session:**
    - `/status` - Check connection
    - `/disconnect` - Clear credentials
+   - `/stats` - Latency and error counters (admins only)
 
 ⚡ **Features:**
 - Auto credential extraction
@@ -89,25 +140,31 @@ async def connect(update: Update, context: ContextTypes.DEFAULT_TYPE):
     password = context.args[2]
     port = int(context.args[3]) if len(context.args) > 3 and context.args[3].isdigit() else None
     
-    # Test connection
-    await update.message.reply_text("🔌 Testing connection...")
-    success, message = test_connection(host, username, password, port)
+    # Test connection; a slow test gets a status message that the result replaces
+    try:
+        (success, message), ack = await with_ack(
+            update.message, "🔌 Testing connection...",
+            winrm_executor.run(user_id, host, test_connection, host, username, password, port)
+        )
+    except HostDown as e:
+        (success, message), ack = (False, str(e)), ack_of(e)
     
     if success:
         # Create session
         session = session_manager.create_session(user_id, host, username, password, port)
         session_manager.update_session_connection(user_id, True)
         
-        await update.message.reply_text(
+        await reply(
+            update.message,
             f"✅ **Connected successfully!**\n"
             f"**Host:** `{host}:{port or config.WINRM_PORT}`\n"
             f"**User:** `{username}`\n"
             f"**Test:** `{message}`\n\n"
             f"Use `/run <command>` to execute commands.",
-            parse_mode=ParseMode.MARKDOWN
+            ack
         )
     else:
-        await update.message.reply_text(f"❌ **Connection failed:** {message}")
+        await reply(update.message, f"❌ **Connection failed:** {message}", ack, parse_mode=None)
 
 @allowed_users_only
 async def run_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -122,82 +179,317 @@ async def run_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    if not context.args:
+    try:
+        options, args = parse_flags(context.args or [], RUN_FLAGS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if not args:
         await update.message.reply_text(
             "❌ **Usage:** `/run <command>`\n\n"
             "**Examples:**\n"
             "• `/run ipconfig`\n"
             "• `/run powershell Get-Process`\n"
-            "• `/run dir C:\\`",
+            "• `/run dir C:\\`\n"
+            "• `/run --stream ping -n 10 8.8.8.8` (live output)\n"
+            "• `/run --fresh systeminfo` (skip the result cache)\n"
+            "• `/run --bg systeminfo` (background job, see /jobs)\n"
+            "• `/run type C:\\app.log | tail 50` (also `| head N`, `| grep [-v] [-i] text`, `| count`)\n"
+            f"• `/run --timeout 60 <command>` (default {config.WINRM_COMMAND_TIMEOUT:g}s, 0 for none)",
             parse_mode=ParseMode.MARKDOWN
         )
         return
     
-    command = ' '.join(context.args)
+    # A multi-line /run is a script: one command per line on one shell
+    if '\n' in update.message.text:
+        unsupported = [f"--{name}" for name in ('bg', 'stream', 'fresh') if options.get(name)]
+        if unsupported:
+            await update.message.reply_text(
+                f"❌ {', '.join(unsupported)} can't be used with several lines. Multi-line commands run as "
+                "a script: `/script [--ps] [--continue] [--timeout N]` followed by one command per line.",
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+        await script(update, context)
+        return
+    
+    command = ' '.join(args)
     
     # Determine if it's PowerShell or CMD
-    if command.lower().startswith('powershell'):
-        # Extract the actual PowerShell command
-        ps_command = command[10:].strip()  # Remove 'powershell'
-        await execute_powershell(update, session, ps_command)
+    command, powershell = split_powershell(command)
+    try:
+        parse_pipeline(command)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    timeout = options.get('timeout', config.WINRM_COMMAND_TIMEOUT)
+    
+    if options.get('bg'):
+        await start_job(update, context, session, command, powershell, options.get('timeout'))
+    elif options.get('stream'):
+        try:
+            await stream_command(update, session, command, powershell, timeout)
+        except CommandCancelled as e:
+            await update.message.reply_text(f"⏹ {e}")
+        except Exception as e:
+            await update.message.reply_text(f"❌ **Error executing command:** {str(e)}")
+    elif powershell:
+        await execute_powershell(update, session, command, options.get('fresh', False), timeout)
     else:
-        await execute_cmd(update, session, command)
+        await execute_cmd(update, session, command, options.get('fresh', False), timeout)
+
+async def reply_from_cache(update: Update, session, command: str, shell: str, fresh: bool) -> bool:
+    """Answer from the result cache if enabled and fresh; returns True on a hit"""
+    if not config.RESULT_CACHE_ENABLED or fresh:
+        return False
+    cached = result_cache.get(session.address, session.username, shell, command)
+    if not cached:
+        return False
+    stdout, stderr, exit_code, age = cached
+    await send_output(update.message, stdout, stderr, exit_code)
+    await update.message.reply_text(f"♻️ Cached result from {int(age)}s ago. Use `/run --fresh` to rerun.",
+                                    parse_mode=ParseMode.MARKDOWN)
+    return True
 
-async def execute_cmd(update: Update, session, command: str):
+async def execute_cmd(update: Update, session, command: str, fresh: bool = False, timeout: float = None):
     """Execute CMD command"""
     user_id = update.effective_user.id
     
     try:
-        # Create WinRM client if not exists
-        if not session.winrm_client:
-            session.winrm_client = WinRMClient(session.host, session.username, session.password, session.port)
-            session.winrm_client.session = winrm.Session(
-                f"{session.host}:{session.port}",
-                auth=(session.username, session.password),
-                transport='ntlm',
-                server_cert_validation='ignore'
-            )
+        if await reply_from_cache(update, session, command, 'cmd', fresh):
+            return
         
-        await update.message.reply_text(f"🖥️ **Executing:** `{command}`", parse_mode=ParseMode.MARKDOWN)
-        
-        stdout, stderr, exit_code = session.winrm_client.run_cmd(command)
-        
-        # Format output
-        output = format_command_output(stdout, stderr, exit_code)
-        truncated_output = truncate_text(output, config.MAX_OUTPUT_LENGTH)
+        remote, output_filter = prepare_pipeline(command)
+        (stdout, stderr, exit_code), ack = await with_ack(
+            update.message, f"🖥️ **Executing:** `{command}`",
+            winrm_executor.run(
+                user_id, session.host, run_remote_command,
+                session.host, session.username, session.password, session.port, remote,
+                token=CancelToken(timeout), output_filter=output_filter
+            )
+        )
+        if config.RESULT_CACHE_ENABLED:
+            result_cache.put(session.address, session.username, 'cmd', command, stdout, stderr, exit_code)
         
-        await update.message.reply_text(truncated_output, parse_mode=ParseMode.MARKDOWN)
+        await send_output(update.message, stdout, stderr, exit_code, ack=ack)
         
+    except CommandCancelled as e:
+        await reply(update.message, f"⏹ {e}", ack_of(e), parse_mode=None)
     except Exception as e:
-        await update.message.reply_text(f"❌ **Error executing command:** {str(e)}")
+        await reply(update.message, f"❌ **Error executing command:** {str(e)}", ack_of(e), parse_mode=None)
 
-async def execute_powershell(update: Update, session, command: str):
+async def execute_powershell(update: Update, session, command: str, fresh: bool = False,
+                             timeout: float = None):
     """Execute PowerShell command"""
     user_id = update.effective_user.id
     
     try:
-        # Create WinRM client if not exists
-        if not session.winrm_client:
-            session.winrm_client = WinRMClient(session.host, session.username, session.password, session.port)
-            session.winrm_client.session = winrm.Session(
-                f"{session.host}:{session.port}",
-                auth=(session.username, session.password),
-                transport='ntlm',
-                server_cert_validation='ignore'
-            )
-        
-        await update.message.reply_text(f"💻 **Executing PowerShell:** `{command}`", parse_mode=ParseMode.MARKDOWN)
+        if await reply_from_cache(update, session, command, 'ps', fresh):
+            return
         
-        stdout, stderr, exit_code = session.winrm_client.run_ps(command)
-        
-        # Format output
-        output = format_command_output(stdout, stderr, exit_code)
-        truncated_output = truncate_text(output, config.MAX_OUTPUT_LENGTH)
+        remote, output_filter = prepare_pipeline(command, powershell=True)
+        (stdout, stderr, exit_code), ack = await with_ack(
+            update.message, f"💻 **Executing PowerShell:** `{command}`",
+            winrm_executor.run(
+                user_id, session.host, run_remote_command,
+                session.host, session.username, session.password, session.port, remote, powershell=True,
+                token=CancelToken(timeout), output_filter=output_filter
+            )
+        )
+        if config.RESULT_CACHE_ENABLED:
+            result_cache.put(session.address, session.username, 'ps', command, stdout, stderr, exit_code)
         
-        await update.message.reply_text(truncated_output, parse_mode=ParseMode.MARKDOWN)
+        await send_output(update.message, stdout, stderr, exit_code, ack=ack)
         
+    except CommandCancelled as e:
+        await reply(update.message, f"⏹ {e}", ack_of(e), parse_mode=None)
     except Exception as e:
-        await update.message.reply_text(f"❌ **Error executing PowerShell:** {str(e)}")
+        await reply(update.message, f"❌ **Error executing PowerShell:** {str(e)}", ack_of(e), parse_mode=None)
+
+@allowed_users_only
+async def ps(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /ps command: run PowerShell, or query its objects as JSON and show a table"""
+    session = session_manager.get_session(update.effective_user.id)
+    
+    if not session or not session.is_connected:
+        await update.message.reply_text(
+            "❌ **No active session.**\n"
+            "Please connect first using /connect or paste credentials."
+        )
+        return
+    
+    try:
+        options, args = parse_flags(context.args or [], PS_FLAGS)
+        filters = parse_filters(options.get('where', ''))
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if not args:
+        await update.message.reply_text(
+            "❌ **Usage:** `/ps [--json] [--cols a,b] [--sort [-]col] [--top N] [--where col>value] <command>`\n\n"
+            "**Examples:**\n"
+            "• `/ps Get-Service`\n"
+            "• `/ps --json --sort -CPU --top 10 Get-Process`\n"
+            "• `/ps --cols Name,Status --where Status=Running Get-Service`\n\n"
+            "Filters use `= != > < >= <=` or `~` (contains); separate several with commas.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    command = ' '.join(args)
+    timeout = options.get('timeout', config.WINRM_COMMAND_TIMEOUT)
+    if any(name in options for name in TABLE_OPTIONS):
+        await execute_json_query(update, session, command, options, filters, timeout)
+    else:
+        await execute_powershell(update, session, command, options.get('fresh', False), timeout)
+
+async def execute_json_query(update: Update, session, command: str, options, filters, timeout: float = None):
+    """Run a PowerShell command as JSON, then filter, sort and tabulate it locally"""
+    columns = [column.strip() for column in options.get('cols', '').split(',') if column.strip()]
+    sort = options.get('sort')
+    top = options.get('top')
+    # Columns needed for sorting and filtering are fetched even if not shown
+    extra = ([sort.lstrip('-+')] if sort else []) + [column for column, _, _ in filters]
+    script_text = build_json_command(
+        command, columns, extra,
+        # Without sorting or filtering, top-N can stop the remote pipeline early
+        first=top if not sort and not filters else None
+    )
+    
+    try:
+        (stdout, stderr, exit_code), ack = await with_ack(
+            update.message, f"💻 **Querying:** `{command}`",
+            winrm_executor.run(
+                update.effective_user.id, session.host, run_remote_command,
+                session.host, session.username, session.password, session.port, script_text,
+                powershell=True, token=CancelToken(timeout)
+            )
+        )
+    except CommandCancelled as e:
+        await reply(update.message, f"⏹ {e}", ack_of(e), parse_mode=None)
+        return
+    except Exception as e:
+        await reply(update.message, f"❌ **Error executing PowerShell:** {str(e)}", ack_of(e), parse_mode=None)
+        return
+    
+    try:
+        rows = parse_json_output(stdout)
+        shown, selected = query(rows, columns, sort, top, filters)
+    except ValueError as e:
+        if exit_code != 0:
+            # The command itself failed; its error explains more than the parse
+            await send_output(update.message, stdout, stderr, exit_code, ack=ack)
+        else:
+            await reply(update.message, f"❌ {e}", ack, parse_mode=None)
+        return
+    
+    table = render_table(shown, selected)
+    if len(selected) != len(rows):
+        table += f"\n\n({len(selected)} of {len(rows)} rows)"
+    await send_output(update.message, table, stderr, exit_code, name="ps", ack=ack)
+
+@allowed_users_only
+async def script(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /script command: run one command per line in a single remote shell"""
+    user_id = update.effective_user.id
+    session = session_manager.get_session(user_id)
+    
+    if not session or not session.is_connected:
+        await update.message.reply_text(
+            "❌ **No active session.**\n"
+            "Please connect first using /connect or paste credentials."
+        )
+        return
+    
+    first_line, _, body = update.message.text.partition('\n')
+    try:
+        options, rest = parse_flags(first_line.split()[1:], SCRIPT_FLAGS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    lines = ([' '.join(rest)] if rest else []) + body.splitlines()
+    
+    commands = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        command, powershell = split_powershell(line)
+        commands.append((command, powershell or options.get('ps', False)))
+    
+    if not commands:
+        await update.message.reply_text(
+            "❌ **Usage:** `/script [--ps] [--continue] [--timeout N]` followed by one command per line\n\n"
+            "**Example:**\n"
+            "```\n/script\nhostname\nipconfig\npowershell Get-Service W3SVC\n```\n"
+            "Stops at the first failing command unless `--continue` is given. "
+            "`--timeout` limits the whole script.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    if len(commands) > config.SCRIPT_MAX_COMMANDS:
+        await update.message.reply_text(f"❌ Scripts are limited to {config.SCRIPT_MAX_COMMANDS} commands.")
+        return
+    
+    stop_on_error = not options.get('continue', False)
+    try:
+        results, ack = await with_ack(
+            update.message, f"📜 **Running {len(commands)} commands...**",
+            winrm_executor.run(
+                user_id, session.host, run_script,
+                session.host, session.username, session.password, session.port, commands, stop_on_error,
+                token=CancelToken(options.get('timeout', config.WINRM_COMMAND_TIMEOUT))
+            )
+        )
+        report, exit_code = format_script_report(results, len(commands))
+        await send_output(update.message, report, "", exit_code, name="script", ack=ack)
+    except Exception as e:
+        await reply(update.message, f"❌ **Error executing script:** {str(e)}", ack_of(e), parse_mode=None)
+
+def format_script_report(results, total: int):
+    """One section per command; returns (report, last non-zero exit code or 0)"""
+    sections = []
+    exit_code = 0
+    for number, (command, stdout, stderr, code) in enumerate(results, 1):
+        section = [f"▶ [{number}/{total}] {command}  (exit {code})"]
+        if stdout.strip():
+            section.append(stdout.rstrip())
+        if stderr.strip():
+            section.append(f"stderr: {stderr.rstrip()}")
+        sections.append("\n".join(section))
+        if code != 0:
+            exit_code = code
+    skipped = total - len(results)
+    if skipped:
+        sections.append(f"⏹ Stopped after command {len(results)} failed; {skipped} skipped.")
+    return "\n\n".join(sections), exit_code
+
+@allowed_users_only
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /cancel command: stop the user's commands and background jobs, or one job by ID"""
+    user_id = update.effective_user.id
+    
+    if context.args:
+        job_id = context.args[0].lstrip('#')
+        if not job_id.isdigit():
+            await update.message.reply_text("❌ **Usage:** `/cancel [job id]`", parse_mode=ParseMode.MARKDOWN)
+            return
+        cancelled = job_manager.cancel(user_id, int(job_id))
+        if not cancelled:
+            await update.message.reply_text(f"ℹ️ Job #{job_id} isn't running.")
+            return
+    else:
+        cancelled = winrm_executor.cancel(user_id) + job_manager.cancel(user_id)
+    
+    if cancelled:
+        await update.message.reply_text(
+            f"⏹ **Cancelling {cancelled} command(s)...** Each stops on the server within "
+            f"{config.WINRM_TIMEOUT}s.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+    else:
+        await update.message.reply_text("ℹ️ **Nothing to cancel.**", parse_mode=ParseMode.MARKDOWN)
 
 @allowed_users_only
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -228,7 +520,8 @@ async def disconnect(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /disconnect command"""
     user_id = update.effective_user.id
     
-    if session_manager.delete_session(user_id):
+    cleared_groups = session_manager.clear_groups(user_id)
+    if session_manager.delete_session(user_id) or cleared_groups:
         await update.message.reply_text("✅ **Session disconnected and credentials cleared.**")
     else:
         await update.message.reply_text("ℹ️ **No active session to disconnect.**")
\ No newline at end of file
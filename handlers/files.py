@@ -0,0 +1,153 @@
+import ntpath
+import time
+from telegram import Message, Update
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+from telegram.constants import FileSizeLimit, ParseMode
+
+from config import config
+from sessions import session_manager
+from security import allowed_users_only
+from transfer import transfer_manager
+
+def format_size(size: float) -> str:
+    """Human-readable byte count such as 12.5 MB"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def progress_reporter(ack: Message, label: str):
+    """Progress callback that edits the ack message at most every STREAM_EDIT_INTERVAL seconds"""
+    started = time.monotonic()
+    last = started
+
+    async def progress(done: int, total: int):
+        nonlocal last
+        now = time.monotonic()
+        if now - last < config.STREAM_EDIT_INTERVAL and done < total:
+            return
+        last = now
+        rate = done / max(now - started, 0.001)
+        try:
+            await ack.edit_text(f"{label}\n{format_size(done)} / {format_size(total)} "
+                                f"({format_size(rate)}/s)", parse_mode=ParseMode.MARKDOWN)
+        except TelegramError:
+            # Progress is best effort
+            pass
+
+    return progress
+
+async def get_connected_session(update: Update):
+    """The user's connected session, or None after telling them to connect"""
+    session = session_manager.get_session(update.effective_user.id)
+    if not session or not session.is_connected:
+        await update.message.reply_text(
+            "❌ **No active session.**\n"
+            "Please connect first using /connect or paste credentials."
+        )
+        return None
+    return session
+
+@allowed_users_only
+async def download(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /download command: send a remote file as a document"""
+    session = await get_connected_session(update)
+    if not session:
+        return
+
+    if not context.args:
+        await update.message.reply_text(
+            "❌ **Usage:** `/download <remote path>`\n\n"
+            "**Example:** `/download C:\\Windows\\Logs\\CBS\\CBS.log`\n"
+            f"Files up to {format_size(config.TRANSFER_MAX_BYTES)}; an interrupted download resumes "
+            "when you send the same command again.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+
+    remote_path = ' '.join(context.args)
+    name = ntpath.basename(remote_path) or "download"
+    label = f"⬇️ **Downloading** `{remote_path}`"
+    ack = await update.message.reply_text(label, parse_mode=ParseMode.MARKDOWN)
+
+    try:
+        state = await transfer_manager.download(
+            update.effective_user.id, session, remote_path, progress_reporter(ack, label)
+        )
+    except Exception as e:
+        await ack.edit_text(f"❌ Download failed: {e}")
+        return
+
+    try:
+        with open(state.data_path, 'rb') as document:
+            await update.message.reply_document(
+                document=document,
+                filename=name,
+                caption=f"📎 {name} ({state.size:,} bytes) · SHA-256 {state.sha256[:16]}… verified"
+            )
+    finally:
+        state.discard()
+    try:
+        await ack.delete()
+    except TelegramError:
+        pass
+
+@allowed_users_only
+async def upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /upload: as a document caption, or as a reply to a document"""
+    session = await get_connected_session(update)
+    if not session:
+        return
+
+    message = update.message
+    if message.document:
+        document, text = message.document, message.caption or ""
+    else:
+        reply_to = message.reply_to_message
+        document, text = (reply_to.document if reply_to else None), message.text or ""
+    parts = text.split(None, 1)
+    remote_path = parts[1].strip() if len(parts) > 1 else ""
+
+    if not document or not remote_path:
+        await message.reply_text(
+            "❌ **Usage:** send a file with the caption `/upload <remote path>`, "
+            "or reply to a file with `/upload <remote path>`.\n\n"
+            "**Example:** `/upload C:\\Temp\\tool.zip`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    if document.file_size and document.file_size > config.TRANSFER_MAX_BYTES:
+        await message.reply_text(f"❌ File too large to upload (limit {format_size(config.TRANSFER_MAX_BYTES)}).")
+        return
+    if not config.BOT_API_URL and document.file_size and document.file_size > FileSizeLimit.FILESIZE_DOWNLOAD:
+        # getFile on the cloud Bot API refuses anything bigger
+        await message.reply_text(
+            "❌ Telegram only lets bots fetch files up to 20 MB. "
+            "Set BOT_API_URL to a local Bot API server to upload larger ones."
+        )
+        return
+
+    label = f"⬆️ **Uploading** `{document.file_name or 'file'}` to `{remote_path}`"
+    ack = await message.reply_text(label, parse_mode=ParseMode.MARKDOWN)
+
+    async def fetch(path: str):
+        telegram_file = await document.get_file()
+        # Streams to disk rather than into memory
+        await telegram_file.download_to_drive(path)
+
+    try:
+        state = await transfer_manager.upload(
+            update.effective_user.id, session, remote_path, document.file_unique_id, fetch,
+            progress_reporter(ack, label)
+        )
+    except Exception as e:
+        await ack.edit_text(f"❌ Upload failed: {e}")
+        return
+
+    await ack.edit_text(
+        f"✅ **Uploaded** `{remote_path}`\n"
+        f"{state.size:,} bytes · SHA-256 `{state.sha256[:16]}…` verified",
+        parse_mode=ParseMode.MARKDOWN
+    )
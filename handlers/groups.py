@@ -0,0 +1,131 @@
+import time
+from typing import List
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
+
+from config import config
+from sessions import session_manager
+from delivery import build_text_document
+from fanout import HostResult, run_on_hosts, format_bundle
+from security import allowed_users_only, delete_credential_message
+from utils import validate_host, parse_flags, split_powershell, split_text
+
+# Options accepted before the group name in /runall
+RUNALL_FLAGS = {'timeout': float}
+
+GROUP_USAGE = (
+    "❌ **Usage:**\n"
+    "`/group add <name> <host> <username> <password> [port]`\n"
+    "`/group remove <name> <host>`\n"
+    "`/group list [name]`\n"
+    "`/group delete <name>`"
+)
+
+@allowed_users_only
+async def group(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /group command"""
+    user_id = update.effective_user.id
+    args = context.args or []
+    action = args[0].lower() if args else ""
+
+    if action == "add" and len(args) >= 5:
+        # The message holds a password
+        await delete_credential_message(update, context)
+        host = validate_host(args[2])
+        if not host:
+            await update.message.reply_text("❌ Invalid host format. Use IP address with optional port.")
+            return
+        port = int(args[5]) if len(args) > 5 and args[5].isdigit() else None
+        entry = session_manager.add_group_host(user_id, args[1], host, args[3], args[4], port)
+        count = len(session_manager.get_group(user_id, args[1]).hosts)
+        await update.message.reply_text(
+            f"✅ Added `{entry.address}` to **{args[1]}** ({count} hosts).",
+            parse_mode=ParseMode.MARKDOWN
+        )
+    elif action == "remove" and len(args) >= 3:
+        if session_manager.remove_group_host(user_id, args[1], args[2]):
+            await update.message.reply_text(f"✅ Removed `{args[2]}` from **{args[1]}**.", parse_mode=ParseMode.MARKDOWN)
+        else:
+            await update.message.reply_text("ℹ️ **No such host in that group.**")
+    elif action == "delete" and len(args) >= 2:
+        if session_manager.delete_group(user_id, args[1]):
+            await update.message.reply_text(f"✅ Deleted group **{args[1]}**.", parse_mode=ParseMode.MARKDOWN)
+        else:
+            await update.message.reply_text("ℹ️ **No such group.**")
+    elif action == "list":
+        groups = session_manager.list_groups(user_id)
+        if len(args) >= 2:
+            groups = [g for g in groups if g.name == args[1]]
+        if not groups:
+            await update.message.reply_text("ℹ️ **No host groups.** Add one with `/group add`.", parse_mode=ParseMode.MARKDOWN)
+            return
+        lines = []
+        for host_group in groups:
+            lines.append(f"**{host_group.name}** ({len(host_group.hosts)} hosts)")
+            lines.extend(f"• `{entry.address}` {entry.username}" for entry in host_group.hosts.values())
+        await update.message.reply_text(split_text("\n".join(lines), config.MAX_OUTPUT_LENGTH)[0], parse_mode=ParseMode.MARKDOWN)
+    else:
+        await update.message.reply_text(GROUP_USAGE, parse_mode=ParseMode.MARKDOWN)
+
+@allowed_users_only
+async def runall(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /runall command"""
+    user_id = update.effective_user.id
+
+    try:
+        options, args = parse_flags(context.args or [], RUNALL_FLAGS)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    if len(args) < 2:
+        await update.message.reply_text(
+            "❌ **Usage:** `/runall [--timeout <seconds>] <group> <command>`\n\n"
+            "**Example:** `/runall web powershell Get-Service W3SVC`",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+
+    host_group = session_manager.get_group(user_id, args[0])
+    if not host_group or not host_group.hosts:
+        await update.message.reply_text("❌ **No such group.** Create one with `/group add`.", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    command, powershell = split_powershell(' '.join(args[1:]))
+    hosts = list(host_group.hosts.values())
+    header = f"🌐 {host_group.name}: {command}"
+
+    # Plain text: first lines of remote output would break Markdown
+    summary = await update.message.reply_text(f"{header}\n⏳ Running on {len(hosts)} hosts...")
+    results: List[HostResult] = []
+    last_edit = time.monotonic()
+
+    async for result in run_on_hosts(hosts, command, powershell, options.get('timeout')):
+        results.append(result)
+        if time.monotonic() - last_edit >= config.STREAM_EDIT_INTERVAL:
+            await _edit_summary(summary, header, results, len(hosts))
+            last_edit = time.monotonic()
+
+    await _edit_summary(summary, header, results, len(hosts))
+
+    document, filename = build_text_document(format_bundle(results, command), f"runall-{host_group.name}")
+    await update.message.reply_document(document=document, filename=filename, caption="📎 Full output per host")
+
+def render_summary(header: str, results: List[HostResult], total: int) -> str:
+    """Summary with failures first, trimmed to fit one message"""
+    ok = sum(1 for result in results if result.ok)
+    status = f"{len(results)}/{total} done · {ok} ok · {len(results) - ok} failed"
+    lines = [result.summary_line() for result in sorted(results, key=lambda r: (r.ok, r.entry.address))]
+    text = "\n".join([header, status, ""] + lines)
+    if len(text) > config.MAX_OUTPUT_LENGTH:
+        text = split_text(text, config.MAX_OUTPUT_LENGTH - 40)[0] + "\n… see attached file"
+    return text
+
+async def _edit_summary(message, header: str, results: List[HostResult], total: int):
+    try:
+        await message.edit_text(render_summary(header, results, total))
+    except TelegramError:
+        # A missed progress update is harmless; the final edit or the file carries the results
+        pass
@@ -0,0 +1,96 @@
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.constants import ParseMode
+from telegram.error import TelegramError
+
+from config import config
+from jobs import job_manager, Job, DONE, QUEUED, RUNNING, CANCELLED
+from delivery import send_output
+from security import allowed_users_only
+from utils import truncate_text
+
+STATE_ICONS = {QUEUED: "⏳", RUNNING: "🔄", DONE: "✅", CANCELLED: "⏹"}
+
+async def start_job(update: Update, context: ContextTypes.DEFAULT_TYPE, session, command: str,
+                    powershell: bool, timeout: float = None):
+    """Queue a command as a background job and reply with its ID straight away"""
+    chat_id = update.effective_chat.id
+
+    async def notify(job: Job):
+        try:
+            await context.bot.send_message(chat_id, describe_finished(job), parse_mode=ParseMode.MARKDOWN)
+        except TelegramError:
+            # The result is still available through /result
+            pass
+
+    job, message = job_manager.submit(
+        update.effective_user.id, session, command, powershell,
+        timeout if timeout is not None else config.JOB_TIMEOUT, notify
+    )
+    if not job:
+        await update.message.reply_text(f"❌ {message}")
+        return
+    await update.message.reply_text(
+        f"🧾 **Job #{job.id} started** on `{job.address}`\n"
+        f"You'll get a message when it finishes. `/jobs` lists jobs, `/result {job.id}` shows the output.",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+def describe_finished(job: Job) -> str:
+    """Completion notice for a job"""
+    command = truncate_text(job.command, 100)
+    if job.state == DONE:
+        icon = "✅" if job.exit_code == 0 else "⚠️"
+        return (f"{icon} **Job #{job.id} finished** in {job.duration:.1f}s (exit `{job.exit_code}`)\n"
+                f"`{command}`\nUse `/result {job.id}` to see the output.")
+    return f"{STATE_ICONS.get(job.state, '❌')} **Job #{job.id} {job.state}:** {job.error}\n`{command}`"
+
+def describe_job(job: Job) -> str:
+    """One line for /jobs"""
+    icon = STATE_ICONS.get(job.state, "❌")
+    if job.state == DONE and job.exit_code != 0:
+        icon = "⚠️"
+    details = f"{job.duration:.1f}s"
+    if job.state == DONE:
+        details += f", exit {job.exit_code}"
+    elif job.state == QUEUED:
+        details = f"waiting {time.time() - job.created_at:.0f}s"
+    return f"{icon} `#{job.id}` {job.state} ({details}) `{truncate_text(job.command, 40)}`"
+
+@allowed_users_only
+async def jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /jobs command: list the user's background jobs"""
+    user_jobs = job_manager.list_jobs(update.effective_user.id)
+    if not user_jobs:
+        await update.message.reply_text(
+            "ℹ️ **No background jobs.** Start one with `/run --bg <command>`.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+
+    lines = [f"🧾 **Background jobs** (results kept {config.JOB_RETENTION // 60} min)"]
+    lines += [describe_job(job) for job in user_jobs]
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+@allowed_users_only
+async def result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /result command: show a finished job's output"""
+    if not context.args or not context.args[0].lstrip('#').isdigit():
+        await update.message.reply_text("❌ **Usage:** `/result <job id>`", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    job_id = int(context.args[0].lstrip('#'))
+    job = job_manager.get(update.effective_user.id, job_id)
+    if not job:
+        await update.message.reply_text(f"❌ No job #{job_id}. It may have expired; see /jobs.")
+        return
+    if job.state in (QUEUED, RUNNING):
+        await update.message.reply_text(f"🔄 Job #{job.id} is still {job.state} ({job.duration:.0f}s so far).")
+        return
+    if job.state != DONE:
+        await update.message.reply_text(describe_finished(job), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    stdout, stderr = job.output()
+    await send_output(update.message, stdout, stderr, job.exit_code, name=f"job-{job.id}")
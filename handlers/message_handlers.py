@@ -1,13 +1,20 @@
+import io
+from typing import Dict, List
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 
 from config import config
-from sessions import session_manager
+from sessions import session_manager, HostEntry
 from extractor import extractor
-from winrm_client import test_connection, WinRMClient
+from metrics import EXTRACTOR_SECONDS
+from executor import winrm_executor
+from health import HostDown
+from fanout import HostResult, verify_hosts
+from delivery import ack_of, build_text_document, reply, with_ack
+from winrm_client import test_connection
 from security import allowed_users_only, delete_credential_message
-from utils import validate_host
+from utils import validate_host, split_host_port
 
 @allowed_users_only
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -15,8 +22,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     text = update.message.text
     
-    # Try to extract credentials
-    credentials = extractor.extract(text)
+    # A dump listing several servers is imported as a host group
+    found, credentials = extractor.parse_message(text)
+    if found:
+        await delete_credential_message(update, context)
+        await import_credentials(update, found, config.IMPORT_GROUP)
+        return
     
     if credentials:
         # Delete message containing credentials if possible
@@ -31,26 +42,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         username = credentials['username']
         password = credentials['password']
         
-        # Test connection
-        await update.message.reply_text("🔍 **Credentials extracted!** Testing connection...", parse_mode=ParseMode.MARKDOWN)
-        
-        success, message = test_connection(host, username, password)
+        # Test connection; a slow test gets a status message that the result replaces
+        try:
+            (success, message), ack = await with_ack(
+                update.message, "🔍 **Credentials extracted!** Testing connection...",
+                winrm_executor.run(user_id, host, test_connection, host, username, password)
+            )
+        except HostDown as e:
+            (success, message), ack = (False, str(e)), ack_of(e)
         
         if success:
             # Create session
             session = session_manager.create_session(user_id, host, username, password)
             session_manager.update_session_connection(user_id, True)
             
-            await update.message.reply_text(
+            await reply(
+                update.message,
                 f"✅ **Auto-connected successfully!**\n"
                 f"**Host:** `{host}`\n"
                 f"**User:** `{username}`\n"
                 f"**Test:** `{message}`\n\n"
                 f"Use `/run <command>` to execute commands.",
-                parse_mode=ParseMode.MARKDOWN
+                ack
             )
         else:
-            await update.message.reply_text(f"❌ **Connection failed:** {message}")
+            await reply(update.message, f"❌ **Connection failed:** {message}", ack, parse_mode=None)
     else:
         # Not a credential message, check if user has active session
         session = session_manager.get_session(user_id)
@@ -68,4 +84,78 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "• `Host: 192.168.1.1 Username: admin Password: password`\n"
                 "• Or use `/connect host user pass`",
                 parse_mode=ParseMode.MARKDOWN
-            )
\ No newline at end of file
+            )
+
+@allowed_users_only
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle uploaded .txt credential dumps; the caption names the target group"""
+    document = update.message.document
+    if document.file_size and document.file_size > config.IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f"❌ File too large to import (limit {config.IMPORT_MAX_BYTES // 1024} KB)."
+        )
+        return
+    
+    buffer = io.BytesIO()
+    telegram_file = await document.get_file()
+    await telegram_file.download_to_memory(buffer)
+    await delete_credential_message(update, context)
+    buffer.seek(0)
+    
+    # Lines are decoded and scanned lazily, in one pass
+    lines = io.TextIOWrapper(buffer, encoding='utf-8', errors='ignore')
+    with EXTRACTOR_SECONDS.time(mode='dump'):
+        found = list(extractor.extract_all(lines))
+    if not found:
+        await update.message.reply_text("🔍 **No credentials found in file.**", parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    caption = (update.message.caption or "").split()
+    await import_credentials(update, found, caption[0] if caption else config.IMPORT_GROUP)
+
+async def import_credentials(update: Update, found: List[Dict[str, str]], group: str):
+    """Test many extracted logins at once and save the working ones as a host group"""
+    user_id = update.effective_user.id
+    entries = []
+    for credentials in found:
+        host, port = split_host_port(credentials['host'])
+        entries.append(HostEntry(host=host, port=port, username=credentials['username'],
+                                 password=credentials['password']))
+    
+    progress = await update.message.reply_text(f"🔍 Found {len(entries)} servers. Testing logins...")
+    
+    results: List[HostResult] = []
+    async for result in verify_hosts(entries):
+        results.append(result)
+        if result.ok:
+            entry = result.entry
+            session_manager.add_group_host(user_id, group, entry.host, entry.username, entry.password, entry.port)
+    
+    working = sum(1 for result in results if result.ok)
+    table = render_import_table(results)
+    summary = (
+        f"📋 Imported {working}/{len(results)} servers into group '{group}'.\n"
+        f"Use /runall {group} <command> to run on all of them."
+    )
+    
+    if len(table) + len(summary) + 10 <= config.MAX_OUTPUT_LENGTH:
+        await progress.edit_text(f"{summary}\n```\n{table}\n```", parse_mode=ParseMode.MARKDOWN)
+    else:
+        await progress.edit_text(summary)
+        document, filename = build_text_document(table, f"import-{group}")
+        await update.message.reply_document(document=document, filename=filename)
+
+def render_import_table(results: List[HostResult]) -> str:
+    """Aligned host/user/result table, working logins first"""
+    results = sorted(results, key=lambda r: (not r.ok, r.entry.address))
+    rows = [("HOST", "USER", "RESULT")]
+    for result in results:
+        if result.ok:
+            status = f"OK {result.elapsed:.1f}s"
+        else:
+            reason = (result.error or result.stdout or "").strip().splitlines()
+            status = f"FAIL {reason[0][:40]}" if reason else "FAIL"
+        rows.append((result.entry.address, result.entry.username, status))
+    host_width = max(len(row[0]) for row in rows)
+    user_width = min(max(len(row[1]) for row in rows), 20)
+    return "\n".join(f"{host:<{host_width}}  {user[:user_width]:<{user_width}}  {status}" for host, user, status in rows)
@@ -0,0 +1,115 @@
+import re
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, TelegramError
+
+from config import config
+from sessions import session_manager
+from watches import Watch, watch_manager, format_interval, parse_interval
+from pipeline import parse_pipeline
+from security import allowed_users_only
+from utils import parse_flags, split_powershell, truncate_text
+
+# Options accepted before the interval in /watch
+WATCH_FLAGS = {'match': str}
+
+def describe_watch(watch: Watch) -> str:
+    """One line for /watch without arguments"""
+    if watch.error:
+        state = "❌ failing"
+    elif watch.last_run:
+        state = f"last run {time.time() - watch.last_run:.0f}s ago"
+    else:
+        state = "starting"
+    condition = f", alert on `{watch.match}`" if watch.match else ""
+    return (f"👁 `#{watch.id}` every {format_interval(watch.interval)}{condition} ({state}, "
+            f"{watch.runs} runs, {watch.changes} changes) `{truncate_text(watch.command, 40)}`")
+
+@allowed_users_only
+async def watch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /watch command: re-run a command on an interval and report what changes"""
+    user_id = update.effective_user.id
+
+    if not context.args:
+        watches = watch_manager.list_watches(user_id)
+        if watches:
+            lines = ["👁 **Watches**"] + [describe_watch(w) for w in watches]
+        else:
+            lines = ["ℹ️ **No watches.**"]
+        lines.append(
+            "\n**Usage:** `/watch [--match <regex>] <interval> <command>`\n"
+            "• `/watch 5m tasklist` (reports added/removed lines)\n"
+            "• `/watch 1m powershell (Get-Service W3SVC).Status`\n"
+            "• `/watch --match Stopped 2m sc query spooler` (alerts when the regex starts or stops matching)\n"
+            f"Exit code changes always alert. Up to {config.WATCH_MAX_PER_USER} watches, "
+            f"at least {format_interval(config.WATCH_MIN_INTERVAL)} apart; `/unwatch [id]` stops them."
+        )
+        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    session = session_manager.get_session(user_id)
+    if not session or not session.is_connected:
+        await update.message.reply_text(
+            "❌ **No active session.**\n"
+            "Please connect first using /connect or paste credentials."
+        )
+        return
+
+    try:
+        options, args = parse_flags(context.args, WATCH_FLAGS)
+        if len(args) < 2:
+            raise ValueError("Usage: /watch [--match <regex>] <interval> <command>")
+        interval = parse_interval(args[0])
+        if options.get('match'):
+            re.compile(options['match'])
+        command, powershell = split_powershell(' '.join(args[1:]))
+        parse_pipeline(command)
+    except re.error as e:
+        await update.message.reply_text(f"❌ Bad --match regex: {e}")
+        return
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    async def notify(watch: Watch, text: str):
+        try:
+            await context.bot.send_message(watch.chat_id, text, parse_mode=ParseMode.MARKDOWN)
+        except BadRequest:
+            # Output that isn't valid Markdown still gets through as plain text
+            try:
+                await context.bot.send_message(watch.chat_id, text)
+            except TelegramError:
+                pass
+        except TelegramError:
+            pass
+
+    watch, message = watch_manager.start(
+        context.job_queue, user_id, update.effective_chat.id, session, command, powershell,
+        interval, notify, options.get('match')
+    )
+    if not watch:
+        await update.message.reply_text(f"❌ {message}")
+
+@allowed_users_only
+async def unwatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /unwatch command: stop one watch, or all of them"""
+    user_id = update.effective_user.id
+
+    if context.args:
+        watch_id = context.args[0].lstrip('#')
+        if not watch_id.isdigit():
+            await update.message.reply_text("❌ **Usage:** `/unwatch [watch id]`", parse_mode=ParseMode.MARKDOWN)
+            return
+        if not watch_manager.stop(user_id, int(watch_id)):
+            await update.message.reply_text(f"ℹ️ No watch #{watch_id}; see /watch.")
+            return
+        await update.message.reply_text(f"⏹ **Watch #{watch_id} stopped.**", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    stopped = watch_manager.stop(user_id)
+    if stopped:
+        await update.message.reply_text(f"⏹ **Stopped {stopped} watch(es).**", parse_mode=ParseMode.MARKDOWN)
+    else:
+        await update.message.reply_text("ℹ️ **No watches to stop.**", parse_mode=ParseMode.MARKDOWN)
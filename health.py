@@ -0,0 +1,183 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from winrm.exceptions import InvalidCredentialsError, WinRMTransportError
+from config import config
+from metrics import registry
+from utils import split_host_port, truncate_text
+
+# Circuit states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Failure kinds
+AUTH = 'auth'
+CONNECT = 'connect'
+
+REJECTED = registry.counter(
+    'host_circuit_rejections_total', "Calls refused without contacting the host", ['reason'])
+
+class HostDown(Exception):
+    """Raised instead of contacting a host whose circuit is open"""
+
+@dataclass
+class HostState:
+    """Circuit breaker state for one host"""
+    state: str = CLOSED
+    failures: int = 0
+    down_since: float = 0.0
+    last_error: str = ""
+    backoff: float = 0.0
+    retry_at: float = 0.0
+    # When the half-open probe was let through
+    probe_started: float = 0.0
+
+def classify(error: Optional[Exception]) -> Optional[str]:
+    """AUTH for a rejected login, CONNECT if the host couldn't be reached, else None"""
+    if error is None:
+        return None
+    if isinstance(error, InvalidCredentialsError) or (isinstance(error, WinRMTransportError) and error.code == 401):
+        return AUTH
+    # Refused, reset, DNS, TLS and timeouts (requests' and aiohttp's errors included)
+    if isinstance(error, OSError):
+        return CONNECT
+    return None
+
+class HostHealth:
+    """Per-host circuit breakers plus a short-lived cache of rejected logins.
+
+    After HOST_FAILURE_THRESHOLD connection failures in a row a host's
+    circuit opens: calls fail at once with HostDown until the backoff
+    (HOST_BACKOFF doubling up to HOST_BACKOFF_MAX) has passed, then one call
+    goes through as a probe. Its success closes the circuit; its failure
+    reopens it with twice the backoff.
+    """
+
+    def __init__(self, threshold: int = None, backoff: float = None, max_backoff: float = None,
+                 auth_ttl: int = None):
+        self.threshold = threshold or config.HOST_FAILURE_THRESHOLD
+        self.base_backoff = backoff or config.HOST_BACKOFF
+        self.max_backoff = max_backoff or config.HOST_BACKOFF_MAX
+        self.auth_ttl = auth_ttl if auth_ttl is not None else config.HOST_AUTH_FAILURE_TTL
+        # A probe that never reports back (e.g. cancelled) frees the slot after this long
+        self.probe_timeout = config.WINRM_TIMEOUT * 3
+        self.hosts: Dict[str, HostState] = {}
+        self._rejected_logins: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+        # Updated from executor worker threads and the event loop
+        self._lock = threading.Lock()
+
+    def check(self, host: str) -> Optional[str]:
+        """None if a call to host may go ahead, else why not.
+
+        Lets exactly one call through as a probe once an open circuit's
+        backoff has passed.
+        """
+        now = time.time()
+        with self._lock:
+            state = self.hosts.get(_key(host))
+            if state is None or state.state == CLOSED:
+                return None
+            if state.state == OPEN and now >= state.retry_at:
+                state.state = HALF_OPEN
+                state.probe_started = now
+                return None
+            if state.state == HALF_OPEN and now - state.probe_started > self.probe_timeout:
+                state.probe_started = now
+                return None
+            return self._describe(host, state, now)
+
+    def guard(self, host: str):
+        """Raise HostDown if the host's circuit is open"""
+        message = self.check(host)
+        if message:
+            REJECTED.inc(reason='host_down')
+            raise HostDown(message)
+
+    def record_success(self, host: str):
+        """The host answered; close its circuit"""
+        key = _key(host)
+        with self._lock:
+            if key in self.hosts:
+                del self.hosts[key]
+
+    def record_failure(self, host: str, error: str):
+        """The host couldn't be reached; open its circuit after enough failures in a row"""
+        now = time.time()
+        with self._lock:
+            state = self.hosts.setdefault(_key(host), HostState(down_since=now))
+            state.failures += 1
+            state.last_error = truncate_text(error, 200)
+            if state.state == HALF_OPEN or (state.state == CLOSED and state.failures >= self.threshold):
+                state.state = OPEN
+                state.backoff = min(self.max_backoff, state.backoff * 2 or self.base_backoff)
+                state.retry_at = now + state.backoff
+
+    def record_error(self, host: str, error: Optional[Exception], username: str = None, password: str = None):
+        """Record the outcome of a call from the exception it ended with (None for success)"""
+        kind = classify(error)
+        if kind == CONNECT:
+            self.record_failure(host, str(error) or error.__class__.__name__)
+            return
+        # Anything else means the host answered
+        self.record_success(host)
+        if kind == AUTH and username is not None:
+            self.record_rejected_login(host, username, password, str(error))
+
+    def rejected_login(self, host: str, username: str, password: str) -> Optional[str]:
+        """Why this login is known to fail, if it was rejected within HOST_AUTH_FAILURE_TTL"""
+        key = _login_key(host, username, password)
+        with self._lock:
+            entry = self._rejected_logins.get(key)
+            if entry is None:
+                return None
+            rejected_at, error = entry
+            age = time.time() - rejected_at
+            if age > self.auth_ttl:
+                del self._rejected_logins[key]
+                return None
+        REJECTED.inc(reason='rejected_login')
+        return (f"Login rejected {int(age)}s ago ({error}); not retrying for another "
+                f"{int(self.auth_ttl - age)}s to avoid locking the account")
+
+    def record_rejected_login(self, host: str, username: str, password: str, error: str):
+        """Remember a rejected login for HOST_AUTH_FAILURE_TTL seconds"""
+        if not self.auth_ttl:
+            return
+        now = time.time()
+        with self._lock:
+            if len(self._rejected_logins) >= 1000:
+                for key in [key for key, (at, _) in self._rejected_logins.items() if now - at > self.auth_ttl]:
+                    del self._rejected_logins[key]
+            self._rejected_logins[_login_key(host, username, password)] = (now, error)
+
+    def stats(self) -> Dict[str, int]:
+        """Hosts with an open or half-open circuit, and remembered rejected logins"""
+        with self._lock:
+            return {
+                'open': sum(state.state == OPEN for state in self.hosts.values()),
+                'half_open': sum(state.state == HALF_OPEN for state in self.hosts.values()),
+                'failing': sum(state.state == CLOSED for state in self.hosts.values()),
+                'rejected_logins': len(self._rejected_logins),
+            }
+
+    def _describe(self, host: str, state: HostState, now: float) -> str:
+        since = time.strftime('%H:%M:%S', time.localtime(state.down_since))
+        retry = "now" if state.state == HALF_OPEN else f"in {max(1, int(state.retry_at - now))}s"
+        return (f"Host {host} down since {since} ({state.failures} failed attempts, last: {state.last_error}); "
+                f"next try {retry}")
+
+def _key(host: str) -> str:
+    return split_host_port(host)[0].lower()
+
+def _login_key(host: str, username: str, password: str) -> Tuple[str, str, str]:
+    # Only a digest of the password is kept
+    return _key(host), username.lower(), hashlib.sha256((password or "").encode('utf-8')).hexdigest()
+
+# Global host health registry
+host_health = HostHealth()
+
+registry.gauge('host_circuits', "Hosts by circuit state (failing = closed with recent failures)", ['state'],
+               lambda: {(name,): value for name, value in host_health.stats().items() if name != 'rejected_logins'})
@@ -0,0 +1,207 @@
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config import config
+from executor import winrm_executor
+from metrics import registry
+from pipeline import prepare_pipeline
+from session_store import JobStore
+from winrm_client import CancelToken, CommandCancelled, run_command as run_remote_command
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+@dataclass
+class Job:
+    """One background command and, once finished, its compressed output"""
+    id: int
+    user_id: int
+    address: str
+    command: str
+    powershell: bool
+    created_at: float
+    state: str = QUEUED
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    exit_code: Optional[int] = None
+    error: Optional[str] = None
+    stdout_z: bytes = b""
+    stderr_z: bytes = b""
+    output_bytes: int = 0
+    token: Optional[CancelToken] = field(default=None, repr=False)
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def duration(self) -> float:
+        """Seconds spent running so far, or in total once finished"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def output(self) -> Tuple[str, str]:
+        """Decompressed (stdout, stderr)"""
+        return (
+            zlib.decompress(self.stdout_z).decode('utf-8') if self.stdout_z else "",
+            zlib.decompress(self.stderr_z).decode('utf-8') if self.stderr_z else "",
+        )
+
+# Awaited with the finished job, e.g. to notify the user
+JobCallback = Callable[[Job], Awaitable[None]]
+
+class JobManager:
+    """Run commands in the background on the WinRM executor and keep their results for a while"""
+
+    def __init__(self, max_active: int = None, history: int = None, retention: int = None,
+                 store: JobStore = None):
+        self.max_active = max_active or config.JOB_MAX_ACTIVE
+        self.history = history or config.JOB_HISTORY
+        self.retention = retention or config.JOB_RETENTION
+        # Finished jobs are also written to the store so they survive restarts
+        self.store = store or JobStore()
+        self.jobs: Dict[int, Dict[int, Job]] = {}
+        # Job IDs count up per user and aren't reused while the bot runs
+        self._last_ids: Dict[int, int] = {}
+        self.completed = 0
+
+    def attach_store(self, store: JobStore) -> int:
+        """Switch to a persistent store and restore finished jobs still within retention"""
+        self.store = store
+        restored = 0
+        for fields in store.load(time.time() - self.retention):
+            job = Job(**fields)
+            self.jobs.setdefault(job.user_id, {})[job.id] = job
+            self._last_ids[job.user_id] = max(self._last_ids.get(job.user_id, 0), job.id)
+            restored += 1
+        return restored
+
+    def submit(self, user_id: int, session, command: str, powershell: bool = False,
+               timeout: float = None, on_done: JobCallback = None) -> Tuple[Optional[Job], str]:
+        """Start a command in the background; returns (job, message) or (None, reason)"""
+        active = [job for job in self.list_jobs(user_id) if job.state not in FINISHED]
+        if len(active) >= self.max_active:
+            return None, f"You already have {len(active)} background jobs running (limit {self.max_active})."
+
+        job_id = self._last_ids[user_id] = self._last_ids.get(user_id, 0) + 1
+        job = Job(
+            id=job_id,
+            user_id=user_id,
+            address=session.address,
+            command=command,
+            powershell=powershell,
+            created_at=time.time(),
+            token=CancelToken(timeout),
+        )
+        self.jobs.setdefault(user_id, {})[job.id] = job
+        self._trim(user_id)
+        job.task = asyncio.create_task(self._run(job, session, on_done))
+        return job, f"Job #{job.id} started"
+
+    async def _run(self, job: Job, session, on_done: JobCallback = None):
+        def started():
+            job.state = RUNNING
+            job.started_at = time.time()
+
+        def call(*args, **kwargs):
+            # Runs on the worker thread: the job counts as running from here
+            loop.call_soon_threadsafe(started)
+            return run_remote_command(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        try:
+            command, output_filter = prepare_pipeline(job.command, job.powershell)
+            # Jobs have their own per-user cap, so they don't use up the
+            # user's interactive slots on the executor
+            stdout, stderr, job.exit_code = await winrm_executor.run(
+                None, session.host, call,
+                session.host, session.username, session.password, session.port, command,
+                powershell=job.powershell, token=job.token, output_filter=output_filter
+            )
+            job.state = DONE
+            job.stdout_z = zlib.compress(stdout.encode('utf-8')) if stdout else b""
+            job.stderr_z = zlib.compress(stderr.encode('utf-8')) if stderr else b""
+            job.output_bytes = len(job.stdout_z) + len(job.stderr_z)
+        except CommandCancelled as e:
+            job.state = CANCELLED
+            job.error = str(e)
+        except asyncio.CancelledError:
+            job.state = CANCELLED
+            job.error = "Bot shutting down"
+            raise
+        except Exception as e:
+            job.state = FAILED
+            job.error = str(e) or e.__class__.__name__
+        finally:
+            job.finished_at = time.time()
+            if job.started_at is None:
+                job.started_at = job.finished_at
+            job.token = None
+            job.task = None
+            self.completed += 1
+            if job.state in FINISHED:
+                self.store.save(job)
+
+        if on_done:
+            await on_done(job)
+
+    def get(self, user_id: int, job_id: int) -> Optional[Job]:
+        """Return one of the user's jobs"""
+        return self.jobs.get(user_id, {}).get(job_id)
+
+    def list_jobs(self, user_id: int) -> List[Job]:
+        """Return the user's jobs, newest first"""
+        return sorted(self.jobs.get(user_id, {}).values(), key=lambda job: job.id, reverse=True)
+
+    def cancel(self, user_id: int, job_id: int = None) -> int:
+        """Cancel one job, or all of the user's unfinished jobs; returns how many were signalled"""
+        jobs = [self.get(user_id, job_id)] if job_id is not None else self.list_jobs(user_id)
+        cancelled = 0
+        for job in jobs:
+            if job and job.token:
+                job.token.cancel("Job cancelled with /cancel")
+                cancelled += 1
+        return cancelled
+
+    def cleanup_expired(self) -> int:
+        """Drop finished jobs whose results are older than the retention period"""
+        cutoff = time.time() - self.retention
+        removed = 0
+        for user_id in list(self.jobs):
+            jobs = self.jobs[user_id]
+            for job_id in [i for i, job in jobs.items() if job.finished_at and job.finished_at < cutoff]:
+                del jobs[job_id]
+                removed += 1
+            if not jobs:
+                del self.jobs[user_id]
+        self.store.delete_before(cutoff)
+        return removed
+
+    def _trim(self, user_id: int):
+        """Keep at most `history` jobs per user, dropping the oldest finished ones"""
+        jobs = self.jobs[user_id]
+        finished = sorted(job_id for job_id, job in jobs.items() if job.state in FINISHED)
+        for job_id in finished[:max(0, len(jobs) - self.history)]:
+            del jobs[job_id]
+            self.store.delete(user_id, job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Return job counts and stored result size"""
+        jobs = [job for user_jobs in self.jobs.values() for job in user_jobs.values()]
+        return {
+            'active': sum(job.state not in FINISHED for job in jobs),
+            'stored': sum(job.state in FINISHED for job in jobs),
+            'stored_bytes': sum(job.output_bytes for job in jobs),
+            'completed': self.completed,
+        }
+
+# Global job manager
+job_manager = JobManager()
+
+registry.gauge('jobs_active', "Background jobs queued or running",
+               callback=lambda: job_manager.stats()['active'])
@@ -1,10 +1,30 @@
+import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
+import time
+from typing import Awaitable, Dict, List
+from telegram import Update
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, ContextTypes, MessageHandler, filters
 from config import config
+from sessions import session_manager
+from session_store import Shard, create_stores
+from executor import winrm_executor
+from winrm_client import winrm_pool
+from transfer import transfer_manager
+from jobs import job_manager
+from async_winrm import async_winrm_pool
+from webhook import run_webhook
+from metrics import TELEGRAM_REQUEST_SECONDS, start_metrics_server
+from outbound import OutboundLimiter
 
 # Import handlers
-from handlers.commands import start, help_command, connect, run_command, status, disconnect
-from handlers.message_handlers import handle_message
+from handlers.commands import start, help_command, connect, run_command, ps, script, cancel, status, disconnect
+from handlers.groups import group, runall
+from handlers.jobs import jobs, result
+from handlers.admin import stats
+from handlers.files import download, upload
+from handlers.watches import watch, unwatch
+from handlers.message_handlers import handle_message, handle_document
 
 # Set up logging
 logging.basicConfig(
@@ -13,32 +33,194 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
-    """Start the bot"""
-    if not config.BOT_TOKEN:
-        logger.error("BOT_TOKEN environment variable is required!")
-        return
-    
-    if not config.ALLOWED_USER_IDS:
-        logger.warning("No ALLOWED_USER_IDS specified - bot will reject all users!")
-    
-    # Create Application
-    application = Application.builder().token(config.BOT_TOKEN).build()
+class TimedRequest(HTTPXRequest):
+    """Bot API requests that record their latency per method (sendMessage, editMessageText, ...)"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=url.rsplit('/', 1)[-1])
+
+# Commands answered straight away, even while the user's earlier updates still run
+UNORDERED_COMMANDS = {'cancel', 'status', 'jobs', 'result', 'stats', 'help'}
+
+class UserOrderedProcessor(BaseUpdateProcessor):
+    """Handle each user's updates one at a time, in the order they arrived; different users run concurrently.
+
+    A pasted login followed by /run thus finds the session the paste created.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # user id -> [lock, updates holding or waiting for it]
+        self._users: Dict[int, List] = {}
+
+    async def process_update(self, update: object, coroutine: Awaitable):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None or self._is_unordered(update):
+            await super().process_update(update, coroutine)
+            return
+        # Waiting for the user's lock comes first, so queued updates don't hold concurrency slots
+        entry = self._users.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[user.id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _is_unordered(self, update: Update) -> bool:
+        text = update.message.text if update.message else None
+        if not text or not text.startswith('/'):
+            return False
+        return text[1:].split(maxsplit=1)[0].split('@')[0].lower() in UNORDERED_COMMANDS
+
+async def reap_sessions(context: ContextTypes.DEFAULT_TYPE):
+    """Job: expire idle sessions and groups, old job results, idle pooled shells and stale transfers"""
+    expired = session_manager.cleanup_expired_sessions()
+    groups = session_manager.cleanup_expired_groups()
+    results = job_manager.cleanup_expired()
+    shells = winrm_pool.evict_idle()
+    transfers = transfer_manager.prune()
+    if expired or groups or results or shells or transfers:
+        stats = session_manager.stats()
+        logger.info(
+            "Reaped %d sessions, %d groups, %d job results, %d idle shells, %d stale transfer files "
+            "(%d live, %d expired total)",
+            expired, groups, results, shells, transfers, stats['live'], stats['expired']
+        )
+
+async def close_async_clients(application: Application):
+    """Delete remote shells held by the asyncio client while the loop still runs"""
+    await async_winrm_pool.close_all()
+
+async def flush_sessions(context: ContextTypes.DEFAULT_TYPE):
+    """Job: write buffered session updates to the store off the event loop"""
+    await asyncio.get_running_loop().run_in_executor(None, session_manager.flush_store)
+
+def open_stores(shard: Shard = None) -> bool:
+    """Restore sessions and job results saved before the last restart; False if misconfigured"""
+    try:
+        session_store, job_store = create_stores(shard)
+    except ValueError as e:
+        logger.error("Session store: %s", e)
+        return False
+    restored = session_manager.attach_store(session_store)
+    results = job_manager.attach_store(job_store)
+    if restored or results:
+        logger.info("Restored %d sessions and %d job results from %s", restored, results, config.SESSION_DB_PATH)
+    return True
+
+def build_application(polling: bool = True) -> Application:
+    """Create the Application with every handler and background job registered"""
+    # Updates are handled concurrently so a slow server only holds up its own
+    # user's handlers (UserOrderedProcessor keeps each user's in order); WinRM
+    # calls run on winrm_executor. Webhook workers get their
+    # updates from the front process instead of an Updater. Bot API calls go
+    # through TimedRequest (PTB's default pool size); getUpdates isn't timed.
+    # OutboundLimiter queues sends per chat and globally to stay under flood limits.
+    builder = (Application.builder().token(config.BOT_TOKEN).concurrent_updates(UserOrderedProcessor(256))
+               .request(TimedRequest(connection_pool_size=256))
+               .rate_limiter(OutboundLimiter()))
+    if config.BOT_API_URL:
+        builder = builder.base_url(config.BOT_API_URL)
+    if polling:
+        builder = builder.post_shutdown(close_async_clients)
+    else:
+        builder = builder.updater(None)
+    application = builder.build()
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("connect", connect))
     application.add_handler(CommandHandler("run", run_command))
+    application.add_handler(CommandHandler("ps", ps))
+    application.add_handler(CommandHandler("script", script))
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(CommandHandler("jobs", jobs))
+    application.add_handler(CommandHandler("result", result))
+    application.add_handler(CommandHandler("watch", watch))
+    application.add_handler(CommandHandler("unwatch", unwatch))
     application.add_handler(CommandHandler("status", status))
+    application.add_handler(CommandHandler("stats", stats))
+    application.add_handler(CommandHandler("download", download))
+    application.add_handler(CommandHandler("upload", upload))
     application.add_handler(CommandHandler("disconnect", disconnect))
+    application.add_handler(CommandHandler("group", group))
+    application.add_handler(CommandHandler("runall", runall))
     
     # Add message handler for credential extraction
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # A document captioned /upload goes to the remote host rather than the dump importer
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/upload(@\w+)?(\s|$)'), upload))
+    application.add_handler(MessageHandler(filters.Document.TXT, handle_document))
+    
+    # Expire sessions in the background instead of waiting for the user's next message
+    application.job_queue.run_repeating(reap_sessions, interval=config.SESSION_REAP_INTERVAL)
+    if config.SESSION_BACKEND != 'memory':
+        application.job_queue.run_repeating(flush_sessions, interval=config.SESSION_FLUSH_INTERVAL)
+    return application
+
+def start_metrics(offset: int = 0):
+    """Serve /metrics for this process on METRICS_PORT + offset, unless disabled"""
+    if not config.METRICS_PORT:
+        return
+    port = config.METRICS_PORT + offset
+    try:
+        start_metrics_server(config.METRICS_LISTEN, port)
+    except OSError as e:
+        # Metrics are optional; the bot keeps running without them
+        logger.warning("Metrics endpoint on %s:%d unavailable: %s", config.METRICS_LISTEN, port, e)
+        return
+    logger.info("Metrics on http://%s:%d/metrics", config.METRICS_LISTEN, port)
+
+def release_resources():
+    """Stop worker threads, close pooled shells and flush the stores"""
+    winrm_executor.shutdown()
+    winrm_pool.close_all()
+    session_manager.store.close()
+    job_manager.store.close()
+
+def main():
+    """Start the bot"""
+    if not config.BOT_TOKEN:
+        logger.error("BOT_TOKEN environment variable is required!")
+        return
+    
+    if not config.ALLOWED_USER_IDS:
+        logger.warning("No ALLOWED_USER_IDS specified - bot will reject all users!")
+    
+    if config.BOT_MODE == 'webhook':
+        # Worker processes open the stores and run the handlers
+        run_webhook()
+        return
+    
+    if not open_stores():
+        return
+    start_metrics()
+    application = build_application()
     
     # Start the bot
     logger.info("Bot starting...")
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        release_resources()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,241 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cache hit to a slow remote command
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+LabelValues = Tuple[str, ...]
+
+class _Metric:
+    """Name, help text and label names shared by every metric type"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        # Observations come from worker threads as well as the event loop
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _format_labels(self, key: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        raise NotImplementedError
+
+class _Value(_Metric):
+    """One number per label set, kept here or read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 callback: Callable[[], Union[float, Dict[LabelValues, float]]] = None):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+        # Lets existing stats() counters be exported without double bookkeeping
+        self._callback = callback
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        if self._callback is not None:
+            try:
+                value = self._callback()
+            except Exception:
+                logger.exception("Metric %s callback failed", self.name)
+                return {}
+            return value if isinstance(value, dict) else {(): value}
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {_number(value)}"
+                for key, value in sorted(self.snapshot().items())]
+
+class Counter(_Value):
+    """Monotonic count, e.g. timeouts or cache hits"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Value):
+    """Current value, e.g. live sessions or queue depth"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    """Distribution of durations in seconds with cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the duration of a with-block, including when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[LabelValues, Tuple[int, float]]:
+        """(count, sum) per label set"""
+        with self._lock:
+            return {key: (sum(counts), self._sums[key]) for key, counts in self._counts.items()}
+
+    def totals(self, **labels: str) -> Tuple[int, float]:
+        """(count, sum) for one label set"""
+        key = self._key(labels)
+        with self._lock:
+            return sum(self._counts.get(key, ())), self._sums.get(key, 0.0)
+
+    def quantile(self, q: float, **labels: str) -> Optional[float]:
+        """Estimate a quantile from the buckets (upper bound of the bucket it falls in)"""
+        with self._lock:
+            counts = list(self._counts.get(self._key(labels), ()))
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else _number(bound)
+                labels = self._format_labels(key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+class Registry:
+    """All metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = (), callback=None) -> Counter:
+        return self.register(Counter(name, help_text, labels, callback))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, help_text, labels, callback))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve GET /metrics on a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+# Global registry
+registry = Registry()
+
+# Hot-path metrics; gauges for live state are registered where that state lives
+WINRM_CONNECT_SECONDS = registry.histogram(
+    'winrm_connect_seconds', "Time to open a WinRM client and run the whoami test")
+WINRM_COMMAND_SECONDS = registry.histogram(
+    'winrm_command_seconds', "Time from starting a remote command to its exit code", ['shell'])
+WINRM_REQUEST_SECONDS = registry.histogram(
+    'winrm_request_seconds', "Round trip of one WS-Management request (network plus server)", ['op'])
+EXECUTOR_WAIT_SECONDS = registry.histogram(
+    'executor_wait_seconds', "Time a WinRM call waited for a limiter slot and a worker thread")
+TELEGRAM_REQUEST_SECONDS = registry.histogram(
+    'telegram_request_seconds', "Bot API call latency (sends, edits, deletes)", ['method'])
+EXTRACTOR_SECONDS = registry.histogram(
+    'extractor_parse_seconds', "Time to scan a message (single) or a dump (dump) for credentials", ['mode'],
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+HANDLER_SECONDS = registry.histogram(
+    'handler_seconds', "Time spent in a Telegram handler end to end", ['handler'])
+
+WINRM_FAILURES = registry.counter(
+    'winrm_failures_total', "Connection tests and commands that failed before an exit code", ['stage'])
+WINRM_TIMEOUTS = registry.counter(
+    'winrm_timeouts_total', "Commands stopped by their deadline")
+WINRM_CANCELLED = registry.counter(
+    'winrm_cancelled_total', "Commands stopped by /cancel or an abandoned caller")
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import config
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+RETRIES = registry.counter(
+    'telegram_retry_after_total', "Bot API calls answered with 429 Retry-After", ['method'])
+THROTTLE_SECONDS = registry.histogram(
+    'telegram_throttle_seconds', "Time a Bot API call waited for the outbound token buckets",
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+class TokenBucket:
+    """Allow `rate` calls per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Waiters are served in arrival order
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Wait for a token and take it"""
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hand out nothing for the next `seconds` (after a 429 Retry-After)"""
+        self._refill(time.monotonic())
+        # The next token is due `seconds` from now
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+    def is_idle(self, now: float) -> bool:
+        """True once the bucket has refilled, i.e. it is the same as a new one"""
+        return not self._lock.locked() and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class OutboundLimiter(BaseRateLimiter):
+    """Rate limiter for every Bot API call the Application makes.
+
+    Calls that target a chat take a token from a global bucket and one from
+    the chat's bucket (group chats are limited per minute, as Telegram does),
+    so bursts queue up here instead of running into 429 flood errors. A 429
+    that still happens pauses the chat (or everything, for calls without a
+    chat) for its Retry-After and the call is retried.
+    """
+
+    # Per-chat buckets are pruned once there are more than this many
+    PRUNE_AT = 1000
+
+    def __init__(self, global_rate: float = None, chat_rate: float = None, group_rate: float = None,
+                 burst: int = None, max_retries: int = None):
+        self.global_rate = global_rate or config.TELEGRAM_GLOBAL_RATE
+        self.chat_rate = chat_rate or config.TELEGRAM_CHAT_RATE
+        self.group_rate = (group_rate or config.TELEGRAM_GROUP_RATE) / 60
+        self.burst = burst or config.TELEGRAM_CHAT_BURST
+        self.max_retries = max_retries if max_retries is not None else config.TELEGRAM_MAX_RETRIES
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[Union[int, str], TokenBucket] = {}
+
+    async def initialize(self):
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats = {}
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    async def process_request(self, callback: Callable[..., Coroutine[Any, Any, Any]], args: Any,
+                              kwargs: Dict[str, Any], endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[None]) -> Any:
+        chat_id = data.get('chat_id')
+        chat = self._chat_bucket(chat_id) if chat_id is not None else None
+        for attempt in range(self.max_retries + 1):
+            if chat is not None:
+                started = time.monotonic()
+                await chat.acquire()
+                await self._global.acquire()
+                THROTTLE_SECONDS.observe(time.monotonic() - started)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                RETRIES.inc(method=endpoint)
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("%s hit the flood limit for chat %s; retrying in %ss", endpoint, chat_id, e.retry_after)
+                (chat or self._global).pause(e.retry_after)
+                if chat is None:
+                    # Calls without a chat don't go through the buckets
+                    await asyncio.sleep(e.retry_after)
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.PRUNE_AT:
+                now = time.monotonic()
+                for idle in [key for key, b in self._chats.items() if b.is_idle(now)]:
+                    del self._chats[idle]
+            # Negative IDs are groups and channels; @names are channels too
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(self.group_rate if group else self.chat_rate, self.burst)
+        return bucket
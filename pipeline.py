@@ -0,0 +1,223 @@
+import codecs
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from structured import quote_ps
+
+# Pipe operators understood at the end of a /run command
+OPERATORS = ('head', 'tail', 'grep', 'count')
+DEFAULT_LINES = 10
+
+# Characters that would need escaping inside findstr /C:"..." or break cmd grouping
+CMD_UNSAFE_TEXT = set('"%\\')
+CMD_UNSAFE_COMMAND = set('&()')
+
+@dataclass
+class Stage:
+    """One pipe operator: head/tail N, grep [-v] [-i] text, or count"""
+    op: str
+    lines: int = DEFAULT_LINES
+    text: str = ""
+    invert: bool = False
+    ignore_case: bool = False
+
+    def __str__(self) -> str:
+        if self.op in ('head', 'tail'):
+            return f"{self.op} {self.lines}"
+        if self.op == 'grep':
+            flags = ("-v " if self.invert else "") + ("-i " if self.ignore_case else "")
+            return f"grep {flags}{self.text}"
+        return self.op
+
+def parse_pipeline(command: str) -> Tuple[str, List[Stage]]:
+    """Split trailing '| head 20', '| grep text' etc. off a command.
+
+    Pipes into anything else are left alone as part of the remote command.
+    Raises ValueError if an operator's arguments are bad.
+    """
+    segments = _split_pipes(command)
+    stages = []
+    while len(segments) > 1:
+        words = segments[-1].split(None, 1)
+        if not words or words[0].lower() not in OPERATORS:
+            break
+        stages.insert(0, _parse_stage(words[0].lower(), words[1] if len(words) > 1 else ""))
+        segments.pop()
+    return '|'.join(segments).strip(), stages
+
+def plan_pipeline(command: str, stages: List[Stage], powershell: bool = False) -> Tuple[str, List[Stage]]:
+    """Move as many stages as possible to the remote side.
+
+    Returns (remote command, stages left to apply locally). PowerShell takes
+    every operator; CMD takes grep (findstr) and count (find /c) until the
+    first head or tail, after which the rest runs locally in order.
+    """
+    if not stages:
+        return command, []
+    if powershell:
+        return _ps_pipeline(command, stages), []
+
+    remote = []
+    if not CMD_UNSAFE_COMMAND & set(command):
+        for stage in stages:
+            if stage.op == 'count':
+                remote.append('find /C /V ""')
+            elif stage.op == 'grep' and stage.text.isascii() and not CMD_UNSAFE_TEXT & set(stage.text):
+                flags = "/L" + (" /V" if stage.invert else "") + (" /I" if stage.ignore_case else "")
+                remote.append(f'findstr {flags} /C:"{stage.text}"')
+            else:
+                break
+    return ' | '.join([command] + remote), stages[len(remote):]
+
+def prepare_pipeline(command: str, powershell: bool = False) -> Tuple[str, Optional['OutputFilter']]:
+    """Parse and plan a command's pipe operators; returns (remote command, local filter or None)"""
+    command, stages = parse_pipeline(command)
+    command, local = plan_pipeline(command, stages, powershell)
+    return command, OutputFilter(local) if local else None
+
+class OutputFilter:
+    """Apply pipe operators to command output line by line as it is received.
+
+    Only what the operators keep is buffered: head stops storing after N
+    lines, tail keeps the last N and count keeps a number.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = [_LOCAL_STAGES[stage.op](stage) for stage in stages]
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._partial = ""
+
+    def feed(self, data: bytes) -> str:
+        """Filter a chunk of raw output; returns the complete lines that pass"""
+        lines = (self._partial + self._decoder.decode(data)).split('\n')
+        self._partial = lines.pop()
+        return _join(self._push(0, lines))
+
+    def finish(self) -> str:
+        """Flush the last partial line and the operators that only answer at the end"""
+        rest = self._partial + self._decoder.decode(b'', final=True)
+        self._partial = ""
+        output = self._push(0, [rest] if rest else [])
+        for index, stage in enumerate(self.stages):
+            output += self._push(index + 1, stage.close())
+        return _join(output)
+
+    def _push(self, start: int, lines: List[str]) -> List[str]:
+        for stage in self.stages[start:]:
+            lines = [kept for line in lines for kept in stage.push(line.rstrip('\r'))]
+        return lines
+
+class _Head:
+    def __init__(self, stage: Stage):
+        self.remaining = stage.lines
+
+    def push(self, line: str) -> List[str]:
+        if self.remaining <= 0:
+            return []
+        self.remaining -= 1
+        return [line]
+
+    def close(self) -> List[str]:
+        return []
+
+class _Tail:
+    def __init__(self, stage: Stage):
+        self.lines = deque(maxlen=stage.lines)
+
+    def push(self, line: str) -> List[str]:
+        self.lines.append(line)
+        return []
+
+    def close(self) -> List[str]:
+        return list(self.lines)
+
+class _Grep:
+    def __init__(self, stage: Stage):
+        self.text = stage.text.lower() if stage.ignore_case else stage.text
+        self.invert = stage.invert
+        self.ignore_case = stage.ignore_case
+
+    def push(self, line: str) -> List[str]:
+        found = self.text in (line.lower() if self.ignore_case else line)
+        return [line] if found != self.invert else []
+
+    def close(self) -> List[str]:
+        return []
+
+class _Count:
+    def __init__(self, stage: Stage):
+        self.count = 0
+
+    def push(self, line: str) -> List[str]:
+        self.count += 1
+        return []
+
+    def close(self) -> List[str]:
+        return [str(self.count)]
+
+_LOCAL_STAGES = {'head': _Head, 'tail': _Tail, 'grep': _Grep, 'count': _Count}
+
+def _parse_stage(op: str, args: str) -> Stage:
+    args = args.strip()
+    if op in ('head', 'tail'):
+        if not args:
+            return Stage(op)
+        if not args.isdigit() or int(args) == 0:
+            raise ValueError(f"| {op} takes a number of lines, not {args!r}")
+        return Stage(op, lines=int(args))
+    if op == 'count':
+        if args:
+            raise ValueError("| count takes no arguments")
+        return Stage(op)
+
+    stage = Stage(op)
+    words = args.split(None, 1)
+    while words and len(words[0]) > 1 and words[0].startswith('-') and set(words[0][1:]) <= set('vi'):
+        stage.invert |= 'v' in words[0]
+        stage.ignore_case |= 'i' in words[0]
+        args = words[1] if len(words) > 1 else ""
+        words = args.split(None, 1)
+    if len(args) >= 2 and args[0] == args[-1] and args[0] in '"\'':
+        args = args[1:-1]
+    if not args:
+        raise ValueError("| grep needs some text to look for")
+    stage.text = args
+    return stage
+
+def _split_pipes(command: str) -> List[str]:
+    """Split on | outside single or double quotes"""
+    segments, current, quote = [], [], None
+    for char in command:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '|':
+            segments.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    segments.append(''.join(current))
+    return segments
+
+def _ps_pipeline(command: str, stages: List[Stage]) -> str:
+    # Format to text lines first so the operators see what the user would
+    parts = [f"& {{\n{command}\n}}", "Out-String -Stream"]
+    for stage in stages:
+        if stage.op == 'head':
+            # Also stops the command once enough lines have been produced
+            parts.append(f"Select-Object -First {stage.lines}")
+        elif stage.op == 'tail':
+            parts.append(f"Select-Object -Last {stage.lines}")
+        elif stage.op == 'grep':
+            flags = (" -NotMatch" if stage.invert else "") + ("" if stage.ignore_case else " -CaseSensitive")
+            parts.append(f"Select-String -SimpleMatch{flags} -Pattern {quote_ps(stage.text)}")
+            parts.append("ForEach-Object { $_.Line }")
+        else:
+            parts.append("Measure-Object")
+            parts.append("ForEach-Object { $_.Count }")
+    return " | ".join(parts)
+
+def _join(lines: List[str]) -> str:
+    return ''.join(line + '\n' for line in lines)
@@ -0,0 +1,186 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+from config import config
+
+PoolKey = Tuple[str, int, str]
+
+class WinRMPool:
+    """Keep authenticated WinRM clients (and their open shells) for reuse"""
+
+    def __init__(self, factory: Callable[..., Any], max_size: int = None, idle_ttl: int = None,
+                 health_interval: int = None):
+        self.factory = factory
+        self.max_size = max_size or config.WINRM_POOL_SIZE
+        # Idle clients live as long as an unused session would
+        self.idle_ttl = idle_ttl or config.SESSION_TTL
+        self.health_interval = health_interval or config.WINRM_POOL_HEALTH_INTERVAL
+        self._idle: Dict[PoolKey, List[Any]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, host: str, username: str, password: str, port: int) -> Any:
+        """Get an open client for (host, port, username), creating one if needed"""
+        key = (host, port, username)
+        stale = []
+        client = None
+
+        with self._lock:
+            stale.extend(self._pop_expired(time.time()))
+            clients = self._idle.get(key, [])
+            while clients and client is None:
+                candidate = clients.pop()
+                if candidate.password == password:
+                    client = candidate
+                else:
+                    # Password changed since this client was pooled
+                    stale.append(candidate)
+                    self._size -= 1
+            if not clients:
+                self._idle.pop(key, None)
+
+            if client is None:
+                if self._size >= self.max_size:
+                    stale.extend(self._pop_lru())
+                self._size += 1
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        self._close(stale)
+
+        if client is not None and time.time() - client.last_used > self.health_interval:
+            if not client.is_alive():
+                # Keep its slot for the replacement
+                self._close([client])
+                client = None
+
+        if client is None:
+            client = self.factory(host, username, password, port)
+            try:
+                client.open()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+
+        return client
+
+    def adopt(self, client: Any):
+        """Pool a client that was opened outside acquire(), e.g. by a connection race"""
+        with self._lock:
+            stale = self._pop_lru() if self._size >= self.max_size else []
+            self._size += 1
+            self.misses += 1
+        self._close(stale)
+        self.release(client)
+
+    def release(self, client: Any, discard: bool = False):
+        """Return a client to the pool, or close it if discarded or over capacity"""
+        client.last_used = time.time()
+        with self._lock:
+            if discard or self._size > self.max_size:
+                self._size -= 1
+            else:
+                self._idle.setdefault((client.host, client.port, client.username), []).append(client)
+                return
+        self._close([client])
+
+    @contextmanager
+    def connection(self, host: str, username: str, password: str, port: int):
+        """Borrow a client for the duration of a with-block"""
+        client = self.acquire(host, username, password, port)
+        try:
+            yield client
+        except Exception:
+            self.release(client, discard=True)
+            raise
+        else:
+            self.release(client)
+
+    def evict(self, host: str, port: int, username: str) -> int:
+        """Close idle clients for one (host, port, username) in the background"""
+        with self._lock:
+            clients = self._idle.pop((host, port, username), [])
+            self._size -= len(clients)
+            self.evictions += len(clients)
+        self._close_in_background(clients)
+        return len(clients)
+
+    def evict_idle(self) -> int:
+        """Close clients idle longer than the session TTL in the background"""
+        with self._lock:
+            expired = self._pop_expired(time.time())
+        self._close_in_background(expired)
+        return len(expired)
+
+    def close_all(self):
+        """Close every idle client"""
+        with self._lock:
+            clients = [client for idle in self._idle.values() for client in idle]
+            self._idle.clear()
+            self._size -= len(clients)
+        self._close(clients)
+
+    def stats(self) -> Dict[str, int]:
+        """Return pool size and reuse counters"""
+        with self._lock:
+            return {
+                'size': self._size,
+                'idle': sum(len(idle) for idle in self._idle.values()),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _pop_expired(self, now: float) -> List[Any]:
+        """Remove idle clients past idle_ttl (caller holds the lock)"""
+        expired = []
+        for key in list(self._idle):
+            idle = self._idle[key]
+            keep = [client for client in idle if now - client.last_used <= self.idle_ttl]
+            expired.extend(client for client in idle if now - client.last_used > self.idle_ttl)
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        self._size -= len(expired)
+        self.evictions += len(expired)
+        return expired
+
+    def _pop_lru(self) -> List[Any]:
+        """Remove the least recently used idle client (caller holds the lock)"""
+        oldest_key, oldest = None, None
+        for key, idle in self._idle.items():
+            for client in idle:
+                if oldest is None or client.last_used < oldest.last_used:
+                    oldest_key, oldest = key, client
+        if oldest is None:
+            # Every client is in use; the new one is closed again on release
+            return []
+        self._idle[oldest_key].remove(oldest)
+        if not self._idle[oldest_key]:
+            del self._idle[oldest_key]
+        self._size -= 1
+        self.evictions += 1
+        return [oldest]
+
+    def _close_in_background(self, clients: List[Any]):
+        """Close clients without blocking the caller (usually the event loop)"""
+        if clients:
+            threading.Thread(target=self._close, args=(clients,), name="winrm-pool-close", daemon=True).start()
+
+    def _close(self, clients: List[Any]):
+        """Close clients outside the lock (closing a shell is a network call)"""
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
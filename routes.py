@@ -0,0 +1,91 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from config import config
+from metrics import registry
+
+# Ports the WinRM listeners use out of the box
+HTTP_PORT = 5985
+HTTPS_PORT = 5986
+
+@dataclass(frozen=True)
+class Route:
+    """One way to reach a WinRM server: port, scheme and authentication transport"""
+    port: int
+    scheme: str
+    transport: str
+
+    def endpoint(self, host: str) -> str:
+        return f"{self.scheme}://{host}:{self.port}/wsman"
+
+    def __str__(self) -> str:
+        return f"{self.port}/{self.scheme} {self.transport}"
+
+def scheme_for(port: int) -> str:
+    """HTTPS for the ports TLS listeners use, HTTP otherwise"""
+    return 'https' if port in (HTTPS_PORT, 443) else 'http'
+
+def default_route(port: int = None) -> Route:
+    """The single route used before racing existed: one port, the configured transport"""
+    port = port or config.WINRM_PORT
+    return Route(port, scheme_for(port), config.WINRM_TRANSPORT)
+
+def candidate_routes(port: int = None) -> List[Route]:
+    """Routes to race for a host, most likely first.
+
+    The requested (or configured) port comes first, then 5985/HTTP and
+    5986/HTTPS, each with every transport in WINRM_TRANSPORTS.
+    """
+    ports = []
+    for candidate in (port or config.WINRM_PORT, HTTP_PORT, HTTPS_PORT):
+        if candidate not in ports:
+            ports.append(candidate)
+    return [Route(p, scheme_for(p), transport) for p in ports for transport in config.WINRM_TRANSPORTS]
+
+class RouteCache:
+    """Remember which route worked for each host for WINRM_ROUTE_TTL seconds"""
+
+    # Expired entries are dropped once there are more than this many
+    PRUNE_AT = 1000
+
+    def __init__(self, ttl: int = None):
+        self.ttl = ttl or config.WINRM_ROUTE_TTL
+        self._routes: Dict[str, Tuple[Route, float]] = {}
+        # Used from executor worker threads
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, host: str) -> Optional[Route]:
+        """The host's cached route, or None if there is none or it expired"""
+        with self._lock:
+            entry = self._routes.get(host.lower())
+            if entry and entry[1] > time.time():
+                self.hits += 1
+                return entry[0]
+            self._routes.pop(host.lower(), None)
+            self.misses += 1
+            return None
+
+    def put(self, host: str, route: Route):
+        """Remember the route that just worked for host"""
+        now = time.time()
+        with self._lock:
+            if len(self._routes) >= self.PRUNE_AT:
+                for key in [key for key, (_, expires) in self._routes.items() if expires <= now]:
+                    del self._routes[key]
+            self._routes[host.lower()] = (route, now + self.ttl)
+
+    def forget(self, host: str):
+        """Drop a route that stopped working"""
+        with self._lock:
+            self._routes.pop(host.lower(), None)
+
+# Global cache of winning routes, shared by the sync and async clients
+route_cache = RouteCache()
+
+registry.counter('winrm_route_cache_lookups_total', "Route cache lookups by result (hit/miss)",
+                 ['result'], lambda: {('hit',): route_cache.hits, ('miss',): route_cache.misses})
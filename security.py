@@ -3,6 +3,7 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from typing import Callable, Any
 from config import config
+from metrics import HANDLER_SECONDS
 from utils import redact_password
 
 def allowed_users_only(func: Callable) -> Callable:
@@ -18,6 +19,20 @@ def allowed_users_only(func: Callable) -> Callable:
                 )
             return
         
+        # Every handler passes through here, so this times all of them
+        with HANDLER_SECONDS.time(handler=func.__name__):
+            return await func(update, context, *args, **kwargs)
+    return wrapper
+
+def admin_only(func: Callable) -> Callable:
+    """Decorator to restrict a handler to ADMIN_USER_IDS"""
+    @wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args: Any, **kwargs: Any):
+        if update.effective_user.id not in config.ADMIN_USER_IDS:
+            if update.message:
+                await update.message.reply_text("⛔ This command is for bot admins only.")
+            return
+        
         return await func(update, context, *args, **kwargs)
     return wrapper
 
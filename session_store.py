@@ -0,0 +1,270 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from cryptography.fernet import Fernet, InvalidToken
+from config import config
+
+# (worker index, worker count): a worker only loads and expires the users routed to it
+Shard = Optional[Tuple[int, int]]
+
+class SessionStore:
+    """Where sessions are kept between restarts; the default keeps nothing"""
+
+    def load(self, cutoff: float) -> Iterable[dict]:
+        """Return stored sessions used after cutoff, as dicts of Session fields"""
+        return []
+
+    def save(self, session) -> None:
+        """Write a new or changed session"""
+
+    def touch(self, user_id: int, last_used: float) -> None:
+        """Record a last_used update; may be written later by flush()"""
+
+    def delete(self, user_id: int) -> None:
+        """Remove a session and its credentials"""
+
+    def flush(self, cutoff: float = None) -> int:
+        """Write buffered updates and drop sessions unused since cutoff; returns rows dropped"""
+        return 0
+
+    def close(self) -> None:
+        """Flush and release the backend"""
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in an SQLite file with Fernet-encrypted passwords.
+
+    last_used updates are buffered in memory and written in one transaction
+    by flush(), so get_session never waits on the disk. A crash loses at most
+    one flush interval of last_used updates, which only shortens sessions.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            host TEXT NOT NULL,
+            port INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            password BLOB NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            is_connected INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+    """
+
+    def __init__(self, path: str, key: str, shard: Shard = None):
+        self._fernet = fernet(key)
+        self._db = connect(path, self.SCHEMA)
+        self._shard = shard_filter(shard)
+        # The event loop and the flush worker share the connection
+        self._lock = threading.Lock()
+        self._touched: Dict[int, float] = {}
+
+    def load(self, cutoff: float) -> List[dict]:
+        self.flush(cutoff)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT user_id, host, port, username, password, created_at, last_used, is_connected "
+                "FROM sessions WHERE last_used >= ?" + self._shard, (cutoff,)
+            ).fetchall()
+        sessions = []
+        for user_id, host, port, username, token, created_at, last_used, is_connected in rows:
+            try:
+                password = self._fernet.decrypt(token).decode('utf-8')
+            except InvalidToken:
+                # Written with a different key; the user has to reconnect
+                self.delete(user_id)
+                continue
+            sessions.append({
+                'user_id': user_id, 'host': host, 'port': port, 'username': username,
+                'password': password, 'created_at': created_at, 'last_used': last_used,
+                'is_connected': bool(is_connected),
+            })
+        return sessions
+
+    def save(self, session):
+        token = self._fernet.encrypt(session.password.encode('utf-8'))
+        with self._lock:
+            self._touched.pop(session.user_id, None)
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(user_id, host, port, username, password, created_at, last_used, is_connected) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (session.user_id, session.host, session.port, session.username, token,
+                 session.created_at, session.last_used, int(session.is_connected))
+            )
+
+    def touch(self, user_id: int, last_used: float):
+        with self._lock:
+            self._touched[user_id] = last_used
+
+    def delete(self, user_id: int):
+        with self._lock:
+            self._touched.pop(user_id, None)
+            self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def flush(self, cutoff: float = None) -> int:
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "UPDATE sessions SET last_used = ? WHERE user_id = ? AND last_used < ?",
+                    [(last_used, user_id, last_used) for user_id, last_used in touched.items()]
+                )
+                removed = 0
+                if cutoff is not None:
+                    # Range delete on the last_used index. Other workers' rows are
+                    # left alone: their newer last_used may not be flushed yet
+                    removed = self._db.execute(
+                        "DELETE FROM sessions WHERE last_used < ?" + self._shard, (cutoff,)
+                    ).rowcount
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                # Keep the updates for the next attempt
+                for user_id, last_used in touched.items():
+                    self._touched.setdefault(user_id, last_used)
+                raise
+        return removed
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+class JobStore:
+    """Where finished background jobs are kept between restarts; the default keeps nothing"""
+
+    def load(self, cutoff: float) -> Iterable[dict]:
+        """Return jobs finished after cutoff, as dicts of Job fields"""
+        return []
+
+    def save(self, job) -> None:
+        """Write a finished job and its compressed output"""
+
+    def delete(self, user_id: int, job_id: int) -> None:
+        """Remove one job"""
+
+    def delete_before(self, cutoff: float) -> int:
+        """Remove jobs finished before cutoff; returns how many"""
+        return 0
+
+    def close(self) -> None:
+        """Release the backend"""
+
+class SQLiteJobStore(JobStore):
+    """Finished jobs in the session database, output encrypted like passwords"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            user_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            address TEXT NOT NULL,
+            command TEXT NOT NULL,
+            powershell INTEGER NOT NULL,
+            state TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL NOT NULL,
+            exit_code INTEGER,
+            error TEXT,
+            stdout_z BLOB NOT NULL,
+            stderr_z BLOB NOT NULL,
+            PRIMARY KEY (user_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+    """
+
+    FIELDS = ('user_id', 'id', 'address', 'command', 'powershell', 'state', 'created_at', 'started_at',
+              'finished_at', 'exit_code', 'error', 'stdout_z', 'stderr_z')
+
+    def __init__(self, path: str, key: str, shard: Shard = None):
+        self._fernet = fernet(key)
+        self._db = connect(path, self.SCHEMA)
+        self._shard = shard_filter(shard)
+        self._lock = threading.Lock()
+
+    def load(self, cutoff: float) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM jobs WHERE finished_at >= ?" + self._shard, (cutoff,)
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            fields = dict(zip(self.FIELDS, row))
+            try:
+                for name in ('stdout_z', 'stderr_z'):
+                    fields[name] = self._fernet.decrypt(fields[name]) if fields[name] else b""
+            except InvalidToken:
+                self.delete(fields['user_id'], fields['id'])
+                continue
+            fields['powershell'] = bool(fields['powershell'])
+            fields['output_bytes'] = len(fields['stdout_z']) + len(fields['stderr_z'])
+            jobs.append(fields)
+        return jobs
+
+    def save(self, job):
+        values = [getattr(job, name) for name in self.FIELDS]
+        values[-2:] = [self._fernet.encrypt(blob) if blob else b"" for blob in values[-2:]]
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(self.FIELDS)}) "
+                f"VALUES ({', '.join('?' for _ in self.FIELDS)})", values
+            )
+
+    def delete(self, user_id: int, job_id: int):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE user_id = ? AND id = ?", (user_id, job_id))
+
+    def delete_before(self, cutoff: float) -> int:
+        with self._lock:
+            return self._db.execute("DELETE FROM jobs WHERE finished_at < ?" + self._shard, (cutoff,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def fernet(key: str) -> Fernet:
+    # Fernet raises ValueError on a malformed key, before anything is written
+    return Fernet(key.encode() if isinstance(key, str) else key)
+
+def connect(path: str, schema: str) -> sqlite3.Connection:
+    """Open the shared database file, safe for several worker processes"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    # Wait for other workers' write locks instead of failing straight away
+    db.execute("PRAGMA busy_timeout=5000")
+    # WAL with synchronous=NORMAL: commits don't fsync, checkpoints do
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(schema)
+    try:
+        os.chmod(path, 0o600)
+    except OSError:
+        pass
+    return db
+
+def shard_filter(shard: Shard) -> str:
+    """SQL condition limiting a query to one worker's users"""
+    if not shard or shard[1] <= 1:
+        return ""
+    index, count = shard
+    return f" AND user_id % {int(count)} = {int(index)}"
+
+def create_stores(shard: Shard = None) -> Tuple[SessionStore, JobStore]:
+    """Build the backends chosen by SESSION_BACKEND; raises ValueError if misconfigured"""
+    if config.SESSION_BACKEND == 'memory':
+        return SessionStore(), JobStore()
+    if config.SESSION_BACKEND == 'sqlite':
+        if not config.SESSION_STORE_KEY:
+            raise ValueError(
+                "SESSION_STORE_KEY is required for SESSION_BACKEND=sqlite. Generate one with: "
+                "python -c \"from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())\""
+            )
+        return (
+            SQLiteSessionStore(config.SESSION_DB_PATH, config.SESSION_STORE_KEY, shard),
+            SQLiteJobStore(config.SESSION_DB_PATH, config.SESSION_STORE_KEY, shard),
+        )
+    raise ValueError(f"Unknown SESSION_BACKEND {config.SESSION_BACKEND!r} (use memory or sqlite)")
@@ -1,7 +1,13 @@
+import heapq
 import time
-from typing import Dict, Optional, Any
-from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
 from config import config
+from metrics import registry
+from session_store import SessionStore
+from utils import split_host_port
+from watches import watch_manager
+from winrm_client import winrm_pool
 
 @dataclass
 class Session:
@@ -14,22 +20,68 @@ class Session:
     created_at: float
     last_used: float
     is_connected: bool = False
-    winrm_client: Any = None
+    
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+@dataclass
+class HostEntry:
+    """Credentials for one server in a host group"""
+    host: str
+    port: int
+    username: str
+    password: str
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+@dataclass
+class HostGroup:
+    """Named set of servers a user can run commands on together"""
+    name: str
+    last_used: float
+    hosts: Dict[str, HostEntry] = field(default_factory=dict)
 
 class SessionManager:
     """Manage user sessions with TTL"""
     
-    def __init__(self):
+    def __init__(self, store: SessionStore = None):
+        # Sessions live in memory; the store only makes them survive restarts
+        self.store = store or SessionStore()
         self.sessions: Dict[int, Session] = {}
+        self.groups: Dict[int, Dict[str, HostGroup]] = {}
+        # Expiry index: at most one (deadline, user_id) per user, never later
+        # than the real deadline; touching a session doesn't reorder the heap
+        self._expiry: List[Tuple[float, int]] = []
+        self._indexed: Set[int] = set()
+        # Sessions sharing each pooled (host, port, username)
+        self._pool_refs: Dict[Tuple[str, int, str], int] = {}
+        self.expired_count = 0
+    
+    def attach_store(self, store: SessionStore) -> int:
+        """Switch to a persistent store and restore its unexpired sessions; returns how many"""
+        self.store = store
+        restored = 0
+        for fields in store.load(time.time() - config.SESSION_TTL):
+            session = Session(**fields)
+            key = (session.host, session.port, session.username)
+            self._pool_refs[key] = self._pool_refs.get(key, 0) + 1
+            self.sessions[session.user_id] = session
+            if session.user_id not in self._indexed:
+                heapq.heappush(self._expiry, (session.last_used + config.SESSION_TTL, session.user_id))
+                self._indexed.add(session.user_id)
+            restored += 1
+        return restored
+    
+    def flush_store(self) -> int:
+        """Write buffered last_used updates and drop expired rows; safe to run off the event loop"""
+        return self.store.flush(time.time() - config.SESSION_TTL)
     
     def create_session(self, user_id: int, host: str, username: str, password: str, port: int = None) -> Session:
         """Create a new session for user"""
-        if port is None:
-            if ':' in host:
-                host, port_str = host.split(':', 1)
-                port = int(port_str)
-            else:
-                port = config.WINRM_PORT
+        host, port = split_host_port(host, port)
         
         session = Session(
             user_id=user_id,
@@ -41,7 +93,22 @@ class SessionManager:
             last_used=time.time()
         )
         
+        # Take the new pool reference first so reconnecting to the same
+        # server doesn't evict the client test_connection just pooled
+        key = (session.host, session.port, session.username)
+        self._pool_refs[key] = self._pool_refs.get(key, 0) + 1
+        if user_id in self.sessions:
+            previous = self.sessions[user_id]
+            if (previous.address, previous.username) != (session.address, session.username):
+                # Watches run with the session's credentials on its server
+                watch_manager.stop(user_id, reason="you connected to another server")
+            self._release_pool_key(previous)
         self.sessions[user_id] = session
+        self.store.save(session)
+        
+        if user_id not in self._indexed:
+            heapq.heappush(self._expiry, (session.last_used + config.SESSION_TTL, user_id))
+            self._indexed.add(user_id)
         return session
     
     def get_session(self, user_id: int) -> Optional[Session]:
@@ -52,10 +119,12 @@ class SessionManager:
             # Check TTL
             if time.time() - session.last_used > config.SESSION_TTL:
                 self.delete_session(user_id)
+                self.expired_count += 1
                 return None
             
-            # Update last used time
+            # Update last used time (written to the store in the next flush)
             session.last_used = time.time()
+            self.store.touch(user_id, session.last_used)
             return session
         
         return None
@@ -63,40 +132,125 @@ class SessionManager:
     def delete_session(self, user_id: int) -> bool:
         """Delete user session"""
         if user_id in self.sessions:
-            # Clean up WinRM client if exists
-            session = self.sessions[user_id]
-            if session.winrm_client:
-                try:
-                    # WinRM doesn't have explicit close, but we can clean up references
-                    session.winrm_client = None
-                except:
-                    pass
-            
-            del self.sessions[user_id]
+            self._release_pool_key(self.sessions.pop(user_id))
+            self.store.delete(user_id)
+            watch_manager.stop(user_id, reason="the session ended")
             return True
         return False
     
-    def update_session_connection(self, user_id: int, is_connected: bool, winrm_client: Any = None) -> bool:
+    def _release_pool_key(self, session: Session):
+        """Close pooled shells once no session uses them any more"""
+        key = (session.host, session.port, session.username)
+        self._pool_refs[key] -= 1
+        if not self._pool_refs[key]:
+            del self._pool_refs[key]
+            winrm_pool.evict(*key)
+    
+    def update_session_connection(self, user_id: int, is_connected: bool) -> bool:
         """Update session connection status"""
         session = self.get_session(user_id)
         if session:
             session.is_connected = is_connected
-            session.winrm_client = winrm_client
+            self.store.save(session)
             return True
         return False
     
+    def add_group_host(self, user_id: int, group: str, host: str, username: str, password: str,
+                       port: int = None) -> HostEntry:
+        """Add or replace a server in one of the user's host groups"""
+        host, port = split_host_port(host, port)
+        entry = HostEntry(host=host, port=port, username=username, password=password)
+        groups = self.groups.setdefault(user_id, {})
+        host_group = groups.get(group) or HostGroup(name=group, last_used=time.time())
+        host_group.hosts[entry.address] = entry
+        host_group.last_used = time.time()
+        groups[group] = host_group
+        return entry
+    
+    def remove_group_host(self, user_id: int, group: str, host: str) -> bool:
+        """Remove a server from a host group"""
+        host_group = self.get_group(user_id, group)
+        if not host_group:
+            return False
+        address = "%s:%s" % split_host_port(host)
+        return host_group.hosts.pop(address, None) is not None
+    
+    def get_group(self, user_id: int, group: str) -> Optional[HostGroup]:
+        """Get a host group if it hasn't expired; groups share the session TTL"""
+        host_group = self.groups.get(user_id, {}).get(group)
+        if host_group:
+            if time.time() - host_group.last_used > config.SESSION_TTL:
+                self.delete_group(user_id, group)
+                return None
+            host_group.last_used = time.time()
+        return host_group
+    
+    def list_groups(self, user_id: int) -> List[HostGroup]:
+        """Get the user's unexpired host groups"""
+        names = list(self.groups.get(user_id, {}))
+        return [group for group in (self.get_group(user_id, name) for name in names) if group]
+    
+    def delete_group(self, user_id: int, group: str) -> bool:
+        """Delete one host group"""
+        groups = self.groups.get(user_id, {})
+        if groups.pop(group, None) is None:
+            return False
+        if not groups:
+            del self.groups[user_id]
+        return True
+    
+    def clear_groups(self, user_id: int) -> int:
+        """Delete all of the user's host groups"""
+        return len(self.groups.pop(user_id, {}))
+    
     def cleanup_expired_sessions(self) -> int:
         """Clean up expired sessions and return count removed"""
-        current_time = time.time()
-        expired_users = [
-            user_id for user_id, session in self.sessions.items()
-            if current_time - session.last_used > config.SESSION_TTL
-        ]
+        now = time.time()
+        removed = 0
         
-        for user_id in expired_users:
-            self.delete_session(user_id)
+        # Pop deadlines that have passed; sessions used since then go back in
+        while self._expiry and self._expiry[0][0] <= now:
+            _, user_id = heapq.heappop(self._expiry)
+            session = self.sessions.get(user_id)
+            if not session:
+                self._indexed.discard(user_id)
+                continue
+            deadline = session.last_used + config.SESSION_TTL
+            if deadline > now:
+                heapq.heappush(self._expiry, (deadline, user_id))
+            else:
+                self._indexed.discard(user_id)
+                self.delete_session(user_id)
+                removed += 1
         
-        return len(expired_users)
+        self.expired_count += removed
+        return removed
+    
+    def cleanup_expired_groups(self) -> int:
+        """Drop host groups (and their passwords) unused for longer than the TTL"""
+        now = time.time()
+        expired = [
+            (user_id, name) for user_id, groups in self.groups.items()
+            for name, host_group in groups.items()
+            if now - host_group.last_used > config.SESSION_TTL
+        ]
+        for user_id, name in expired:
+            self.delete_group(user_id, name)
+        return len(expired)
+    
+    def stats(self) -> Dict[str, int]:
+        """Return live and expired session counts"""
+        return {
+            'live': len(self.sessions),
+            'expired': self.expired_count,
+            'indexed': len(self._expiry),
+            'groups': sum(len(groups) for groups in self.groups.values()),
+        }
 
 # Global session manager
-session_manager = SessionManager()
\ No newline at end of file
+session_manager = SessionManager()
+
+registry.gauge('sessions_live', "Sessions held in memory, including ones not yet reaped",
+               callback=lambda: len(session_manager.sessions))
+registry.counter('sessions_expired_total', "Sessions dropped after SESSION_TTL",
+                 callback=lambda: session_manager.expired_count)
\ No newline at end of file
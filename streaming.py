@@ -0,0 +1,154 @@
+import asyncio
+import codecs
+import time
+from typing import Optional
+from telegram import Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+from config import config
+from executor import winrm_executor
+from pipeline import prepare_pipeline
+from winrm_client import CancelToken, run_command as run_remote_command
+
+class StreamingMessage:
+    """Show growing command output by editing a Telegram message at a throttled rate"""
+
+    def __init__(self, message: Message, header: str, interval: float = None, limit: int = None):
+        self.message = message
+        self.header = header
+        self.interval = interval or config.STREAM_EDIT_INTERVAL
+        self.limit = limit or config.MAX_OUTPUT_LENGTH
+        self.body = ""
+        self.part = 1
+        self.pending = False
+        self.last_sent = ""
+        self.last_edit = 0.0
+
+    def feed(self, text: str):
+        """Buffer new output; it is shown on the next flush"""
+        if text:
+            self.body += text
+            self.pending = True
+
+    def next_flush_in(self) -> Optional[float]:
+        """Seconds until buffered output may be flushed, or None if nothing is buffered"""
+        if not self.pending:
+            return None
+        return max(0.0, self.last_edit + self.interval - time.monotonic())
+
+    async def flush(self):
+        """Edit the current message, moving to follow-up messages once it is full"""
+        room = self.limit - len(self._render(""))
+        while len(self.body) > room:
+            # Close off the full message and continue in a new one
+            await self._edit(self._render(self.body[:room]))
+            self.body = self.body[room:]
+            self.part += 1
+            room = self.limit - len(self._render(""))
+            await self._throttle()
+            self.last_sent = self._render(self.body[:room])
+            self.message = await self._send(self.last_sent)
+            self.last_edit = time.monotonic()
+        await self._edit(self._render(self.body))
+        self.pending = False
+
+    async def finish(self, stderr: str, exit_code: int):
+        """Flush remaining output and append stderr and the exit code"""
+        await self.flush()
+        footer = ""
+        if stderr:
+            footer += f"\n\n📥 **Stderr:**\n```\n{stderr[:self.limit // 2]}\n```"
+        footer += f"\n\n🔢 **Exit Code:** `{exit_code}`"
+        final = self._render(self.body) + footer
+        if len(final) <= self.limit:
+            await self._edit(final)
+        else:
+            await self._send(footer.strip())
+
+    def _render(self, body: str) -> str:
+        header = self.header if self.part == 1 else f"{self.header} (part {self.part})"
+        return f"{header}\n```\n{body or '…'}\n```"
+
+    async def _throttle(self):
+        delay = self.last_edit + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, text: str) -> Message:
+        """Reply with a new message, as plain text if the output breaks the Markdown"""
+        while True:
+            try:
+                return await self.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except BadRequest:
+                return await self.message.reply_text(text)
+
+    async def _edit(self, text: str):
+        if text == self.last_sent:
+            # Telegram rejects edits that change nothing
+            return
+        await self._throttle()
+        while True:
+            try:
+                await self.message.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    break
+                # Output broke the Markdown; show it as plain text instead
+                await self.message.edit_text(text)
+                break
+        self.last_sent = text
+        self.last_edit = time.monotonic()
+
+async def stream_command(update, session, command: str, powershell: bool = False, timeout: float = None):
+    """Run a command and stream its stdout into Telegram as it arrives.
+
+    Raises CommandCancelled after streaming what arrived if the command is
+    cancelled or runs past timeout seconds.
+    """
+    user_id = update.effective_user.id
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+
+    def on_output(stdout: bytes, stderr: bytes):
+        # Called on the worker thread
+        if stdout:
+            loop.call_soon_threadsafe(chunks.put_nowait, stdout)
+
+    label = "💻 **Streaming PowerShell:**" if powershell else "🖥️ **Streaming:**"
+    stream = StreamingMessage(
+        await update.message.reply_text(f"{label} `{command}`", parse_mode=ParseMode.MARKDOWN),
+        f"{label} `{command}`"
+    )
+
+    remote, output_filter = prepare_pipeline(command, powershell)
+    task = asyncio.ensure_future(winrm_executor.run(
+        user_id, session.host, run_remote_command,
+        session.host, session.username, session.password, session.port, remote,
+        powershell=powershell, on_output=on_output, token=CancelToken(timeout), output_filter=output_filter
+    ))
+    task.add_done_callback(lambda _: loop.call_soon_threadsafe(chunks.put_nowait, None))
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    while True:
+        try:
+            chunk = await asyncio.wait_for(chunks.get(), stream.next_flush_in())
+        except asyncio.TimeoutError:
+            await stream.flush()
+            continue
+        if chunk is None:
+            break
+        stream.feed(decoder.decode(chunk))
+        if stream.next_flush_in() == 0:
+            await stream.flush()
+
+    stream.feed(decoder.decode(b'', final=True))
+    if task.exception() is not None:
+        # Show what arrived before the failure or cancel
+        await stream.flush()
+    stdout, stderr, exit_code = await task
+    await stream.finish(stderr, exit_code)
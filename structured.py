@@ -0,0 +1,194 @@
+import json
+import operator
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Longest value shown in a table cell
+CELL_WIDTH = 40
+
+# Columns used when the objects have no default display set
+DEFAULT_COLUMNS = 8
+
+# Filter operators; '~' is a case-insensitive substring match
+COMPARISONS = {
+    '=': operator.eq, '!=': operator.ne, '>': operator.gt,
+    '<': operator.lt, '>=': operator.ge, '<=': operator.le,
+}
+FILTER = re.compile(r'^\s*([\w.-]+)\s*(!=|>=|<=|=|>|<|~)\s*(.*?)\s*$')
+
+# Windows PowerShell 5.1 serializes DateTime as "\/Date(<ms since epoch>)\/"
+JSON_DATE = re.compile(r'^/Date\((-?\d+)([+-]\d{4})?\)/$')
+
+Row = Dict[str, Any]
+Filter = Tuple[str, str, str]
+
+def quote_ps(value: str) -> str:
+    """Single-quoted PowerShell string literal"""
+    return "'" + value.replace("'", "''") + "'"
+
+def build_json_command(command: str, columns: Sequence[str] = (), extra: Sequence[str] = (),
+                       first: int = None) -> str:
+    """Wrap a PowerShell command so it prints its objects as one compact JSON array.
+
+    Only `columns` are serialized; without them, the objects' default display
+    properties (or their first few properties) are, which keeps the payload
+    close to what Format-Table would have shown minus the padding. `extra`
+    columns (e.g. for sorting) are added to either set. `first` stops the
+    pipeline after that many objects, for a top-N that needs no sorting.
+    """
+    if columns:
+        pick = f"$columns = @({', '.join(quote_ps(column) for column in columns)})\n"
+    else:
+        pick = (
+            "$first = $items | Select-Object -First 1\n"
+            "$columns = @($first.PSStandardMembers.DefaultDisplayPropertySet.ReferencedPropertyNames)\n"
+            "if (-not $columns -and $first -ne $null) {\n"
+            f"  $columns = @($first.PSObject.Properties | Select-Object -First {DEFAULT_COLUMNS} -ExpandProperty Name)\n"
+            "}\n"
+        )
+    if extra:
+        # Hashtable keys are case-insensitive, like property names
+        pick += (
+            f"$seen = @{{}}; $columns = @(foreach ($c in $columns + @({', '.join(quote_ps(c) for c in extra)})) "
+            "{ if (-not $seen.ContainsKey($c)) { $seen[$c] = 1; $c } })\n"
+        )
+    return (
+        "$ProgressPreference = 'SilentlyContinue'\n"
+        f"$items = @(& {{\n{command}\n}}{f' | Select-Object -First {int(first)}' if first is not None else ''})\n"
+        + pick +
+        "if ($items.Count -eq 0) { '[]' }\n"
+        "elseif ($items[0] -is [string] -or $items[0].GetType().IsPrimitive) {\n"
+        "  ConvertTo-Json -InputObject $items -Compress\n"
+        "} else {\n"
+        "  ConvertTo-Json -InputObject @($items | Select-Object -Property $columns) -Compress -Depth 2\n"
+        "}"
+    )
+
+def parse_json_output(stdout: str) -> List[Row]:
+    """Rows from build_json_command's output; raises ValueError if it isn't JSON"""
+    data = json.loads(stdout.strip() or '[]')
+    if not isinstance(data, list):
+        data = [data]
+    return [item if isinstance(item, dict) else {'Value': item} for item in data]
+
+def parse_filters(text: str) -> List[Filter]:
+    """Parse 'CPU>10,Name~sql' into (column, operator, value) triples; raises ValueError"""
+    filters = []
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        match = FILTER.match(part)
+        if not match:
+            raise ValueError(f"Bad filter {part!r}: use column, one of {' '.join(COMPARISONS)} ~, then a value")
+        filters.append(match.groups())
+    return filters
+
+def query(rows: List[Row], columns: Sequence[str] = (), sort: str = None, top: int = None,
+          filters: Sequence[Filter] = ()) -> Tuple[List[str], List[Row]]:
+    """Filter, sort ('-Col' for descending), cut to top N and pick columns.
+
+    Column names match case-insensitively. Returns (columns, rows).
+    """
+    names = _column_names(rows)
+    lookup = {name.lower(): name for name in names}
+
+    def resolve(column: str) -> str:
+        try:
+            return lookup[column.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown column {column!r}; available: {', '.join(names) or 'none'}")
+
+    for column, op, value in filters:
+        key = resolve(column)
+        rows = [row for row in rows if _matches(row.get(key), op, value)]
+
+    if sort:
+        descending = sort.startswith('-')
+        key = resolve(sort.lstrip('-+'))
+        # Missing values last either way; numbers compare as numbers
+        present = [row for row in rows if row.get(key) is not None]
+        missing = [row for row in rows if row.get(key) is None]
+        rows = sorted(present, key=lambda row: _sort_key(row[key]), reverse=descending) + missing
+
+    if top is not None:
+        rows = rows[:max(0, top)]
+
+    return ([resolve(column) for column in columns] if columns else names), rows
+
+def render_table(columns: Sequence[str], rows: List[Row]) -> str:
+    """Aligned plain-text table: no borders, two spaces between columns"""
+    if not rows:
+        return "(no results)"
+    cells = [[_cell(row.get(column)) for column in columns] for row in rows]
+    widths = [max(len(column), *(len(line[i]) for line in cells)) for i, column in enumerate(columns)]
+    # Right-align columns that only hold numbers
+    numeric = [all(_is_number(row.get(column)) for row in rows if row.get(column) is not None)
+               for column in columns]
+
+    def line(values):
+        return "  ".join(
+            value.rjust(width) if right else value.ljust(width)
+            for value, width, right in zip(values, widths, numeric)
+        ).rstrip()
+
+    header = line(columns)
+    return "\n".join([header, line(['-' * width for width in widths])] + [line(values) for values in cells])
+
+def _column_names(rows: List[Row]) -> List[str]:
+    names = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name, None)
+    return list(names)
+
+def _matches(value: Any, op: str, expected: str) -> bool:
+    if op == '~':
+        return expected.lower() in _text(value).lower()
+    left, right = _number(value), _number(expected)
+    if left is None or right is None:
+        # Compare as text unless both sides are numbers
+        left, right = _text(value).lower(), expected.lower()
+    return COMPARISONS[op](left, right)
+
+def _sort_key(value: Any) -> Tuple[int, Any]:
+    number = _number(value)
+    return (0, number) if number is not None else (1, _text(value).lower())
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _number(value: Any) -> Optional[float]:
+    if _is_number(value):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
+
+def _text(value: Any) -> str:
+    """Readable form of a JSON value"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip('0').rstrip('.')
+    if isinstance(value, str):
+        match = JSON_DATE.match(value)
+        if match:
+            return datetime.fromtimestamp(int(match.group(1)) / 1000, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        return value
+    if isinstance(value, list):
+        return ", ".join(_text(item) for item in value)
+    if isinstance(value, dict):
+        # Nested objects: their name if they have one, else compact JSON
+        for key in ('Name', 'DisplayName', 'Id'):
+            if key in value:
+                return _text(value[key])
+        return json.dumps(value, separators=(',', ':'))
+    return str(value)
+
+def _cell(value: Any) -> str:
+    text = " ".join(_text(value).split())
+    return text if len(text) <= CELL_WIDTH else text[:CELL_WIDTH - 1] + "…"
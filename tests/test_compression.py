@@ -0,0 +1,55 @@
+import base64
+import gzip
+
+from compression import LINE_BYTES, GzipDecoder, OutputSizes, build_compressed_command
+
+def wire(data: bytes) -> bytes:
+    """What the remote wrapper prints: the gzip stream as base64 lines"""
+    packed = gzip.compress(data)
+    return b"".join(base64.b64encode(packed[i:i + LINE_BYTES]) + b"\r\n" for i in range(0, len(packed), LINE_BYTES))
+
+def decode(stream: bytes, chunk: int) -> bytes:
+    decoder = GzipDecoder()
+    out = b"".join(decoder.feed(stream[i:i + chunk]) for i in range(0, len(stream), chunk))
+    return out + decoder.finish()
+
+def test_round_trip_in_uneven_chunks():
+    data = b"".join(b"2024-03-01 service %d entered the running state\r\n" % i for i in range(5000))
+    for chunk in (1, 7, 4096, 1 << 20):
+        assert decode(wire(data), chunk) == data
+
+def test_counts_wire_and_output_bytes():
+    data = b"x" * 100000
+    stream = wire(data)
+    decoder = GzipDecoder()
+    decoder.feed(stream)
+    decoder.finish()
+    assert (decoder.wire_bytes, decoder.output_bytes) == (len(stream), len(data))
+
+def test_plain_output_is_passed_through():
+    # e.g. the wrapper failed before it could compress anything
+    text = b"powershell.exe : The term 'x' is not recognized\r\n"
+    decoder = GzipDecoder()
+    assert decoder.feed(text) + decoder.finish() == text
+    assert decoder.raw
+
+def test_empty_output():
+    assert decode(wire(b""), 10) == b""
+
+def test_wrapper_quotes_the_command_and_refuses_long_ones():
+    script = build_compressed_command("echo it's")
+    assert "$arguments = '/c ' + 'echo it''s'" in script
+    assert build_compressed_command("echo " + "x" * 8000) is None
+
+def test_output_sizes_decide_auto_compression(monkeypatch):
+    from config import config
+    monkeypatch.setattr(config, 'WINRM_COMPRESS', 'auto')
+    monkeypatch.setattr(config, 'WINRM_COMPRESS_THRESHOLD', 1000)
+    sizes = OutputSizes('type,get-*')
+    assert sizes.should_compress('h:5985', 'TYPE big.log', False)
+    assert sizes.should_compress('h:5985', 'Get-WinEvent System', True)
+    assert not sizes.should_compress('h:5985', 'hostname', False)
+    sizes.record('h:5985', 'hostname', False, 5000)
+    assert sizes.should_compress('h:5985', '  HOSTNAME ', False)
+    sizes.record('h:5985', 'type big.log', False, 10)
+    assert not sizes.should_compress('h:5985', 'type big.log', False)
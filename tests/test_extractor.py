@@ -0,0 +1,53 @@
+from extractor import extractor
+
+def test_labeled_record_beats_bare_triplets():
+    text = "admin 10.0.0.9 secret\nIP: 10.0.0.5 User: Administrator Pass: Winter2024#"
+    assert extractor.extract(text) == {'host': '10.0.0.5', 'username': 'Administrator', 'password': 'Winter2024#'}
+
+def test_following_beats_surrounding():
+    candidates = extractor.extract_candidates("root 1.2.3.4 admin hunter2")
+    assert candidates[0] == {'host': '1.2.3.4', 'username': 'admin', 'password': 'hunter2'}
+    assert {'host': '1.2.3.4', 'username': 'root', 'password': 'admin'} in candidates
+
+def test_two_word_label_and_reordered_fields():
+    text = "Password: Qwerty-123\nIP Address: 172.16.4.20:5985\nUsername: svc_backup"
+    assert extractor.extract(text) == {'host': '172.16.4.20:5985', 'username': 'svc_backup', 'password': 'Qwerty-123'}
+
+def test_value_that_looks_like_a_label():
+    assert extractor.extract("IP: 10.1.1.1 User: admin Pass: pass") == {
+        'host': '10.1.1.1', 'username': 'admin', 'password': 'pass'}
+
+def test_repeated_label_starts_the_record_over():
+    text = "IP: 10.0.0.1 IP: 10.0.0.2 User: a Pass: b"
+    assert extractor.extract(text)['host'] == '10.0.0.2'
+
+def test_separators_and_full_width_colons():
+    assert extractor.extract("198.51.100.9 — administrator — Pa-ss-123") == {
+        'host': '198.51.100.9', 'username': 'administrator', 'password': 'Pa-ss-123'}
+    assert extractor.extract("地址：45.77.12.9 用户名：administrator 密码：Zx9$kLm2")['host'] == '45.77.12.9'
+
+def test_no_credentials():
+    assert extractor.extract("ping 8.8.8.8") is None
+    assert extractor.parse_message("no address here at all") == ([], None)
+
+def test_provider_mail_network_settings_are_not_servers():
+    mail = ("Your VPS is ready.\nIP Address: 203.0.113.10\nUsername: Administrator\nPassword: S3cret!pw\n"
+            "Netmask 255.255.255.0\nGateway 203.0.113.1\nDNS 8.8.8.8 8.8.4.4\nThanks, Support")
+    assert extractor.parse_message(mail) == (
+        [], {'host': '203.0.113.10', 'username': 'Administrator', 'password': 'S3cret!pw'})
+
+def test_gateway_chatter_after_labeled_record_is_one_login():
+    found, credentials = extractor.parse_message("IP: 10.0.0.5 User: admin Pass: pw\nGateway 192.168.1.254 is fine")
+    assert found == []
+    assert credentials['host'] == '10.0.0.5'
+
+def test_dumps_with_several_servers():
+    found, credentials = extractor.parse_message("1.2.3.4 admin pw1\n5.6.7.8 root pw2\n1.2.3.4 admin pw1")
+    assert credentials is None
+    assert [c['host'] for c in found] == ['1.2.3.4', '5.6.7.8']
+    found, _ = extractor.parse_message("IP: 1.2.3.4 User: a Pass: b\nIP: 5.6.7.8\nUser: c\nPass: d")
+    assert [c['host'] for c in found] == ['1.2.3.4', '5.6.7.8']
+
+def test_extract_all_reads_lazily_from_an_iterator():
+    lines = iter(["10.0.0.1 admin a1", "junk line", "admin 10.0.0.2 b2"])
+    assert [c['host'] for c in extractor.extract_all(lines)] == ['10.0.0.1', '10.0.0.2']
@@ -0,0 +1,93 @@
+import pytest
+from winrm.exceptions import InvalidCredentialsError
+
+import health
+from health import AUTH, CLOSED, CONNECT, HALF_OPEN, OPEN, HostDown, HostHealth, classify
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(health.time, 'time', clock)
+    return clock
+
+@pytest.fixture
+def registry():
+    return HostHealth(threshold=3, backoff=30, max_backoff=100, auth_ttl=60)
+
+def state(registry, host='10.0.0.1'):
+    entry = registry.hosts.get(host)
+    return entry.state if entry else CLOSED
+
+def test_classify():
+    assert classify(None) is None
+    assert classify(ConnectionRefusedError()) == CONNECT
+    assert classify(InvalidCredentialsError("401")) == AUTH
+    assert classify(ValueError("bad output")) is None
+
+def test_opens_after_threshold_failures_in_a_row(clock, registry):
+    for _ in range(2):
+        registry.record_failure('10.0.0.1:5985', "refused")
+    assert state(registry) == CLOSED
+    assert registry.check('10.0.0.1') is None
+    registry.record_failure('10.0.0.1:5986', "refused")
+    assert state(registry) == OPEN
+    with pytest.raises(HostDown, match="3 failed attempts"):
+        registry.guard('10.0.0.1')
+
+def test_success_resets_the_count(clock, registry):
+    registry.record_failure('10.0.0.1', "refused")
+    registry.record_failure('10.0.0.1', "refused")
+    registry.record_success('10.0.0.1')
+    registry.record_failure('10.0.0.1', "refused")
+    assert state(registry) == CLOSED
+
+def test_half_open_lets_exactly_one_probe_through(clock, registry):
+    for _ in range(3):
+        registry.record_failure('10.0.0.1', "refused")
+    clock.now += 30
+    assert registry.check('10.0.0.1') is None
+    assert state(registry) == HALF_OPEN
+    assert registry.check('10.0.0.1') is not None
+
+def test_failed_probe_doubles_the_backoff_up_to_the_maximum(clock, registry):
+    for _ in range(3):
+        registry.record_failure('10.0.0.1', "refused")
+    for expected in (60, 100, 100):
+        clock.now += registry.hosts['10.0.0.1'].backoff
+        assert registry.check('10.0.0.1') is None
+        registry.record_failure('10.0.0.1', "refused")
+        assert state(registry) == OPEN
+        assert registry.hosts['10.0.0.1'].backoff == expected
+
+def test_successful_probe_closes_the_circuit(clock, registry):
+    for _ in range(3):
+        registry.record_failure('10.0.0.1', "refused")
+    clock.now += 30
+    registry.check('10.0.0.1')
+    registry.record_error('10.0.0.1', None)
+    assert state(registry) == CLOSED
+    assert registry.stats()['open'] == 0
+
+def test_stuck_probe_frees_its_slot(clock, registry):
+    for _ in range(3):
+        registry.record_failure('10.0.0.1', "refused")
+    clock.now += 30
+    registry.check('10.0.0.1')
+    clock.now += registry.probe_timeout + 1
+    assert registry.check('10.0.0.1') is None
+
+def test_rejected_login_is_remembered_per_password_not_per_host(clock, registry):
+    registry.record_error('10.0.0.1', InvalidCredentialsError("401"), 'Admin', 'wrong')
+    # A rejected login means the host is up
+    assert state(registry) == CLOSED
+    assert "Login rejected" in registry.rejected_login('10.0.0.1:5985', 'admin', 'wrong')
+    assert registry.rejected_login('10.0.0.1', 'admin', 'right') is None
+    clock.now += 61
+    assert registry.rejected_login('10.0.0.1', 'admin', 'wrong') is None
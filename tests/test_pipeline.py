@@ -0,0 +1,87 @@
+import pytest
+
+from pipeline import OutputFilter, Stage, parse_pipeline, plan_pipeline, prepare_pipeline
+
+def run_filter(stages, data: bytes, chunk: int = 3) -> str:
+    """Feed data in small chunks, as a command's output arrives"""
+    output_filter = OutputFilter(stages)
+    out = "".join(output_filter.feed(data[i:i + chunk]) for i in range(0, len(data), chunk))
+    return out + output_filter.finish()
+
+def test_parse_splits_trailing_operators():
+    command, stages = parse_pipeline("type C:\\app.log | grep error | tail 5")
+    assert command == "type C:\\app.log"
+    assert [str(stage) for stage in stages] == ["grep error", "tail 5"]
+
+def test_parse_ignores_pipe_inside_quotes():
+    command, stages = parse_pipeline('findstr "a|head" C:\\x.txt | head 3')
+    assert command == 'findstr "a|head" C:\\x.txt'
+    assert [str(stage) for stage in stages] == ["head 3"]
+
+def test_parse_leaves_other_pipes_to_the_server():
+    command, stages = parse_pipeline("Get-Process | Sort-Object CPU")
+    assert command == "Get-Process | Sort-Object CPU"
+    assert stages == []
+
+def test_parse_stops_at_first_unknown_stage_from_the_end():
+    command, stages = parse_pipeline("dir | sort | head 2")
+    assert command == "dir | sort"
+    assert [stage.op for stage in stages] == ["head"]
+
+def test_grep_flags_combined_and_quoted_text():
+    _, [stage] = parse_pipeline("tasklist | grep -vi 'svc host'")
+    assert (stage.invert, stage.ignore_case, stage.text) == (True, True, "svc host")
+
+def test_grep_separate_flags():
+    _, [stage] = parse_pipeline("tasklist | grep -v -i svchost")
+    assert (stage.invert, stage.ignore_case, stage.text) == (True, True, "svchost")
+
+@pytest.mark.parametrize("command", ["dir | head 0", "dir | tail x", "dir | count 3", "dir | grep", "dir | grep -v"])
+def test_bad_operator_arguments(command):
+    with pytest.raises(ValueError):
+        parse_pipeline(command)
+
+def test_plan_cmd_moves_grep_and_count_remote():
+    remote, local = plan_pipeline("tasklist", [Stage('grep', text='svc', ignore_case=True), Stage('count')])
+    assert remote == 'tasklist | findstr /L /I /C:"svc" | find /C /V ""'
+    assert local == []
+
+def test_plan_cmd_keeps_everything_after_head_local():
+    stages = [Stage('head', lines=5), Stage('count')]
+    remote, local = plan_pipeline("tasklist", stages)
+    assert remote == "tasklist"
+    assert local == stages
+
+def test_plan_cmd_unsafe_grep_text_stays_local():
+    stages = [Stage('grep', text='50%'), Stage('count')]
+    remote, local = plan_pipeline("tasklist", stages)
+    assert remote == "tasklist"
+    assert local == stages
+
+def test_plan_cmd_unsafe_command_stays_local():
+    stages = [Stage('grep', text='a')]
+    remote, local = plan_pipeline("dir & dir", stages)
+    assert remote == "dir & dir"
+    assert local == stages
+
+def test_plan_powershell_runs_everything_remote():
+    stages = [Stage('grep', text="it's", invert=True), Stage('head', lines=2)]
+    remote, local = plan_pipeline("Get-Service", stages, powershell=True)
+    assert local == []
+    assert "Select-String -SimpleMatch -NotMatch -CaseSensitive -Pattern 'it''s'" in remote
+    assert remote.endswith("Select-Object -First 2")
+
+def test_head_then_count_differs_from_count_then_head():
+    data = b"".join(b"line %d\r\n" % i for i in range(20))
+    assert run_filter([Stage('head', lines=5), Stage('count')], data) == "5\n"
+    assert run_filter([Stage('count'), Stage('head', lines=5)], data) == "20\n"
+
+def test_filter_handles_lines_split_across_chunks_and_no_final_newline():
+    data = "alpha\nbéta\ngamma".encode('utf-8')
+    assert run_filter([Stage('grep', text='a')], data, chunk=1) == "alpha\nbéta\ngamma\n"
+    assert run_filter([Stage('tail', lines=1)], data, chunk=2) == "gamma\n"
+
+def test_prepare_returns_no_filter_when_all_stages_run_remote():
+    remote, output_filter = prepare_pipeline("tasklist | grep svc")
+    assert remote == 'tasklist | findstr /L /C:"svc"'
+    assert output_filter is None
@@ -0,0 +1,68 @@
+import pytest
+
+from structured import parse_filters, parse_json_output, query, quote_ps, render_table
+
+ROWS = [
+    {'Name': 'svchost', 'CPU': 9.5, 'Id': 100},
+    {'Name': 'System', 'CPU': 120, 'Id': 4},
+    {'Name': 'explorer', 'CPU': None, 'Id': 2200},
+    {'Name': 'sqlservr', 'CPU': '15', 'Id': 3000},
+]
+
+def test_quote_ps_doubles_single_quotes():
+    assert quote_ps("it's") == "'it''s'"
+
+def test_parse_json_output_wraps_single_objects_and_values():
+    assert parse_json_output('{"Name": "a"}') == [{'Name': 'a'}]
+    assert parse_json_output('["a", 1]') == [{'Value': 'a'}, {'Value': 1}]
+    assert parse_json_output('') == []
+    with pytest.raises(ValueError):
+        parse_json_output('Get-Foo : not recognized')
+
+def test_parse_filters():
+    assert parse_filters("CPU>=10, Name~sql") == [('CPU', '>=', '10'), ('Name', '~', 'sql')]
+    with pytest.raises(ValueError):
+        parse_filters("CPU")
+
+def test_sort_is_numeric_not_text():
+    # As text "9.5" > "15" > "120"; as numbers it is the other way round
+    _, rows = query(ROWS, sort='-CPU')
+    assert [row['Name'] for row in rows] == ['System', 'sqlservr', 'svchost', 'explorer']
+
+def test_sort_ascending_keeps_missing_values_last():
+    _, rows = query(ROWS, sort='cpu')
+    assert [row['Name'] for row in rows] == ['svchost', 'sqlservr', 'System', 'explorer']
+
+def test_text_sort_is_case_insensitive():
+    _, rows = query(ROWS, sort='Name')
+    assert [row['Name'] for row in rows] == ['explorer', 'sqlservr', 'svchost', 'System']
+
+def test_numeric_filter_compares_numbers_and_text_filter_compares_text():
+    _, rows = query(ROWS, filters=[('CPU', '>', '10')])
+    assert [row['Name'] for row in rows] == ['System', 'sqlservr']
+    _, rows = query(ROWS, filters=[('name', '=', 'SYSTEM')])
+    assert [row['Name'] for row in rows] == ['System']
+    _, rows = query(ROWS, filters=[('Name', '~', 'SQL')])
+    assert [row['Name'] for row in rows] == ['sqlservr']
+
+def test_top_and_columns_resolve_case_insensitively():
+    columns, rows = query(ROWS, columns=['name', 'id'], sort='-id', top=2)
+    assert columns == ['Name', 'Id']
+    assert [row['Id'] for row in rows] == [3000, 2200]
+
+def test_unknown_column_lists_the_available_ones():
+    with pytest.raises(ValueError, match="available: Name, CPU, Id"):
+        query(ROWS, sort='Memory')
+
+def test_render_table_right_aligns_numbers_and_formats_dates():
+    table = render_table(['Name', 'Id', 'Start'], [
+        {'Name': 'a', 'Id': 5, 'Start': '/Date(0)/'},
+        {'Name': 'bbb', 'Id': 1234, 'Start': None},
+    ])
+    lines = table.splitlines()
+    assert lines[0] == "Name    Id  Start"
+    assert lines[2] == "a        5  1970-01-01 00:00:00"
+    assert lines[3] == "bbb   1234"
+
+def test_render_table_empty():
+    assert render_table(['Name'], []) == "(no results)"
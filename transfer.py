@@ -0,0 +1,321 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, List, Optional
+from config import config
+from executor import winrm_executor
+from metrics import registry
+from structured import quote_ps
+from winrm_client import CancelToken, run_command as run_remote_command
+
+# Directions
+DOWNLOAD = 'download'
+UPLOAD = 'upload'
+
+# Attempts per chunk before the transfer stops (and can be resumed)
+CHUNK_ATTEMPTS = 3
+
+TRANSFER_BYTES = registry.counter(
+    'transfer_bytes_total', "File bytes moved by /download and /upload chunks", ['direction'])
+
+# Called with (bytes done, total bytes) as chunks complete
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+class TransferError(Exception):
+    """A transfer failed; its state is kept if it can be resumed"""
+
+@dataclass
+class TransferState:
+    """Progress of one file transfer, saved next to its local data for resuming"""
+    id: str
+    direction: str
+    remote_path: str
+    size: int
+    sha256: str
+    chunk_size: int
+    # Identifies the source version: remote mtime ticks or Telegram file_unique_id
+    stamp: str = ""
+    done: List[int] = field(default_factory=list)
+    updated_at: float = 0.0
+
+    @property
+    def chunks(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def bytes_done(self) -> int:
+        return sum(min(self.chunk_size, self.size - index * self.chunk_size) for index in self.done)
+
+    @property
+    def data_path(self) -> str:
+        """Local file: the download being assembled, or the upload's source"""
+        return os.path.join(config.TRANSFER_DIR, f"{self.id}.part")
+
+    @property
+    def remote_part(self) -> str:
+        """Remote file an upload is written to before it replaces remote_path"""
+        return f"{self.remote_path}.part"
+
+    def save(self):
+        self.updated_at = time.time()
+        path = os.path.join(config.TRANSFER_DIR, f"{self.id}.json")
+        with open(path + ".tmp", 'w') as f:
+            json.dump(asdict(self), f)
+        os.replace(path + ".tmp", path)
+
+    def discard(self):
+        for path in (self.data_path, os.path.join(config.TRANSFER_DIR, f"{self.id}.json")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def load(cls, transfer_id: str) -> Optional['TransferState']:
+        try:
+            with open(os.path.join(config.TRANSFER_DIR, f"{transfer_id}.json")) as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+class TransferManager:
+    """Move files between Telegram and WinRM hosts in base64 chunks over several pooled shells"""
+
+    def __init__(self, chunk_size: int = None, parallel: int = None):
+        self.chunk_size = chunk_size or config.TRANSFER_CHUNK_BYTES
+        self.parallel = parallel or config.TRANSFER_PARALLEL
+        # Transfer IDs in progress, so the same one can't run twice at once
+        self.active = set()
+
+    def transfer_id(self, direction: str, user_id: int, session, remote_path: str) -> str:
+        key = f"{direction}\0{user_id}\0{session.address.lower()}\0{session.username.lower()}\0{remote_path.lower()}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+
+    async def download(self, user_id: int, session, remote_path: str,
+                       progress: ProgressCallback = None) -> TransferState:
+        """Copy a remote file into TRANSFER_DIR; returns its state, whose data_path holds the file.
+
+        Chunks already fetched for the same unchanged file are kept from an
+        interrupted attempt. Raises TransferError.
+        """
+        transfer_id = self.transfer_id(DOWNLOAD, user_id, session, remote_path)
+        async with self._running(transfer_id):
+            size, stamp, sha256 = await self._call(session, remote_stat, remote_path, config.TRANSFER_MAX_BYTES)
+            if size > config.TRANSFER_MAX_BYTES:
+                raise TransferError(f"{remote_path} is {size:,} bytes; the limit is {config.TRANSFER_MAX_BYTES:,}")
+
+            state = TransferState.load(transfer_id)
+            if state is None or (state.size, state.stamp, state.sha256) != (size, stamp, sha256) \
+                    or not os.path.exists(state.data_path):
+                if state is not None:
+                    state.discard()
+                state = TransferState(transfer_id, DOWNLOAD, remote_path, size, sha256, self.chunk_size, stamp)
+                open(state.data_path, 'wb').close()
+                state.save()
+
+            await self._run_chunks(session, state, read_chunk, progress)
+            local = await asyncio.get_running_loop().run_in_executor(None, sha256_file, state.data_path)
+            if local != state.sha256:
+                state.discard()
+                raise TransferError(f"SHA-256 mismatch (remote {state.sha256[:12]}…, got {local[:12]}…); "
+                                    "the file changed during the download")
+        return state
+
+    async def upload(self, user_id: int, session, remote_path: str, file_id: str,
+                     fetch: Callable[[str], Awaitable[None]], progress: ProgressCallback = None) -> TransferState:
+        """Copy a Telegram file to remote_path, via remote_path.part; returns the finished state.
+
+        fetch(path) downloads the Telegram file to a local path. Chunks that
+        reached the server in an interrupted attempt with the same file are
+        skipped. Raises TransferError.
+        """
+        transfer_id = self.transfer_id(UPLOAD, user_id, session, remote_path)
+        async with self._running(transfer_id):
+            state = TransferState.load(transfer_id)
+            if state is None or state.stamp != file_id or not os.path.exists(state.data_path):
+                if state is not None:
+                    state.discard()
+                state = TransferState(transfer_id, UPLOAD, remote_path, 0, "", self.chunk_size, file_id)
+                await fetch(state.data_path)
+                state.size = os.path.getsize(state.data_path)
+                state.sha256 = await asyncio.get_running_loop().run_in_executor(None, sha256_file, state.data_path)
+                state.save()
+
+            await self._run_chunks(session, state, write_chunk, progress)
+            remote = await self._call(session, finish_upload, state)
+            if remote != state.sha256:
+                state.discard()
+                raise TransferError(f"SHA-256 mismatch (sent {state.sha256[:12]}…, server has {remote[:12]}…); "
+                                    "the upload was discarded")
+        state.discard()
+        return state
+
+    async def _run_chunks(self, session, state: TransferState, work: Callable, progress: ProgressCallback = None):
+        """Run work(..., state, index) for every chunk not done yet, `parallel` at a time"""
+        done = set(state.done)
+        pending = [index for index in range(state.chunks) if index not in done]
+        pending.reverse()
+        failure: List[BaseException] = []
+
+        async def worker():
+            while pending and not failure:
+                index = pending.pop()
+                for attempt in range(1, CHUNK_ATTEMPTS + 1):
+                    try:
+                        await self._call(session, work, state, index)
+                        break
+                    except Exception as e:
+                        if attempt == CHUNK_ATTEMPTS:
+                            failure.append(e)
+                            return
+                state.done.append(index)
+                state.save()
+                TRANSFER_BYTES.inc(min(state.chunk_size, state.size - index * state.chunk_size),
+                                   direction=state.direction)
+                if progress:
+                    await progress(state.bytes_done, state.size)
+
+        # Each worker borrows its own pooled client, i.e. its own remote shell
+        await asyncio.gather(*(worker() for _ in range(min(self.parallel, len(pending)) or 1)))
+        if failure:
+            raise TransferError(f"{failure[0]} ({len(state.done)}/{state.chunks} chunks done; "
+                                "send the same command again to resume)")
+
+    async def _call(self, session, func: Callable, *args):
+        # Transfers have their own parallelism limit, so they skip the per-user one
+        return await winrm_executor.run(
+            None, session.host, func,
+            session.host, session.username, session.password, session.port, *args
+        )
+
+    @asynccontextmanager
+    async def _running(self, transfer_id: str):
+        if transfer_id in self.active:
+            raise TransferError("This transfer is already running")
+        os.makedirs(config.TRANSFER_DIR, exist_ok=True)
+        self.active.add(transfer_id)
+        try:
+            yield
+        finally:
+            self.active.discard(transfer_id)
+
+    def prune(self) -> int:
+        """Delete saved transfers not touched within TRANSFER_RESUME_TTL; returns how many"""
+        if not os.path.isdir(config.TRANSFER_DIR):
+            return 0
+        cutoff = time.time() - config.TRANSFER_RESUME_TTL
+        pruned = 0
+        for name in os.listdir(config.TRANSFER_DIR):
+            path = os.path.join(config.TRANSFER_DIR, name)
+            if name.split('.')[0] not in self.active and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                pruned += 1
+        return pruned
+
+def remote_stat(host: str, username: str, password: str, port: int, remote_path: str, max_bytes: int = None):
+    """(size, mtime ticks, SHA-256) of a remote file; the hash covers exactly `size` bytes.
+
+    Files over max_bytes aren't read at all; their SHA-256 comes back as None.
+    """
+    limit = -1 if max_bytes is None else max_bytes
+    stdout = _run(host, username, password, port, _script(remote_path) + f"$limit = {limit}\n" + (
+        "$item = Get-Item -LiteralPath $path -Force\n"
+        "if ($item.PSIsContainer) { throw \"$path is a directory\" }\n"
+        "$length = $item.Length\n"
+        "if ($limit -ge 0 -and $length -gt $limit) { '{0} {1} -' -f $length, $item.LastWriteTimeUtc.Ticks; return }\n"
+        "$file = [IO.File]::Open($path, 'Open', 'Read', 'ReadWrite, Delete')\n"
+        "try {\n"
+        "  $sha = [Security.Cryptography.SHA256]::Create(); $buffer = New-Object byte[] 1048576; $left = $length\n"
+        "  while ($left -gt 0) {\n"
+        "    $read = $file.Read($buffer, 0, [Math]::Min($buffer.Length, $left)); if ($read -le 0) { break }\n"
+        "    [void]$sha.TransformBlock($buffer, 0, $read, $null, 0); $left -= $read\n"
+        "  }\n"
+        "  [void]$sha.TransformFinalBlock($buffer, 0, 0)\n"
+        "} finally { $file.Close() }\n"
+        "'{0} {1} {2}' -f $length, $item.LastWriteTimeUtc.Ticks, ([BitConverter]::ToString($sha.Hash) -replace '-', '')"
+    ))
+    try:
+        size, stamp, sha256 = stdout.split()
+        return int(size), stamp, None if sha256 == '-' else sha256.lower()
+    except ValueError:
+        raise TransferError(f"Unexpected reply from the server: {stdout[:200]!r}")
+
+def read_chunk(host: str, username: str, password: str, port: int, state: TransferState, index: int):
+    """Fetch one chunk of a download into its place in the local file"""
+    offset = index * state.chunk_size
+    length = min(state.chunk_size, state.size - offset)
+    stdout = _run(host, username, password, port, _script(state.remote_path, offset, length) + (
+        "$file = [IO.File]::Open($path, 'Open', 'Read', 'ReadWrite, Delete')\n"
+        "try {\n"
+        "  [void]$file.Seek($offset, 'Begin'); $buffer = New-Object byte[] $length; $read = 0\n"
+        "  while ($read -lt $length) { $n = $file.Read($buffer, $read, $length - $read); if ($n -le 0) { break }; $read += $n }\n"
+        "} finally { $file.Close() }\n"
+        "[Convert]::ToBase64String($buffer, 0, $read)"
+    ))
+    data = base64.b64decode(stdout.strip())
+    if len(data) != length:
+        raise TransferError(f"Chunk {index} came back with {len(data)} of {length} bytes")
+    with open(state.data_path, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+
+def write_chunk(host: str, username: str, password: str, port: int, state: TransferState, index: int):
+    """Send one chunk of an upload through stdin into its place in the remote .part file"""
+    offset = index * state.chunk_size
+    with open(state.data_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(state.chunk_size)
+    stdout = _run(host, username, password, port, _script(state.remote_part, offset, len(data)) + (
+        "$buffer = [Convert]::FromBase64String([Console]::In.ReadToEnd())\n"
+        "$file = [IO.File]::Open($path, 'OpenOrCreate', 'Write', 'ReadWrite')\n"
+        "try { [void]$file.Seek($offset, 'Begin'); $file.Write($buffer, 0, $buffer.Length) } finally { $file.Close() }\n"
+        "$buffer.Length"
+    ), stdin=base64.b64encode(data))
+    if stdout.strip() != str(len(data)):
+        raise TransferError(f"Chunk {index} was not written: {stdout.strip()[:200]!r}")
+
+def finish_upload(host: str, username: str, password: str, port: int, state: TransferState) -> str:
+    """Trim the remote .part file, hash it and, if it matches, move it into place; returns its SHA-256"""
+    stdout = _run(host, username, password, port, _script(state.remote_part, 0, state.size) + (
+        "$file = [IO.File]::Open($path, 'OpenOrCreate', 'ReadWrite', 'None')\n"
+        "try {\n"
+        "  $file.SetLength($length)\n"
+        "  $hash = ([BitConverter]::ToString([Security.Cryptography.SHA256]::Create().ComputeHash($file)) -replace '-', '')\n"
+        "} finally { $file.Close() }\n"
+        f"if ($hash -eq {quote_ps(state.sha256.upper())}) {{ Move-Item -LiteralPath $path -Destination "
+        f"{quote_ps(state.remote_path)} -Force }}\n"
+        "$hash"
+    ))
+    return stdout.strip().lower()
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _script(path: str, offset: int = 0, length: int = 0) -> str:
+    return (
+        "$ProgressPreference = 'SilentlyContinue'; $ErrorActionPreference = 'Stop'\n"
+        f"$path = {quote_ps(path)}\n"
+        f"$offset = {offset}\n"
+        f"$length = {length}\n"
+    )
+
+def _run(host: str, username: str, password: str, port: int, script: str, stdin: bytes = None) -> str:
+    stdout, stderr, exit_code = run_remote_command(
+        host, username, password, port, script, powershell=True,
+        token=CancelToken(config.WINRM_COMMAND_TIMEOUT), stdin=stdin
+    )
+    if exit_code != 0:
+        raise TransferError((stderr or stdout).strip()[:300] or f"exit code {exit_code}")
+    return stdout
+
+# Global transfer manager
+transfer_manager = TransferManager()
@@ -1,5 +1,6 @@
 import re
-from typing import Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from config import config
 
 def truncate_text(text: str, max_length: int = 4000) -> str:
     """Truncate text to maximum length with ellipsis if needed"""
@@ -7,6 +8,20 @@ def truncate_text(text: str, max_length: int = 4000) -> str:
         return text
     return text[:max_length-3] + "..."
 
+def split_text(text: str, max_length: int) -> List[str]:
+    """Split text into chunks of at most max_length, preferring line boundaries"""
+    chunks = []
+    while len(text) > max_length:
+        cut = text.rfind('\n', 0, max_length)
+        if cut <= 0:
+            cut = max_length
+        chunks.append(text[:cut])
+        # Drop the newline we split on
+        text = text[cut + 1:] if text[cut] == '\n' else text[cut:]
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
 def redact_password(text: str, password: str) -> str:
     """Redact password from text for logging"""
     if not password:
@@ -34,6 +49,38 @@ def validate_host(host: str) -> Optional[str]:
     
     return None
 
+def split_host_port(host: str, port: Optional[int] = None) -> Tuple[str, int]:
+    """Split 'ip:port' into (ip, port), falling back to the configured WinRM port"""
+    if port is None and ':' in host:
+        host, port_str = host.split(':', 1)
+        port = int(port_str)
+    return host, port or config.WINRM_PORT
+
+def parse_flags(args: Sequence[str], spec: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Pop leading --flags off a command's arguments.
+
+    spec maps a flag name to bool for switches, or to a type such as int for
+    flags that take a value. Raises ValueError on a missing or bad value.
+    """
+    options = {}
+    rest = list(args)
+    while rest and rest[0].startswith('--') and rest[0][2:].lower() in spec:
+        name = rest.pop(0)[2:].lower()
+        kind = spec[name]
+        if kind is bool:
+            options[name] = True
+            continue
+        if not rest:
+            raise ValueError(f"--{name} needs a value")
+        options[name] = kind(rest.pop(0))
+    return options, rest
+
+def split_powershell(command: str) -> Tuple[str, bool]:
+    """Strip a leading 'powershell' keyword; returns (command, is_powershell)"""
+    if command.lower().startswith('powershell'):
+        return command[10:].strip(), True
+    return command, False
+
 def format_command_output(stdout: str, stderr: str, exit_code: int) -> str:
     """Format command output for Telegram message"""
     output_parts = []
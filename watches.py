@@ -0,0 +1,249 @@
+import difflib
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from config import config
+from executor import winrm_executor
+from metrics import registry
+from pipeline import prepare_pipeline
+from utils import truncate_text
+from winrm_client import CancelToken, CommandCancelled, run_command as run_remote_command
+
+# Interval suffixes accepted by /watch
+UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+@dataclass
+class Watch:
+    """A command re-run every `interval` seconds whose output is compared with the last run"""
+    id: int
+    user_id: int
+    chat_id: int
+    address: str
+    command: str
+    powershell: bool
+    interval: float
+    created_at: float
+    # Alert when whether this regex matches the output changes, instead of sending diffs
+    match: Optional[str] = None
+    runs: int = 0
+    changes: int = 0
+    last_run: Optional[float] = None
+    lines: Optional[List[str]] = None
+    exit_code: Optional[int] = None
+    matched: Optional[bool] = None
+    error: Optional[str] = None
+    stopped: bool = False
+    session: Any = field(default=None, repr=False)
+    notify: Optional[Callable[['Watch', str], Awaitable[None]]] = field(default=None, repr=False)
+    job_queue: Any = field(default=None, repr=False)
+    job: Any = field(default=None, repr=False)
+    token: Optional[CancelToken] = field(default=None, repr=False)
+
+def parse_interval(text: str) -> float:
+    """Seconds from '90', '90s', '5m' or '1h'; raises ValueError"""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smh]?)', text.strip().lower())
+    if not match:
+        raise ValueError(f"Bad interval {text!r}; use e.g. 30s, 5m or 1h")
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+def format_interval(seconds: float) -> str:
+    for unit in ('h', 'm'):
+        if seconds >= UNITS[unit] and seconds % UNITS[unit] == 0:
+            return f"{int(seconds // UNITS[unit])}{unit}"
+    return f"{seconds:g}s"
+
+def line_diff(old: List[str], new: List[str], limit: int) -> Tuple[List[str], int, int]:
+    """Changed lines as '+ line' / '- line' (at most `limit`), plus added and removed counts"""
+    changed = [line for line in difflib.unified_diff(old, new, n=0, lineterm='')
+               if line[:1] in '+-' and not line.startswith(('+++', '---'))]
+    added = sum(line[0] == '+' for line in changed)
+    shown = [f"{line[0]} {truncate_text(line[1:], 200)}" for line in changed[:limit]]
+    if len(changed) > limit:
+        shown.append(f"… {len(changed) - limit} more changed lines")
+    return shown, added, len(changed) - added
+
+class WatchManager:
+    """Re-run users' commands on the Application job queue and report only what changed"""
+
+    def __init__(self, max_per_user: int = None, jitter: float = None):
+        self.max_per_user = max_per_user or config.WATCH_MAX_PER_USER
+        self.jitter = config.WATCH_JITTER if jitter is None else jitter
+        self.watches: Dict[int, Dict[int, Watch]] = {}
+        self._last_ids: Dict[int, int] = {}
+        self.runs = 0
+
+    def start(self, job_queue, user_id: int, chat_id: int, session, command: str, powershell: bool,
+              interval: float, notify: Callable[[Watch, str], Awaitable[None]],
+              match: str = None) -> Tuple[Optional[Watch], str]:
+        """Start watching a command; returns (watch, message) or (None, reason).
+
+        The first run happens straight away and sets the baseline.
+        """
+        if interval < config.WATCH_MIN_INTERVAL:
+            return None, f"The shortest interval is {format_interval(config.WATCH_MIN_INTERVAL)}."
+        watches = self.list_watches(user_id)
+        if len(watches) >= self.max_per_user:
+            return None, f"You already have {len(watches)} watches (limit {self.max_per_user}); see /unwatch."
+
+        watch_id = self._last_ids[user_id] = self._last_ids.get(user_id, 0) + 1
+        watch = Watch(
+            id=watch_id,
+            user_id=user_id,
+            chat_id=chat_id,
+            address=session.address,
+            command=command,
+            powershell=powershell,
+            interval=interval,
+            created_at=time.time(),
+            match=match,
+            session=session,
+            notify=notify,
+            job_queue=job_queue,
+        )
+        self.watches.setdefault(user_id, {})[watch.id] = watch
+        self._schedule(watch, 0)
+        return watch, f"Watch #{watch.id} started"
+
+    def list_watches(self, user_id: int) -> List[Watch]:
+        """Return the user's watches, oldest first"""
+        return sorted(self.watches.get(user_id, {}).values(), key=lambda watch: watch.id)
+
+    def stop(self, user_id: int, watch_id: int = None, reason: str = None) -> int:
+        """Stop one watch, or all of the user's; returns how many were stopped.
+
+        With a reason, the user is told each watch stopped (used when the
+        session ends rather than on /unwatch).
+        """
+        watches = self.watches.get(user_id, {})
+        ids = [watch_id] if watch_id is not None else list(watches)
+        stopped = 0
+        for watch in [watches.pop(i, None) for i in ids]:
+            if watch is None:
+                continue
+            watch.stopped = True
+            if watch.job is not None:
+                watch.job.schedule_removal()
+                watch.job = None
+            if watch.token is not None:
+                watch.token.cancel("Watch stopped")
+            if reason and watch.notify and watch.job_queue is not None:
+                watch.job_queue.run_once(self._send_stopped, 0, data=(watch, reason))
+            stopped += 1
+        if not watches:
+            self.watches.pop(user_id, None)
+        return stopped
+
+    def _schedule(self, watch: Watch, delay: float):
+        # Each watch reschedules itself after a run, so runs never overlap
+        watch.job = watch.job_queue.run_once(self._tick, delay, data=watch,
+                                             name=f"watch-{watch.user_id}-{watch.id}")
+
+    def _next_delay(self, watch: Watch) -> float:
+        """The interval, randomly moved by up to WATCH_JITTER of itself so watches spread out"""
+        return watch.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _tick(self, context):
+        watch = context.job.data
+        watch.job = None
+        if watch.stopped:
+            return
+        message = await self._run(watch)
+        if watch.stopped:
+            return
+        self._schedule(watch, self._next_delay(watch))
+        if message and watch.notify:
+            await watch.notify(watch, message)
+
+    async def _run(self, watch: Watch) -> Optional[str]:
+        """Run the command once; returns what to tell the user, if anything"""
+        session = watch.session
+        # A run never outlasts its interval
+        watch.token = CancelToken(watch.interval)
+        try:
+            command, output_filter = prepare_pipeline(watch.command, watch.powershell)
+            # Watches have their own per-user cap; the pooled shell for the
+            # session's server is reused between runs
+            stdout, stderr, exit_code = await winrm_executor.run(
+                None, session.host, run_remote_command,
+                session.host, session.username, session.password, session.port, command,
+                powershell=watch.powershell, token=watch.token, output_filter=output_filter
+            )
+        except CommandCancelled as e:
+            return None if watch.stopped else self._failed(watch, str(e))
+        except Exception as e:
+            return self._failed(watch, str(e) or e.__class__.__name__)
+        finally:
+            watch.token = None
+            watch.runs += 1
+            watch.last_run = time.time()
+            self.runs += 1
+        return self._compare(watch, stdout.splitlines(), stderr, exit_code)
+
+    def _failed(self, watch: Watch, error: str) -> Optional[str]:
+        """Report a failed run only if the last one didn't fail the same way"""
+        previous, watch.error = watch.error, truncate_text(error, 300)
+        if previous == watch.error:
+            return None
+        return f"❌ **Watch #{watch.id}** `{truncate_text(watch.command, 60)}` failed: {watch.error}"
+
+    def _compare(self, watch: Watch, lines: List[str], stderr: str, exit_code: int) -> Optional[str]:
+        """Describe how this run differs from the previous one; None if it doesn't"""
+        header = f"**Watch #{watch.id}** `{truncate_text(watch.command, 60)}`"
+        notes = []
+        if watch.error is not None:
+            notes.append("running again")
+            watch.error = None
+        baseline = watch.lines is None
+        if not baseline and exit_code != watch.exit_code:
+            notes.append(f"exit code {watch.exit_code} → {exit_code}")
+            if stderr.strip():
+                notes.append(truncate_text(stderr.strip().splitlines()[0], 200))
+
+        if watch.match:
+            pattern = re.compile(watch.match)
+            hit = next((line for line in lines if pattern.search(line)), None)
+            matched = hit is not None
+            if not baseline and matched != watch.matched:
+                notes.append(f"`{watch.match}` now matches: `{truncate_text(hit, 200)}`" if matched
+                             else f"`{watch.match}` no longer matches")
+            watch.matched = matched
+            diff = []
+        else:
+            diff, added, removed = ([], 0, 0) if baseline else line_diff(watch.lines, lines, config.WATCH_DIFF_LINES)
+            if diff:
+                notes.append(f"+{added} −{removed} lines")
+
+        watch.lines, watch.exit_code = lines, exit_code
+        if baseline:
+            state = f"{len(lines)} lines, exit {exit_code}"
+            if watch.match:
+                state += f", `{watch.match}` {'matches' if watch.matched else 'does not match'}"
+            return (f"👁 {header} on `{watch.address}` every {format_interval(watch.interval)}\n"
+                    f"Baseline: {state}. You'll only hear about changes; `/unwatch {watch.id}` stops it.")
+        if not notes:
+            return None
+        watch.changes += 1
+        icon = "🚨" if watch.match or exit_code != 0 else "🔁"
+        text = f"{icon} {header}: " + "; ".join(notes)
+        if diff:
+            text += "\n```\n" + "\n".join(diff) + "\n```"
+        return text
+
+    async def _send_stopped(self, context):
+        watch, reason = context.job.data
+        await watch.notify(watch, f"⏹ **Watch #{watch.id}** `{truncate_text(watch.command, 60)}` stopped: {reason}.")
+
+    def stats(self) -> Dict[str, int]:
+        """Return active watch and run counts"""
+        return {
+            'active': sum(len(watches) for watches in self.watches.values()),
+            'runs': self.runs,
+        }
+
+# Global watch manager
+watch_manager = WatchManager()
+
+registry.gauge('watches_active', "Commands being re-run by /watch",
+               callback=lambda: watch_manager.stats()['active'])
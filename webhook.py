@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+from typing import List
+from aiohttp import web
+from telegram import Bot, Update
+from config import config
+from session_store import create_stores
+
+logger = logging.getLogger(__name__)
+
+# Update fields that carry the sender, in the order they are checked
+SENDER_FIELDS = ('from', 'user', 'chat')
+
+def route(update: dict, workers: int) -> int:
+    """Worker index for an update: one user always lands on the same worker, which keeps their updates in order"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        for name in SENDER_FIELDS:
+            sender = value.get(name)
+            if isinstance(sender, dict) and isinstance(sender.get('id'), int):
+                return sender['id'] % workers
+    # No sender (e.g. polls): any worker will do
+    return update.get('update_id', 0) % workers
+
+def run_webhook():
+    """Receive updates on a local HTTP front and hand each user's to a fixed worker process"""
+    if not config.WEBHOOK_URL:
+        logger.error("WEBHOOK_URL is required for BOT_MODE=webhook")
+        return
+    try:
+        # Check the store settings once here rather than in every worker
+        for store in create_stores():
+            store.close()
+    except ValueError as e:
+        logger.error("Session store: %s", e)
+        return
+    workers = max(1, config.BOT_WORKERS)
+    if workers > 1 and config.SESSION_BACKEND == 'memory':
+        logger.warning("SESSION_BACKEND=memory: sessions are lost whenever a worker restarts")
+
+    # spawn, so workers don't inherit the front's event loop or sockets
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [None] * workers
+
+    def start_worker(index: int):
+        process = context.Process(target=worker_main, args=(index, workers, queues[index]),
+                                  name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        processes[index] = process
+
+    for index in range(workers):
+        start_worker(index)
+    try:
+        asyncio.run(_serve_front(queues, processes, start_worker))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=15)
+            if process.is_alive():
+                process.terminate()
+
+async def _serve_front(queues: List, processes: List, start_worker):
+    """aiohttp server for Telegram's webhook POSTs; also restarts workers that die"""
+    secret = config.WEBHOOK_SECRET
+
+    async def receive(request: web.Request) -> web.Response:
+        if secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            return web.Response(status=403)
+        body = await request.read()
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        # Only the raw JSON crosses the process boundary; the worker parses it
+        queues[route(update, len(queues))].put(body)
+        return web.Response()
+
+    app = web.Application(client_max_size=config.IMPORT_MAX_BYTES * 2)
+    app.router.add_post(config.WEBHOOK_PATH, receive)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.WEBHOOK_LISTEN, config.WEBHOOK_PORT).start()
+
+    async with Bot(config.BOT_TOKEN, base_url=config.BOT_API_URL or "https://api.telegram.org/bot") as bot:
+        await bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=secret or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    logger.info("Webhook front listening on %s:%d%s with %d workers",
+                config.WEBHOOK_LISTEN, config.WEBHOOK_PORT, config.WEBHOOK_PATH, len(queues))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        while not stop.is_set():
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.warning("Worker %d exited with %s; restarting", index, process.exitcode)
+                    start_worker(index)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await runner.cleanup()
+
+def worker_main(index: int, workers: int, updates):
+    """Entry point of one worker process: the usual handlers, fed from the front's queue"""
+    # Imported here: the worker builds its own globals after spawn
+    import main
+
+    # The front handles Ctrl+C and tells workers to stop through the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if not main.open_stores((index, workers)):
+        return
+    # Each worker has its own registry, so each gets its own port
+    main.start_metrics(index)
+    try:
+        asyncio.run(_serve_worker(main, updates))
+    finally:
+        main.release_resources()
+
+async def _serve_worker(main, updates):
+    application = main.build_application(polling=False)
+    loop = asyncio.get_running_loop()
+    async with application:
+        await application.start()
+        try:
+            while True:
+                # Blocking get on a helper thread keeps the event loop free
+                body = await loop.run_in_executor(None, updates.get)
+                if body is None:
+                    break
+                update = Update.de_json(json.loads(body), application.bot)
+                await application.update_queue.put(update)
+        finally:
+            await application.stop()
+            await main.close_async_clients(application)
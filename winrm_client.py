@@ -1,29 +1,127 @@
+import queue
+import threading
+import time
+from base64 import b64encode
 import winrm
-from typing import Tuple, Optional
+from winrm.exceptions import WinRMError, WinRMTransportError, WinRMOperationTimeoutError
+from typing import Callable, List, Tuple, Optional
 from config import config
+from cache import result_cache
+from compression import GzipDecoder, build_compressed_command, output_sizes
+from metrics import (registry, WINRM_CONNECT_SECONDS, WINRM_COMMAND_SECONDS, WINRM_REQUEST_SECONDS,
+                     WINRM_FAILURES, WINRM_TIMEOUTS, WINRM_CANCELLED)
+from health import AUTH, CONNECT, classify, host_health
+from pipeline import OutputFilter
+from pool import WinRMPool
+from routes import Route, candidate_routes, route_cache
+from utils import split_host_port
+
+# Called from the worker thread with each (stdout, stderr) chunk
+OutputCallback = Optional[Callable[[bytes, bytes], None]]
+
+# Most stdin sent per Send message; base64 in the envelope must stay under
+# the server's MaxEnvelopeSizekb (500 KB by default)
+STDIN_PIECE = 256 * 1024
+
+class CommandCancelled(Exception):
+    """A command was stopped by /cancel or by passing its deadline"""
+
+class ConnectFailed(Exception):
+    """No candidate route reached the host; the message lists each route's error"""
+
+class CancelToken:
+    """Deadline and cancel flag for one command, checked between Receive polls"""
+
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = "Command cancelled"):
+        """Ask the worker to stop; safe to call from any thread"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def timed_out(self) -> bool:
+        """True if the deadline passed without an explicit cancel"""
+        return self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check(self):
+        """Raise CommandCancelled if cancelled or past the deadline"""
+        if self._event.is_set():
+            raise CommandCancelled(self.reason)
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise CommandCancelled(f"Command timed out after {self.timeout:g}s")
 
 class WinRMClient:
-    """Wrapper for WinRM operations"""
-    
-    def __init__(self, host: str, username: str, password: str, port: int = None):
+    """Wrapper for WinRM operations over one long-lived remote shell"""
+
+    def __init__(self, host: str, username: str, password: str, port: int = None, route: Route = None):
         self.host = host
         self.username = username
         self.password = password
+        # The port asked for (part of the pool key); the route may use another
         self.port = port or config.WINRM_PORT
+        self.route = route
         self.session = None
+        self.shell_id = None
         self.is_connected = False
-    
+        self.last_used = time.time()
+        # Exception the last command failed with, for the host health registry
+        self.last_error: Optional[Exception] = None
+        # A shell runs one command at a time
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Create the WinRM session without testing it, on the host's cached route.
+
+        With no cached route (it expired, or the bot restarted) the candidate
+        routes are raced again and the winner's authenticated session is kept,
+        so a session that left out its port still finds 5986/HTTPS.
+        """
+        if self.route is None:
+            self.route = route_cache.get(self.host)
+            if self.route is None:
+                self._race()
+                return
+        self.session = winrm.Session(
+            self.route.endpoint(self.host),
+            auth=(self.username, self.password),
+            transport=self.route.transport,
+            server_cert_validation='ignore',  # For self-signed certs
+            # A Receive with no new output returns after the operation timeout,
+            # which bounds how long a cancel or deadline takes to be noticed
+            operation_timeout_sec=config.WINRM_TIMEOUT,
+            read_timeout_sec=config.WINRM_TIMEOUT + 10
+        )
+
+    def _race(self):
+        """Take over the session of whichever candidate route connects first; raises ConnectFailed"""
+        client, message = race_connect(self.host, self.username, self.password, self.port)
+        if client is None:
+            # The race already tried every route and told host_health
+            raise ConnectFailed(message)
+        route_cache.put(self.host, client.route)
+        self.route, self.session, self.shell_id = client.route, client.session, client.shell_id
+        self.is_connected = True
+
     def connect(self) -> Tuple[bool, str]:
         """Connect to Windows server via WinRM"""
+        with WINRM_CONNECT_SECONDS.time():
+            success, message = self._connect()
+        if not success:
+            WINRM_FAILURES.inc(stage='connect')
+        return success, message
+
+    def _connect(self) -> Tuple[bool, str]:
         try:
             # Create WinRM session
-            self.session = winrm.Session(
-                f"{self.host}:{self.port}",
-                auth=(self.username, self.password),
-                transport='ntlm',
-                server_cert_validation='ignore'  # For self-signed certs
-            )
-            
+            if not self.session:
+                self.open()
+
             # Test connection with whoami
             result = self.run_cmd("whoami")
             if result[2] == 0:  # Exit code 0 means success
@@ -31,35 +129,363 @@ class WinRMClient:
                 return True, "Connection successful"
             else:
                 return False, f"Connection test failed: {result[1]}"
-                
+
         except Exception as e:
             return False, f"Connection error: {str(e)}"
-    
-    def run_cmd(self, command: str) -> Tuple[str, str, int]:
-        """Execute command via CMD"""
+
+    def run_cmd(self, command: str, on_output: OutputCallback = None,
+                token: CancelToken = None, keep_stdout: bool = True) -> Tuple[str, str, int]:
+        """Execute command via CMD; raises CommandCancelled if token fires"""
         try:
-            result = self.session.run_cmd(command)
+            with WINRM_COMMAND_SECONDS.time(shell='cmd'):
+                stdout, stderr, status_code = self._execute(command, on_output, token, keep_stdout)
+            self.last_error = None
             return (
-                result.std_out.decode('utf-8', errors='ignore') if result.std_out else "",
-                result.std_err.decode('utf-8', errors='ignore') if result.std_err else "",
-                result.status_code
+                stdout.decode('utf-8', errors='ignore') if stdout else "",
+                stderr.decode('utf-8', errors='ignore') if stderr else "",
+                status_code
             )
+        except CommandCancelled:
+            count_cancelled(token)
+            raise
         except Exception as e:
+            WINRM_FAILURES.inc(stage='command')
+            self.last_error = e
             return "", f"Command execution error: {str(e)}", 1
-    
-    def run_ps(self, command: str) -> Tuple[str, str, int]:
-        """Execute PowerShell command"""
+
+    def run_ps(self, command: str, on_output: OutputCallback = None,
+               token: CancelToken = None, keep_stdout: bool = True, stdin: bytes = None) -> Tuple[str, str, int]:
+        """Execute PowerShell command; raises CommandCancelled if token fires.
+
+        stdin, if given, is sent to the command and then closed; the script
+        can read it with [Console]::In.
+        """
         try:
-            result = self.session.run_ps(command)
+            # Same encoding as winrm.Session.run_ps, but on the pooled shell
+            encoded_ps = b64encode(command.encode('utf_16_le')).decode('ascii')
+            with WINRM_COMMAND_SECONDS.time(shell='ps'):
+                stdout, stderr, status_code = self._execute(
+                    f"powershell -encodedcommand {encoded_ps}", on_output, token, keep_stdout, stdin)
+            if stderr:
+                stderr = self.session._clean_error_msg(stderr)
+            self.last_error = None
             return (
-                result.std_out.decode('utf-8', errors='ignore') if result.std_out else "",
-                result.std_err.decode('utf-8', errors='ignore') if result.std_err else "",
-                result.status_code
+                stdout.decode('utf-8', errors='ignore') if stdout else "",
+                stderr.decode('utf-8', errors='ignore') if stderr else "",
+                status_code
             )
+        except CommandCancelled:
+            count_cancelled(token)
+            raise
         except Exception as e:
+            WINRM_FAILURES.inc(stage='command')
+            self.last_error = e
             return "", f"PowerShell execution error: {str(e)}", 1
 
+    def is_alive(self) -> bool:
+        """Health check: run a no-op on the existing shell"""
+        return self.run_cmd("rem")[2] == 0
+
+    def close(self):
+        """Delete the remote shell"""
+        with self._lock:
+            self._close_shell()
+
+    def _execute(self, command: str, on_output: OutputCallback = None,
+                 token: CancelToken = None, keep_stdout: bool = True,
+                 stdin: bytes = None) -> Tuple[bytes, bytes, int]:
+        """Run a command in the open shell, reopening it once if the server dropped it"""
+        with self._lock:
+            if token:
+                # Cancelled or expired while waiting for a worker
+                token.check()
+            self.last_used = time.time()
+            # Input is piped, not typed into a console, when there is any
+            console = stdin is None
+            try:
+                command_id = self._start(self._ensure_shell(), command, console)
+            except (WinRMError, WinRMTransportError):
+                # Shell expired or was closed remotely; the command never started
+                self.shell_id = None
+                command_id = self._start(self._ensure_shell(), command, console)
+
+            failed = False
+            try:
+                if stdin is not None:
+                    self._send(command_id, stdin, token)
+                return self._receive(command_id, on_output, token, keep_stdout)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                try:
+                    # Signal/terminate: stops the process if it is still running
+                    with WINRM_REQUEST_SECONDS.time(op='signal'):
+                        self.session.protocol.cleanup_command(self.shell_id, command_id)
+                except Exception:
+                    failed = True
+                if failed:
+                    # Don't reuse a shell whose state we no longer know
+                    self._close_shell()
+
+    def _start(self, shell_id: str, command: str, console: bool = True) -> str:
+        with WINRM_REQUEST_SECONDS.time(op='command'):
+            return self.session.protocol.run_command(shell_id, command, console_mode_stdin=console)
+
+    def _send(self, command_id: str, data: bytes, token: CancelToken = None):
+        """Send data to the command's stdin in pieces, closing it with the last one"""
+        pieces = [data[i:i + STDIN_PIECE] for i in range(0, len(data), STDIN_PIECE)] or [b""]
+        for number, piece in enumerate(pieces, 1):
+            if token:
+                token.check()
+            with WINRM_REQUEST_SECONDS.time(op='send'):
+                self.session.protocol.send_command_input(self.shell_id, command_id, piece, end=number == len(pieces))
+
+    def _receive(self, command_id: str, on_output: OutputCallback = None,
+                 token: CancelToken = None, keep_stdout: bool = True) -> Tuple[bytes, bytes, int]:
+        """Poll the Receive operation, passing each chunk to on_output as it arrives.
+
+        With keep_stdout False, stdout only goes to on_output and isn't buffered.
+        """
+        protocol = self.session.protocol
+        stdout, stderr = [], []
+        while True:
+            if token:
+                token.check()
+            try:
+                with WINRM_REQUEST_SECONDS.time(op='receive'):
+                    out, err, status_code, done = protocol._raw_get_command_output(self.shell_id, command_id)
+            except WinRMOperationTimeoutError:
+                # Nothing new within the operation timeout; keep polling
+                continue
+            if keep_stdout:
+                stdout.append(out)
+            stderr.append(err)
+            if on_output and (out or err):
+                on_output(out, err)
+            if done:
+                return b''.join(stdout), b''.join(stderr), status_code
+
+    def _ensure_shell(self) -> str:
+        if not self.shell_id:
+            with WINRM_REQUEST_SECONDS.time(op='create'):
+                self.shell_id = self.session.protocol.open_shell(idle_timeout=config.SESSION_TTL)
+        return self.shell_id
+
+    def _close_shell(self):
+        shell_id, self.shell_id = self.shell_id, None
+        if shell_id:
+            try:
+                self.session.protocol.close_shell(shell_id)
+            except Exception:
+                pass
+
+def count_cancelled(token: CancelToken = None):
+    """Count a stopped command as a timeout or a cancel"""
+    if token is not None and token.timed_out:
+        WINRM_TIMEOUTS.inc()
+    else:
+        WINRM_CANCELLED.inc()
+
+# Global pool of authenticated clients keyed by (host, port, username)
+winrm_pool = WinRMPool(WinRMClient)
+
+def _pool_clients():
+    stats = winrm_pool.stats()
+    return {('idle',): stats['idle'], ('in_use',): stats['size'] - stats['idle']}
+
+registry.gauge('winrm_pool_clients', "Pooled WinRM clients by state", ['state'], _pool_clients)
+registry.counter('winrm_pool_reuse_total', "Pool acquires that reused (hit) or opened (miss) a client",
+                 ['result'], lambda: {('hit',): winrm_pool.hits, ('miss',): winrm_pool.misses})
+
 def test_connection(host: str, username: str, password: str, port: int = None) -> Tuple[bool, str]:
-    """Test WinRM connection"""
-    client = WinRMClient(host, username, password, port)
-    return client.connect()
\ No newline at end of file
+    """Test WinRM connection on the host's cached route, or race the candidate routes"""
+    host, port = split_host_port(host, port)
+    rejected = host_health.rejected_login(host, username, password)
+    if rejected:
+        return False, rejected
+    if route_cache.get(host) is None:
+        client, message = race_connect(host, username, password, port)
+        if client is None:
+            return False, message
+        route_cache.put(host, client.route)
+        # Keep the authenticated client for the commands that follow
+        winrm_pool.adopt(client)
+        return True, message
+
+    try:
+        client = winrm_pool.acquire(host, username, password, port)
+    except Exception as e:
+        return False, f"Connection error: {str(e)}"
+    success, message = client.connect()
+    report_health(client)
+    winrm_pool.release(client, discard=not success)
+    if not success:
+        # Race again next time in case the server moved; not right away,
+        # since a wrong password would then fail once per route
+        route_cache.forget(host)
+    return success, message
+
+def race_connect(host: str, username: str, password: str, port: int = None,
+                 routes: List[Route] = None, delay: float = None) -> Tuple[Optional['WinRMClient'], str]:
+    """Connect over whichever candidate route works first (happy eyeballs).
+
+    Attempts start `delay` seconds apart, or at once when every earlier one
+    has failed. The first success wins; attempts not started yet are skipped
+    and those still in flight are closed when they finish. Returns
+    (client, message), or (None, every route's error) if none worked.
+    """
+    routes = routes or candidate_routes(port)
+    delay = config.WINRM_RACE_DELAY if delay is None else delay
+    results: queue.Queue = queue.Queue()
+    won = threading.Event()
+
+    def attempt(route: Route):
+        client = WinRMClient(host, username, password, port, route)
+        if won.is_set():
+            results.put((client, False, "skipped"))
+            return
+        try:
+            success, message = client.connect()
+        except Exception as e:
+            success, message = False, f"Connection error: {str(e)}"
+        results.put((client, success, message))
+
+    started, finished, errors, failures = 0, 0, [], []
+    next_start = time.monotonic()
+    while finished < len(routes):
+        now = time.monotonic()
+        if started < len(routes) and (started == finished or now >= next_start):
+            threading.Thread(target=attempt, args=(routes[started],), name="winrm-race", daemon=True).start()
+            started += 1
+            next_start = now + delay
+        try:
+            timeout = max(0.0, next_start - time.monotonic()) if started < len(routes) else None
+            client, success, message = results.get(timeout=timeout)
+        except queue.Empty:
+            continue
+        finished += 1
+        if success:
+            won.set()
+            host_health.record_success(host)
+            if started > finished:
+                threading.Thread(target=_close_losers, args=(results, started - finished),
+                                 name="winrm-race-close", daemon=True).start()
+            return client, f"{message} via {client.route}"
+        errors.append(f"{client.route}: {message}")
+        failures.append(client.last_error)
+        client.close()
+    record_race_failure(host, username, password, failures)
+    return None, "; ".join(errors)
+
+def record_race_failure(host: str, username: str, password: str, failures: List[Optional[Exception]]):
+    """Tell the host health registry that every route of a race failed"""
+    # A rejected login means the host is up; the circuit only counts unreachable hosts
+    rejected = next((error for error in failures if classify(error) == AUTH), None)
+    if rejected is not None or all(classify(error) == CONNECT for error in failures):
+        host_health.record_error(host, rejected or failures[0], username, password)
+
+def report_health(client: 'WinRMClient'):
+    """Tell the host health registry how the client's last command went"""
+    host_health.record_error(client.host, client.last_error, client.username, client.password)
+
+def _close_losers(results: queue.Queue, count: int):
+    for _ in range(count):
+        client, _, _ = results.get()
+        client.close()
+
+def run_command(host: str, username: str, password: str, port: int, command: str,
+                powershell: bool = False, on_output: OutputCallback = None,
+                token: CancelToken = None, output_filter: OutputFilter = None,
+                stdin: bytes = None, compress: bool = None) -> Tuple[str, str, int]:
+    """Run a command on a pooled client; raises CommandCancelled if token fires.
+
+    An output_filter (see pipeline.py) is applied to stdout as it arrives, so
+    only the lines it keeps are buffered or passed on to on_output. A command
+    given stdin always runs as PowerShell. compress gzips stdout on the server
+    (see compression.py); None decides from WINRM_COMPRESS, and never for
+    live output.
+    """
+    host, port = split_host_port(host, port)
+    address = f"{host}:{port}"
+    # Anything that might change the server makes its cached results stale
+    result_cache.invalidate_if_mutating(address, command)
+    if compress is None:
+        compress = on_output is None and stdin is None and output_sizes.should_compress(address, command, powershell)
+    compressed = build_compressed_command(command, powershell) if compress else None
+    with winrm_pool.connection(host, username, password, port) as client:
+        run = client.run_ps if powershell else client.run_cmd
+        if stdin is not None:
+            result = client.run_ps(command, on_output, token, stdin=stdin)
+        elif compressed is not None:
+            result = _run_compressed(client.run_ps, compressed, output_filter, on_output, token)
+        elif output_filter is None:
+            result = run(command, on_output, token)
+        else:
+            result = _run_filtered(run, command, output_filter, on_output, token)
+        report_health(client)
+        failed = client.last_error is not None
+    if stdin is None and not failed:
+        output_sizes.record(address, command, powershell, len(result[0]) + len(result[1]))
+    return result
+
+def _run_filtered(run: Callable, command: str, output_filter: OutputFilter,
+                  on_output: OutputCallback = None, token: CancelToken = None) -> Tuple[str, str, int]:
+    kept = []
+
+    def filtered(stdout: bytes, stderr: bytes):
+        text = output_filter.feed(stdout) if stdout else ""
+        kept.append(text)
+        if on_output and (text or stderr):
+            on_output(text.encode('utf-8'), stderr)
+
+    _, stderr, exit_code = run(command, filtered, token, keep_stdout=False)
+    rest = output_filter.finish()
+    if on_output and rest:
+        on_output(rest.encode('utf-8'), b"")
+    return ''.join(kept) + rest, stderr, exit_code
+
+def _run_compressed(run_ps: Callable, script: str, output_filter: OutputFilter = None,
+                    on_output: OutputCallback = None, token: CancelToken = None) -> Tuple[str, str, int]:
+    decoder = GzipDecoder()
+    kept = []
+
+    def decoded(stdout: bytes, stderr: bytes):
+        data = decoder.feed(stdout) if stdout else b""
+        if output_filter is not None:
+            data = output_filter.feed(data).encode('utf-8')
+        kept.append(data)
+        if on_output and (data or stderr):
+            on_output(data, stderr)
+
+    _, stderr, exit_code = run_ps(script, decoded, token, keep_stdout=False)
+    rest = decoder.finish()
+    if output_filter is not None:
+        rest = (output_filter.feed(rest) + output_filter.finish()).encode('utf-8')
+    if on_output and rest:
+        on_output(rest, b"")
+    return b''.join(kept + [rest]).decode('utf-8', errors='ignore'), stderr, exit_code
+
+def run_script(host: str, username: str, password: str, port: int, commands: List[Tuple[str, bool]],
+               stop_on_error: bool = True, token: CancelToken = None) -> List[Tuple[str, str, str, int]]:
+    """Run (command, is_powershell) pairs in order on one pooled shell.
+
+    Returns (command, stdout, stderr, exit_code) for each command that ran; a
+    cancelled or timed-out command ends the script with its reason as stderr.
+    """
+    host, port = split_host_port(host, port)
+    results = []
+    with winrm_pool.connection(host, username, password, port) as client:
+        for command, powershell in commands:
+            result_cache.invalidate_if_mutating(f"{host}:{port}", command)
+            try:
+                run = client.run_ps if powershell else client.run_cmd
+                stdout, stderr, exit_code = run(command, token=token)
+            except CommandCancelled as e:
+                results.append((command, "", str(e), 1))
+                break
+            results.append((command, stdout, stderr, exit_code))
+            if exit_code != 0 and stop_on_error:
+                break
+        report_health(client)
+    return results